@@ -1,25 +1,225 @@
-from flask import Blueprint, render_template, abort
+"""Admin pages: keyset-paged user and auction lists and streaming exports.
+
+The lists page like the public listings, by a (sort column, id) cursor, so
+a deep page costs the same as the first. Exports stream users, auctions or
+bids through exports.py with the same filters as the lists.
+
+Admin rights are granted from the command line:
+
+    python admin.py grant <username>
+    python admin.py revoke <username>
+"""
+import logging
+import sys
+from datetime import datetime
+
+from flask import Blueprint, Response, abort, render_template, request, stream_with_context
 from flask_login import login_required, current_user
-from models import User, Auction
+from sqlalchemy import Float, and_, case, cast, func, select, tuple_, update
+from sqlalchemy.orm import selectinload
+
+from config import Config
+from models import User, Auction, AuctionType, Bid
+from db import db_session
+import cluster
+import exports
+import ledger
+
+logger = logging.getLogger(__name__)
 
 admin = Blueprint('admin', __name__)
 
+# Sort name -> (column, parser of the cursor value).
+USER_SORTS = {
+    'id': (User.id, int),
+    'username': (func.coalesce(User.username, ''), str),
+}
+AUCTION_SORTS = {
+    'id': (Auction.id, int),
+    'end_time': (Auction.end_time, datetime.fromisoformat),
+    'price': (Auction.current_price, float),
+    'title': (Auction.title, str),
+    'bids': (Auction.bid_count, int),
+}
+
+
 @admin.before_request
 @login_required
 def require_admin():
     if not current_user.is_admin:
         abort(403)
 
+
+def encode_cursor(value, row_id):
+    value = value.isoformat() if isinstance(value, datetime) else repr(value) if isinstance(value, float) else value
+    return f"{value}_{row_id}"
+
+
+def decode_cursor(cursor, parse):
+    if not cursor:
+        return None
+    try:
+        value, row_id = cursor.rsplit('_', 1)
+        return parse(value), int(row_id)
+    except ValueError:
+        return None
+
+
+def keyset_page(stmt, id_column, sorts, default_sort, default_order):
+    """One page of `stmt` in the order asked for by the request, and the next page's cursor."""
+    sort = request.args.get('sort') if request.args.get('sort') in sorts else default_sort
+    order = request.args.get('order') if request.args.get('order') in ('asc', 'desc') else default_order
+    column, parse = sorts[sort]
+    after = decode_cursor(request.args.get('after'), parse)
+    key = tuple_(column, id_column)
+    if order == 'asc':
+        if after:
+            stmt = stmt.where(key > tuple_(*after))
+        stmt = stmt.order_by(column.asc(), id_column.asc())
+    else:
+        if after:
+            stmt = stmt.where(key < tuple_(*after))
+        stmt = stmt.order_by(column.desc(), id_column.desc())
+
+    limit = Config.ADMIN_PAGE_SIZE
+    rows = db_session.execute(stmt.add_columns(column.label('sort_key')).limit(limit + 1)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last.sort_key, last[0].id)
+    return [row[0] for row in rows[:limit]], next_cursor, sort, order
+
+
+def _flag(value):
+    return {'yes': True, 'no': False}.get(value)
+
+
+def user_filters(args):
+    conditions = []
+    if args.get('q'):
+        conditions.append(User.username.contains(args['q'], autoescape=True) | (User.telegram_id == args['q']))
+    if _flag(args.get('admin')) is not None:
+        conditions.append(User.is_admin == _flag(args['admin']))
+    if _flag(args.get('active')) is not None:
+        conditions.append(User.is_active == _flag(args['active']))
+    return conditions
+
+
+def auction_filters(args):
+    conditions = []
+    if args.get('q'):
+        conditions.append(Auction.title.contains(args['q'], autoescape=True))
+    if args.get('type') in AuctionType.__members__:
+        conditions.append(Auction.auction_type == AuctionType[args['type']])
+    if args.get('status') in ('active', 'ended'):
+        conditions.append(Auction.is_active == (args['status'] == 'active'))
+    if args.get('creator', '').isdigit():
+        conditions.append(Auction.creator_id == int(args['creator']))
+    return conditions
+
+
+def bid_filters(args):
+    conditions = []
+    if args.get('auction', '').isdigit():
+        conditions.append(Bid.auction_id == int(args['auction']))
+    if args.get('bidder', '').isdigit():
+        conditions.append(Bid.bidder_id == int(args['bidder']))
+    return conditions
+
+
+def _xtr(minor):
+    return cast(minor, Float) / ledger.MINOR_UNITS
+
+
+def users_export(args):
+    balance, held = ledger.totals(User.id)
+    return select(
+        User.id, User.username, User.telegram_id, User.is_active, User.is_admin,
+        _xtr(balance).label('balance'), _xtr(held).label('held'),
+    ).where(*user_filters(args)).order_by(User.id)
+
+
+def auctions_export(args):
+    return select(
+        Auction.id, Auction.title, Auction.auction_type, Auction.pricing_rule, Auction.creator_id,
+        Auction.starting_price, Auction.current_price, Auction.bid_count,
+        Auction.start_time, Auction.end_time, Auction.is_active,
+    ).where(*auction_filters(args)).order_by(Auction.id)
+
+
+def bids_export(args):
+    # Amounts on running sealed lots stay hidden here too.
+    sealed = and_(Auction.auction_type == AuctionType.CLOSED, Auction.is_active == True)
+    return select(
+        Bid.id, Bid.auction_id, Bid.bidder_id, case((sealed, None), else_=Bid.amount).label('amount'), Bid.timestamp,
+    ).join(Auction, Auction.id == Bid.auction_id).where(*bid_filters(args)).order_by(Bid.id)
+
+
+EXPORTS = {
+    'users': users_export,
+    'auctions': auctions_export,
+    'bids': bids_export,
+}
+
+
 @admin.route('/admin')
 def dashboard():
     return render_template('admin/dashboard.html')
 
 @admin.route('/admin/users')
 def users():
-    users = User.query.all()
-    return render_template('admin/users.html', users=users)
+    users, next_cursor, sort, order = keyset_page(
+        select(User).where(*user_filters(request.args)), User.id, USER_SORTS, 'id', 'asc'
+    )
+    balances = ledger.balances(db_session, [user.id for user in users])
+    return render_template('admin/users.html', users=users, balances=balances,
+                           next_cursor=next_cursor, sort=sort, order=order)
 
 @admin.route('/admin/auctions')
 def auctions():
-    auctions = Auction.query.all()
-    return render_template('admin/auctions.html', auctions=auctions)
+    auctions, next_cursor, sort, order = keyset_page(
+        select(Auction).where(*auction_filters(request.args)).options(selectinload(Auction.creator)),
+        Auction.id, AUCTION_SORTS, 'id', 'desc'
+    )
+    return render_template('admin/auctions.html', auctions=auctions, auction_types=AuctionType,
+                           next_cursor=next_cursor, sort=sort, order=order)
+
+@admin.route('/admin/export/<kind>')
+def export(kind):
+    if kind not in EXPORTS:
+        abort(404)
+    fmt = request.args.get('format', 'csv')
+    if fmt not in exports.MIMETYPES:
+        abort(400)
+    result = db_session.execute(EXPORTS[kind](request.args), execution_options={'yield_per': Config.EXPORT_CHUNK_SIZE})
+    body = exports.chunks(fmt, list(result.keys()), result.partitions())
+    filename = f"{kind}-{datetime.utcnow():%Y%m%d-%H%M%S}.{fmt}"
+    logger.info(f"Admin {current_user.id} exporting {kind} as {fmt}")
+    return Response(stream_with_context(body), mimetype=exports.MIMETYPES[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+def set_admin(session, user_id, is_admin):
+    """Grants or revokes admin rights; the caller commits."""
+    session.execute(update(User).where(User.id == user_id).values(is_admin=is_admin))
+
+
+def main(argv):
+    if len(argv) != 2 or argv[0] not in ('grant', 'revoke'):
+        print(__doc__)
+        return 2
+    user = db_session.query(User).filter(User.username == argv[1]).first()
+    if user is None:
+        print(f"No user named {argv[1]}")
+        return 1
+    set_admin(db_session, user.id, argv[0] == 'grant')
+    # This process has no relay; web processes hear about it when this commits.
+    cluster.announce_user_change(db_session, user.id)
+    db_session.commit()
+    print(f"{user.username}: is_admin={user.is_admin}")
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv[1:]))
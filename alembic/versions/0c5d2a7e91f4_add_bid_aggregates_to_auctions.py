@@ -0,0 +1,43 @@
+"""add bid aggregates to auctions
+
+Revision ID: 0c5d2a7e91f4
+Revises: 6ae873d0d155
+Create Date: 2026-10-18 11:48:12.530917
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0c5d2a7e91f4'
+down_revision: Union[str, None] = '6ae873d0d155'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('auctions', sa.Column('highest_bid_id', sa.Integer(), nullable=True))
+    op.add_column('auctions', sa.Column('highest_bid_amount', sa.Float(), nullable=True))
+    op.add_column('auctions', sa.Column('bid_count', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('auctions', sa.Column('last_bid_at', sa.DateTime(), nullable=True))
+
+    # Backfill from the bids table; ties on amount go to the earliest bid.
+    op.execute("""
+        UPDATE auctions SET
+            highest_bid_id = (SELECT b.id FROM bids b WHERE b.auction_id = auctions.id
+                              ORDER BY b.amount DESC, b.id LIMIT 1),
+            highest_bid_amount = (SELECT max(b.amount) FROM bids b WHERE b.auction_id = auctions.id),
+            bid_count = (SELECT count(*) FROM bids b WHERE b.auction_id = auctions.id),
+            last_bid_at = (SELECT max(b.timestamp) FROM bids b WHERE b.auction_id = auctions.id)
+        WHERE EXISTS (SELECT 1 FROM bids b WHERE b.auction_id = auctions.id)
+    """)
+
+
+def downgrade() -> None:
+    op.drop_column('auctions', 'last_bid_at')
+    op.drop_column('auctions', 'bid_count')
+    op.drop_column('auctions', 'highest_bid_amount')
+    op.drop_column('auctions', 'highest_bid_id')
@@ -0,0 +1,64 @@
+"""add indexes for hot queries and a primary key on watchlist
+
+Revision ID: 6ae873d0d155
+Revises: db36039dd332
+Create Date: 2026-10-18 11:02:53.407119
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6ae873d0d155'
+down_revision: Union[str, None] = 'db36039dd332'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Built outside the migration transaction so Postgres can build them
+    # CONCURRENTLY without locking writes on bids/auctions.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_bids_auction_id_amount', 'bids',
+                        ['auction_id', sa.text('amount DESC')], postgresql_concurrently=True)
+        op.create_index('ix_bids_auction_id_timestamp', 'bids',
+                        ['auction_id', sa.text('timestamp DESC')], postgresql_concurrently=True)
+        op.create_index('ix_bids_bidder_id', 'bids', ['bidder_id'], postgresql_concurrently=True)
+        op.create_index('ix_auctions_active_end_time', 'auctions', ['end_time', 'id'],
+                        postgresql_where=sa.text('is_active'), sqlite_where=sa.text('is_active = 1'),
+                        postgresql_concurrently=True)
+        op.create_index('ix_auctions_inactive_end_time', 'auctions', ['end_time', 'id'],
+                        postgresql_where=sa.text('NOT is_active'), sqlite_where=sa.text('is_active = 0'),
+                        postgresql_concurrently=True)
+        op.create_index('ix_auctions_creator_id', 'auctions', ['creator_id'], postgresql_concurrently=True)
+
+    # The primary key needs the existing rows to be complete and unique first.
+    op.execute('DELETE FROM watchlist WHERE user_id IS NULL OR auction_id IS NULL')
+    op.execute('CREATE TABLE watchlist_dedup AS SELECT DISTINCT user_id, auction_id FROM watchlist')
+    op.execute('DELETE FROM watchlist')
+    op.execute('INSERT INTO watchlist (user_id, auction_id) SELECT user_id, auction_id FROM watchlist_dedup')
+    op.execute('DROP TABLE watchlist_dedup')
+
+    with op.batch_alter_table('watchlist') as batch_op:
+        batch_op.alter_column('user_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.alter_column('auction_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_primary_key('watchlist_pkey', ['user_id', 'auction_id'])
+    op.create_index(op.f('ix_watchlist_auction_id'), 'watchlist', ['auction_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_watchlist_auction_id'), table_name='watchlist')
+    with op.batch_alter_table('watchlist') as batch_op:
+        batch_op.drop_constraint('watchlist_pkey', type_='primary')
+        batch_op.alter_column('auction_id', existing_type=sa.Integer(), nullable=True)
+        batch_op.alter_column('user_id', existing_type=sa.Integer(), nullable=True)
+
+    op.drop_index('ix_auctions_creator_id', table_name='auctions')
+    op.drop_index('ix_auctions_inactive_end_time', table_name='auctions')
+    op.drop_index('ix_auctions_active_end_time', table_name='auctions')
+    op.drop_index('ix_bids_bidder_id', table_name='bids')
+    op.drop_index('ix_bids_auction_id_timestamp', table_name='bids')
+    op.drop_index('ix_bids_auction_id_amount', table_name='bids')
@@ -0,0 +1,58 @@
+"""add balance holds
+
+Revision ID: 7d41be0c3a92
+Revises: 0c5d2a7e91f4
+Create Date: 2026-10-18 12:31:05.214860
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d41be0c3a92'
+down_revision: Union[str, None] = '0c5d2a7e91f4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('balance_holds',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('auction_id', sa.Integer(), nullable=False),
+    sa.Column('amount', sa.Float(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['auction_id'], ['auctions.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'auction_id')
+    )
+    op.create_index(op.f('ix_balance_holds_auction_id'), 'balance_holds', ['auction_id'], unique=False)
+    op.add_column('users', sa.Column('xtr_held', sa.Float(), nullable=False, server_default='0'))
+
+    # Open bids placed before holds existed: the leading bid of every running
+    # lot, and each bidder's largest sealed bid on running Closed lots.
+    op.execute("""
+        INSERT INTO balance_holds (user_id, auction_id, amount, updated_at)
+        SELECT b.bidder_id, b.auction_id, b.amount, CURRENT_TIMESTAMP
+        FROM auctions a JOIN bids b ON b.id = a.highest_bid_id
+        WHERE a.is_active AND a.auction_type != 'CLOSED' AND b.bidder_id IS NOT NULL
+    """)
+    op.execute("""
+        INSERT INTO balance_holds (user_id, auction_id, amount, updated_at)
+        SELECT b.bidder_id, b.auction_id, max(b.amount), CURRENT_TIMESTAMP
+        FROM auctions a JOIN bids b ON b.auction_id = a.id
+        WHERE a.is_active AND a.auction_type = 'CLOSED' AND b.bidder_id IS NOT NULL
+        GROUP BY b.bidder_id, b.auction_id
+    """)
+    op.execute("""
+        UPDATE users SET xtr_held = (SELECT sum(h.amount) FROM balance_holds h WHERE h.user_id = users.id)
+        WHERE EXISTS (SELECT 1 FROM balance_holds h WHERE h.user_id = users.id)
+    """)
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'xtr_held')
+    op.drop_index(op.f('ix_balance_holds_auction_id'), table_name='balance_holds')
+    op.drop_table('balance_holds')
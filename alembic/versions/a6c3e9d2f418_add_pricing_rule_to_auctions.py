@@ -0,0 +1,45 @@
+"""add a pricing rule to auctions
+
+Revision ID: a6c3e9d2f418
+Revises: f93b1d7a2c55
+Create Date: 2026-10-18 14:41:05.218934
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a6c3e9d2f418'
+down_revision: Union[str, None] = 'f93b1d7a2c55'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+pricing_rule = sa.Enum('FIRST_PRICE', 'SECOND_PRICE', name='pricingrule')
+
+
+def upgrade() -> None:
+    pricing_rule.create(op.get_bind(), checkfirst=True)
+    op.add_column('auctions', sa.Column('pricing_rule', pricing_rule, nullable=False, server_default='FIRST_PRICE'))
+
+    # Running sealed lots no longer track a leader; sealed.resolve() picks
+    # one when they close.
+    op.execute("""
+        UPDATE auctions SET highest_bid_id = NULL, highest_bid_amount = NULL
+        WHERE auction_type = 'CLOSED' AND is_active
+    """)
+
+
+def downgrade() -> None:
+    op.execute("""
+        UPDATE auctions SET
+            highest_bid_id = (SELECT b.id FROM bids b WHERE b.auction_id = auctions.id
+                              ORDER BY b.amount DESC, b.id LIMIT 1),
+            highest_bid_amount = (SELECT max(b.amount) FROM bids b WHERE b.auction_id = auctions.id)
+        WHERE auction_type = 'CLOSED' AND is_active
+    """)
+    with op.batch_alter_table('auctions') as batch_op:
+        batch_op.drop_column('pricing_rule')
+    pricing_rule.drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,72 @@
+"""derive dutch price from start_time
+
+Revision ID: b983e368c18d
+Revises: 4fed39e028d1
+Create Date: 2026-10-18 10:20:41.118204
+
+"""
+import math
+from datetime import datetime, timedelta
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b983e368c18d'
+down_revision: Union[str, None] = '4fed39e028d1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+auctions = sa.table('auctions',
+    sa.column('id', sa.Integer),
+    sa.column('auction_type', sa.String),
+    sa.column('starting_price', sa.Float),
+    sa.column('current_dutch_price', sa.Float),
+    sa.column('dutch_price_decrement', sa.Float),
+    sa.column('dutch_interval', sa.Integer),
+    sa.column('start_time', sa.DateTime),
+    sa.column('end_time', sa.DateTime),
+)
+
+
+def upgrade() -> None:
+    op.add_column('auctions', sa.Column('start_time', sa.DateTime(), nullable=True))
+
+    now = datetime.utcnow()
+    conn = op.get_bind()
+    conn.execute(auctions.update().values(start_time=now))
+
+    # Back-date the start of running Dutch lots so the derived price equals
+    # the last price written by the old periodic job, and cap their end_time
+    # at the moment the price reaches zero.
+    dutch_rows = conn.execute(
+        sa.select(
+            auctions.c.id, auctions.c.starting_price, auctions.c.current_dutch_price,
+            auctions.c.dutch_price_decrement, auctions.c.dutch_interval, auctions.c.end_time,
+        ).where(auctions.c.auction_type == 'DUTCH')
+    ).all()
+    for row in dutch_rows:
+        if not row.dutch_price_decrement or not row.dutch_interval:
+            continue
+        current_price = row.current_dutch_price if row.current_dutch_price is not None else row.starting_price
+        intervals_passed = max(0, round((row.starting_price - current_price) / row.dutch_price_decrement))
+        start_time = now - timedelta(seconds=intervals_passed * row.dutch_interval)
+        zero_price_time = start_time + timedelta(
+            seconds=math.ceil(row.starting_price / row.dutch_price_decrement) * row.dutch_interval
+        )
+        conn.execute(
+            auctions.update().where(auctions.c.id == row.id).values(
+                start_time=start_time,
+                end_time=min(row.end_time, zero_price_time),
+            )
+        )
+
+    op.drop_column('auctions', 'current_dutch_price')
+
+
+def downgrade() -> None:
+    op.add_column('auctions', sa.Column('current_dutch_price', sa.Float(), nullable=True))
+    op.drop_column('auctions', 'start_time')
@@ -0,0 +1,27 @@
+"""add is_admin to users
+
+Revision ID: c18d4f7b2e90
+Revises: a6c3e9d2f418
+Create Date: 2026-10-18 15:20:44.106273
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c18d4f7b2e90'
+down_revision: Union[str, None] = 'a6c3e9d2f418'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('is_admin', sa.Boolean(), nullable=False, server_default=sa.false()))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('is_admin')
@@ -0,0 +1,27 @@
+"""add version to auctions
+
+Revision ID: d5b7e1a09c36
+Revises: c18d4f7b2e90
+Create Date: 2026-10-18 17:02:13.518420
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5b7e1a09c36'
+down_revision: Union[str, None] = 'c18d4f7b2e90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('auctions', sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('auctions') as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,79 @@
+"""add xtr ledger and balance snapshots
+
+Revision ID: e2f8a4c61b07
+Revises: 7d41be0c3a92
+Create Date: 2026-10-18 13:14:37.902115
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2f8a4c61b07'
+down_revision: Union[str, None] = '7d41be0c3a92'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('ledger_entries',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=16), nullable=False),
+    sa.Column('balance_delta', sa.BigInteger(), nullable=False),
+    sa.Column('held_delta', sa.BigInteger(), nullable=False),
+    sa.Column('auction_id', sa.Integer(), nullable=True),
+    sa.Column('reference', sa.String(length=128), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['auction_id'], ['auctions.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_ledger_entries_user_id_id', 'ledger_entries', ['user_id', 'id'], unique=False)
+    op.create_index('uq_ledger_entries_topup_reference', 'ledger_entries', ['reference'], unique=True,
+                    postgresql_where=sa.text("kind = 'topup'"), sqlite_where=sa.text("kind = 'topup'"))
+    op.create_table('balance_snapshots',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('balance', sa.BigInteger(), nullable=False),
+    sa.Column('held', sa.BigInteger(), nullable=False),
+    sa.Column('last_entry_id', sa.Integer(), nullable=False),
+    sa.Column('taken_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+    # Carry the current balances over as one opening entry per user (in
+    # hundredths of an XTR) and snapshot them, then drop the mutable columns.
+    op.execute("""
+        INSERT INTO ledger_entries (user_id, kind, balance_delta, held_delta, created_at)
+        SELECT id, 'opening', CAST(round(COALESCE(xtr_balance, 0) * 100) AS BIGINT),
+               CAST(round(xtr_held * 100) AS BIGINT), CURRENT_TIMESTAMP
+        FROM users
+        WHERE COALESCE(xtr_balance, 0) != 0 OR xtr_held != 0
+    """)
+    op.execute("""
+        INSERT INTO balance_snapshots (user_id, balance, held, last_entry_id, taken_at)
+        SELECT user_id, balance_delta, held_delta, id, created_at FROM ledger_entries
+    """)
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('xtr_held')
+        batch_op.drop_column('xtr_balance')
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('xtr_balance', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('xtr_held', sa.Float(), nullable=False, server_default='0'))
+    op.execute("""
+        UPDATE users SET
+            xtr_balance = (SELECT sum(e.balance_delta) FROM ledger_entries e WHERE e.user_id = users.id) / 100.0,
+            xtr_held = (SELECT sum(e.held_delta) FROM ledger_entries e WHERE e.user_id = users.id) / 100.0
+        WHERE EXISTS (SELECT 1 FROM ledger_entries e WHERE e.user_id = users.id)
+    """)
+    op.drop_table('balance_snapshots')
+    op.drop_index('uq_ledger_entries_topup_reference', table_name='ledger_entries')
+    op.drop_index('ix_ledger_entries_user_id_id', table_name='ledger_entries')
+    op.drop_table('ledger_entries')
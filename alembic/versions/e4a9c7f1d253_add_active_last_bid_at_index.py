@@ -0,0 +1,29 @@
+"""add active last_bid_at index
+
+Revision ID: e4a9c7f1d253
+Revises: d5b7e1a09c36
+Create Date: 2026-10-18 18:11:37.402957
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4a9c7f1d253'
+down_revision: Union[str, None] = 'd5b7e1a09c36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_auctions_active_last_bid_at', 'auctions', ['last_bid_at'],
+                        postgresql_where=sa.text('is_active'), sqlite_where=sa.text('is_active = 1'),
+                        postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_auctions_active_last_bid_at', table_name='auctions')
@@ -0,0 +1,58 @@
+"""fold ledger snapshots by writing transaction
+
+Revision ID: f7c2b9e4a1d6
+Revises: e4a9c7f1d253
+Create Date: 2026-10-18 21:04:12.518730
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f7c2b9e4a1d6'
+down_revision: Union[str, None] = 'e4a9c7f1d253'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('ledger_entries', sa.Column('txid', sa.BigInteger(), nullable=True))
+    op.drop_index('ix_ledger_entries_user_id_id', table_name='ledger_entries')
+    op.create_index('ix_ledger_entries_user_id_sequence', 'ledger_entries',
+                    ['user_id', sa.text('coalesce(txid, id)')], unique=False)
+    with op.batch_alter_table('balance_snapshots') as batch_op:
+        batch_op.alter_column('last_entry_id', new_column_name='last_sequence',
+                              existing_type=sa.Integer(), type_=sa.BigInteger(), existing_nullable=False)
+
+    if op.get_bind().dialect.name == 'postgresql':
+        # Existing entries sort before every transaction from now on, and the
+        # snapshots are rebuilt to cover all of them. ADD COLUMN holds off
+        # ledger writes until this commits.
+        op.execute("UPDATE ledger_entries SET txid = 0")
+        op.execute("ALTER TABLE ledger_entries ALTER COLUMN txid SET DEFAULT txid_current()")
+        op.execute("DELETE FROM balance_snapshots")
+        op.execute("""
+            INSERT INTO balance_snapshots (user_id, balance, held, last_sequence, taken_at)
+            SELECT user_id, sum(balance_delta), sum(held_delta), 0, CURRENT_TIMESTAMP
+            FROM ledger_entries GROUP BY user_id
+        """)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        # Transaction ids don't map back to entry ids: fold everything.
+        op.execute("DELETE FROM balance_snapshots")
+        op.execute("""
+            INSERT INTO balance_snapshots (user_id, balance, held, last_sequence, taken_at)
+            SELECT user_id, sum(balance_delta), sum(held_delta), max(id), CURRENT_TIMESTAMP
+            FROM ledger_entries GROUP BY user_id
+        """)
+    with op.batch_alter_table('balance_snapshots') as batch_op:
+        batch_op.alter_column('last_sequence', new_column_name='last_entry_id',
+                              existing_type=sa.BigInteger(), type_=sa.Integer(), existing_nullable=False)
+    op.drop_index('ix_ledger_entries_user_id_sequence', table_name='ledger_entries')
+    op.create_index('ix_ledger_entries_user_id_id', 'ledger_entries', ['user_id', 'id'], unique=False)
+    op.drop_column('ledger_entries', 'txid')
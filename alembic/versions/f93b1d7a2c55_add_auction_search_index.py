@@ -0,0 +1,38 @@
+"""add a full-text search index on auctions
+
+Revision ID: f93b1d7a2c55
+Revises: e2f8a4c61b07
+Create Date: 2026-10-18 14:02:11.530472
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f93b1d7a2c55'
+down_revision: Union[str, None] = 'e2f8a4c61b07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Must stay identical to models.auction_search_document.
+SEARCH_DOCUMENT = (
+    "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'B')"
+)
+
+
+def upgrade() -> None:
+    # SQLite searches an in-process index (see search.py).
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    with op.get_context().autocommit_block():
+        op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_auctions_search ON auctions USING gin (({SEARCH_DOCUMENT}))')
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    with op.get_context().autocommit_block():
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_auctions_search')
@@ -1,51 +1,105 @@
+import argparse
 import os
 import logging
 from datetime import datetime, timedelta
-from flask import Flask, render_template, redirect, url_for, flash, abort, request, jsonify
+from flask import Blueprint, Flask, Response, render_template, redirect, url_for, flash, abort, request, jsonify
 from flask_login import LoginManager, login_required, current_user
-from flask_migrate import Migrate
 from config import Config
-from models import User, Auction, Subscriber, Bid, AuctionType
+from models import User, Auction, Subscriber, Bid, AuctionType, PricingRule, dutch_end_time
 from auth import auth
 from admin import admin
 from telegram_bot import setup_bot, send_notification
-from db import db_session, init_db, engine
+from telegram import Update
+from notifications import dispatcher
+from watch_alerts import watch_alerts
+from db import WORKLOADS, db_session, on_engine_created, async_session, dispose_async_engine
+from bid_engine import bid_engine
+from live import live_broker
+from principals import user_cache
+from asgi import AsgiDispatcher
+import bid_history
+import cluster
+import escrow
+import health
+import ledger
+import listing
+import metrics
+import query_budget
+import search
+import sealed
+import watchlists
+from close_scheduler import CloseScheduler
+from sqlalchemy import select, update
+from sqlalchemy.orm import joinedload, selectinload
 from forms import AuctionForm, BidForm
 import asyncio
 from hypercorn.asyncio import serve
 from hypercorn.config import Config as HyperConfig
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
-app = Flask(__name__)
-app.config.from_object(Config)
-
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-login_manager = LoginManager(app)
+login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
 
-migrate = Migrate(app, db_session)
+pages = Blueprint('pages', __name__)
 
 @login_manager.user_loader
 def load_user(user_id):
-    return db_session.get(User, int(user_id))
-
-app.register_blueprint(auth)
-app.register_blueprint(admin)
-
-with app.app_context():
-    init_db()
-
-@app.route('/')
+    return user_cache.get(int(user_id))
+
+def create_app(config=Config):
+    """Builds the Flask app.
+
+    Connects to nothing and creates no tables: the engine is created by the
+    first query and the schema is Alembic's. Cheap enough to call per test.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config)
+    login_manager.init_app(app)
+    metrics.instrument_app(app)
+    # Per engine, not per app: instrumented once, whenever it's created.
+    on_engine_created(metrics.instrument_engine)
+    on_engine_created(query_budget.instrument_engine)
+    app.register_blueprint(pages)
+    app.register_blueprint(auth)
+    app.register_blueprint(admin)
+    app.teardown_appcontext(shutdown_session)
+    return app
+
+@pages.route('/')
+@query_budget.budget(4)
 def index():
-    active_auctions = Auction.query.filter_by(is_active=True).all()
-    inactive_auctions = Auction.query.filter_by(is_active=False).all()
+    active_after = request.args.get('active_after')
+    inactive_after = request.args.get('inactive_after')
+    active_html, active_next = listing.render_section(listing.ACTIVE, active_after)
+    inactive_html, inactive_next = listing.render_section(listing.INACTIVE, inactive_after)
     return render_template('index.html',
-                           active_auctions=active_auctions,
-                           inactive_auctions=inactive_auctions)
-
-@app.route('/create_auction', methods=['GET', 'POST'])
+                           active_html=active_html,
+                           active_next=active_next,
+                           active_after=active_after,
+                           inactive_html=inactive_html,
+                           inactive_next=inactive_next,
+                           inactive_after=inactive_after)
+
+@pages.route('/search')
+def search_results():
+    text = request.args.get('q', '').strip()
+    auction_type = AuctionType.__members__.get(request.args.get('type', ''))
+    status = request.args.get('status', '')
+    is_active = {'active': True, 'ended': False}.get(status)
+    cursor = request.args.get('after')
+    results, next_cursor = search.search_page(text, auction_type, is_active, cursor) if text else ([], None)
+    return render_template('search.html',
+                           auction_types=AuctionType,
+                           q=text,
+                           auction_type=auction_type,
+                           status=status,
+                           results=results,
+                           next_cursor=next_cursor)
+
+@pages.route('/create_auction', methods=['GET', 'POST'])
 @login_required
 def create_auction():
     form = AuctionForm()
@@ -58,241 +112,326 @@ def create_auction():
             current_price=form.starting_price.data,
             end_time=form.end_time.data,
             is_active=True,
-            creator=current_user,
+            creator_id=current_user.id,
             auction_type=auction_type
         )
         
         if auction_type == AuctionType.DUTCH:
-            new_auction.current_dutch_price = form.starting_price.data
+            new_auction.start_time = datetime.utcnow()
             new_auction.dutch_price_decrement = form.dutch_price_decrement.data
             new_auction.dutch_interval = form.dutch_interval.data
+            # The lot expires when its price reaches zero; close_auctions picks it up then.
+            zero_price_time = dutch_end_time(
+                new_auction.starting_price,
+                new_auction.dutch_price_decrement,
+                new_auction.dutch_interval,
+                new_auction.start_time,
+            )
+            if zero_price_time and zero_price_time < new_auction.end_time:
+                new_auction.end_time = zero_price_time
         elif auction_type == AuctionType.EVERLASTING:
-            new_auction.end_time = datetime.utcnow() + timedelta(years=100)  # Set a very far future date
+            new_auction.end_time = datetime.utcnow() + timedelta(days=365 * 100)  # Set a very far future date
         elif auction_type == AuctionType.CLOSED:
-            new_auction.current_price = None  # Hide current price for closed auctions
+            # current_price stays at the starting price until sealed.resolve() sets it.
+            new_auction.pricing_rule = PricingRule[form.pricing_rule.data]
         
         db_session.add(new_auction)
+        db_session.flush()
+        if auction_type != AuctionType.EVERLASTING:
+            # Reaches the scheduler leader, wherever it runs, when this commits.
+            cluster.announce_deadline(db_session, new_auction.id, new_auction.end_time)
         db_session.commit()
+        close_scheduler.schedule(new_auction.id, new_auction.end_time, auction_type)
+        listing.invalidate_new_auction()
         flash('Your auction has been created!', 'success')
-        return redirect(url_for('index'))
+        return redirect(url_for('pages.index'))
     return render_template('create_auction.html', title='Create Auction', form=form)
 
-@app.route('/auction/<int:auction_id>', methods=['GET', 'POST'])
+@pages.route('/auction/<int:auction_id>', methods=['GET', 'POST'])
+@query_budget.budget(8)
 def auction_detail(auction_id):
-    auction = db_session.get(Auction, auction_id)
+    auction = db_session.get(Auction, auction_id, options=[joinedload(Auction.creator)])
     if auction is None:
         abort(404)
 
     bid_form = BidForm()
 
+    is_xhr = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
     if bid_form.validate_on_submit():
-        if not auction.is_active:
-            flash('This auction has ended. Bidding is no longer allowed.', 'warning')
-        else:
-            bid_amount = bid_form.amount.data
-            user = current_user
-
-            if not user.is_authenticated:
-                flash('Please log in to place a bid.', 'warning')
-                return redirect(url_for('auth.login'))
-
-            if auction.auction_type == AuctionType.DUTCH:
-                if bid_amount != auction.current_dutch_price:
-                    flash('For Dutch auctions, you must accept the current price.', 'danger')
-                else:
-                    # End the auction immediately for Dutch auctions
-                    auction.is_active = False
-                    auction.current_price = bid_amount
-                    new_bid = Bid(amount=bid_amount, bidder=user, auction=auction)
-                    db_session.add(new_bid)
-                    db_session.commit()
-                    flash('Congratulations! You won the Dutch auction!', 'success')
-            elif auction.auction_type == AuctionType.CLOSED:
-                # For closed auctions, we don't update the current price
-                if bid_amount <= auction.starting_price:
-                    flash('Your bid must be higher than the starting price.', 'danger')
-                elif user.xtr_balance < bid_amount:
-                    flash('You don\'t have enough XTR for this bid.', 'danger')
-                else:
-                    new_bid = Bid(amount=bid_amount, bidder=user, auction=auction)
-                    db_session.add(new_bid)
-                    db_session.commit()
-                    flash('Your bid has been placed successfully!', 'success')
-            elif auction.auction_type == AuctionType.ENGLISH:
-                if bid_amount <= auction.current_price:
-                    flash('Your bid must be higher than the current price.', 'danger')
-                elif user.xtr_balance < bid_amount:
-                    flash('You don\'t have enough XTR for this bid.', 'danger')
-                else:
-                    auction.current_price = bid_amount
-                    new_bid = Bid(amount=bid_amount, bidder=user, auction=auction)
-                    db_session.add(new_bid)
-                    db_session.commit()
-                    flash('Your bid has been successfully placed!', 'success')
-            elif auction.auction_type == AuctionType.EVERLASTING:
-                if bid_amount <= auction.current_price:
-                    flash('Your bid must be higher than the current price.', 'danger')
-                elif user.xtr_balance < bid_amount:
-                    flash('You don\'t have enough XTR for this bid.', 'danger')
-                else:
-                    auction.current_price = bid_amount
-                    new_bid = Bid(amount=bid_amount, bidder=user, auction=auction)
-                    db_session.add(new_bid)
-                    db_session.commit()
-                    flash('Your bid has been successfully placed!', 'success')
-
-            return redirect(url_for('auction_detail', auction_id=auction_id))
-
-    bids = db_session.query(Bid).filter_by(auction_id=auction_id).order_by(Bid.amount.desc()).all()
+        if not current_user.is_authenticated:
+            if is_xhr:
+                return jsonify({'success': False, 'error': 'Please log in to place a bid.'}), 401
+            flash('Please log in to place a bid.', 'warning')
+            return redirect(url_for('auth.login'))
+
+        user_id, username = current_user.id, current_user.username
+        # Hand the connection back to the pool while the bid engine works.
+        db_session.close()
+        result = bid_engine.place_bid(auction_id, user_id, username, bid_form.amount.data)
+        if is_xhr:
+            # The bid history itself reaches the page through the live stream.
+            return jsonify({
+                'success': result.accepted,
+                'new_price': result.current_price,
+                'message': result.message,
+                'error': None if result.accepted else result.message,
+            })
+        flash(result.message, result.category)
+        return redirect(url_for('pages.auction_detail', auction_id=auction_id))
+    elif is_xhr and request.method == 'POST':
+        errors = [error for field_errors in bid_form.errors.values() for error in field_errors]
+        return jsonify({'success': False, 'error': ' '.join(errors) or 'Invalid bid.'}), 400
+
+    bids = db_session.query(Bid).filter_by(auction_id=auction_id).options(joinedload(Bid.bidder))
+    # Ordering sealed bids by amount would give away the ranking.
+    bids = bids.order_by(Bid.timestamp.desc() if auction.bids_sealed else Bid.amount.desc()).all()
+
+    watching = current_user.is_authenticated and watchlists.is_watching(db_session, current_user.id, auction_id)
 
     return render_template('auction_detail.html',
                            auction=auction,
                            bids=bids,
-                           bid_form=bid_form)
+                           bid_form=bid_form,
+                           watching=watching)
 
-@app.route('/api/auction/<int:auction_id>/bids')
+@pages.route('/api/auction/<int:auction_id>/bids')
+@query_budget.budget(4)
 def get_auction_bids(auction_id):
-    auction = Auction.query.filter_by(id=auction_id).first()
-    if auction is None:
+    version = bid_history.current_version(db_session, auction_id)
+    if version is None:
         return jsonify({'error': 'Auction not found'}), 404
-    bids = Bid.query.filter_by(auction_id=auction_id).order_by(Bid.timestamp.desc()).limit(10).all()
-    
-    bid_history_html = render_template('bid_history.html', bids=bids)
-    
-    return jsonify({
-        'current_price': auction.current_price,
-        'bid_history_html': bid_history_html
-    })
-
-@app.route('/watchlist')
+    if request.if_none_match.contains(bid_history.etag(auction_id, version)):
+        response = Response(status=304)
+    else:
+        data, version = bid_history.payload(db_session, auction_id, version)
+        if data is None:
+            return jsonify({'error': 'Auction not found'}), 404
+        response = jsonify(data)
+    response.set_etag(bid_history.etag(auction_id, version))
+    # Lets the browser keep the body but ask again on every poll.
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@pages.route('/watchlist')
 @login_required
 def watchlist():
-    return render_template('watchlist.html', auctions=current_user.watchlist)
+    return render_template('watchlist.html', auctions=watchlists.watched_auctions(db_session, current_user.id))
 
-@app.route('/profile')
+@pages.route('/profile')
 @login_required
 def profile():
-    return render_template('profile.html')
+    balance, held = ledger.balance_of(db_session, current_user.id)
+    return render_template('profile.html', balance=balance, held=held)
 
-@app.route('/add_to_watchlist/<int:auction_id>', methods=['POST'])
+@pages.route('/add_to_watchlist/<int:auction_id>', methods=['POST'])
 @login_required
 def add_to_watchlist(auction_id):
-    auction = db_session.get(Auction, auction_id)
-    if auction and auction not in current_user.watchlist:
-        current_user.watchlist.append(auction)
-        db_session.commit()
-        return jsonify({'success': True, 'message': 'Auction added to watchlist.'}), 200
-    else:
-        return jsonify({'success': False, 'message': 'Auction already in watchlist or does not exist.'}), 400
-
-@app.route('/remove_from_watchlist/<int:auction_id>', methods=['POST'])
+    if not watchlists.add(db_session, current_user.id, auction_id):
+        # Nothing inserted: already watched, or no such auction.
+        if db_session.get(Auction, auction_id) is None:
+            return jsonify({'success': False, 'message': 'Auction does not exist.'}), 404
+    db_session.commit()
+    return jsonify({'success': True, 'watching': True, 'message': 'Auction added to watchlist.'}), 200
+
+@pages.route('/remove_from_watchlist/<int:auction_id>', methods=['POST'])
 @login_required
 def remove_from_watchlist(auction_id):
-    auction = db_session.get(Auction, auction_id)
-    if auction and auction in current_user.watchlist:
-        current_user.watchlist.remove(auction)
-        db_session.commit()
-        return jsonify({'success': True, 'message': 'Auction removed from watchlist.'}), 200
-    else:
-        return jsonify({'success': False, 'message': 'Auction not found in your watchlist.'}), 404
+    watchlists.remove(db_session, current_user.id, auction_id)
+    db_session.commit()
+    return jsonify({'success': True, 'watching': False, 'message': 'Auction removed from watchlist.'}), 200
 
-@app.errorhandler(404)
+@pages.route('/api/watchlist/flags')
+def watched_flags():
+    """Which of the given auctions (?ids=1,2,3) the user watches, for a listing page."""
+    try:
+        auction_ids = [int(i) for i in request.args.get('ids', '').split(',') if i][:watchlists.MAX_FLAG_IDS]
+    except ValueError:
+        return jsonify({'error': 'ids must be comma-separated integers'}), 400
+    if not current_user.is_authenticated:
+        return jsonify({'watched': []})
+    watched = watchlists.watched_ids(db_session, current_user.id, auction_ids)
+    return jsonify({'watched': sorted(watched)})
+
+@pages.app_errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
 
-@app.errorhandler(500)
+@pages.app_errorhandler(500)
 def internal_error(error):
     db_session.rollback()
     return render_template('errors/500.html'), 500
 
-@app.teardown_appcontext
 def shutdown_session(exception=None):
     db_session.remove()
 
-async def close_auctions():
-    current_time = datetime.utcnow()
-    logger.info(f"Running close_auctions at {current_time}")
-    try:
-        ended_auctions = db_session.query(Auction).filter(
-            Auction.end_time <= current_time, Auction.is_active == True).all()
-
-        logger.info(f"Found {len(ended_auctions)} auctions to close")
+async def close_auctions(auction_ids):
+    """Closes a batch of lots that reached their deadline, in one transaction.
 
-        if not ended_auctions:
-            logger.info("No auctions to close at this time")
-            return
-
-        for auction in ended_auctions:
-            if auction.auction_type == AuctionType.EVERLASTING:
-                continue  # Skip everlasting auctions
-
-            auction.is_active = False
-            logger.info(f"Closing auction {auction.id}: {auction.title}")
-
-            if auction.bids:
-                winning_bid = max(auction.bids, key=lambda bid: bid.amount)
-                winner = winning_bid.bidder
-                await send_notification(
-                    winner.telegram_id,
-                    f"Congratulations! You won the auction '{auction.title}' with a bid of {winning_bid.amount} XTR."
-                )
-                await send_notification(
-                    auction.creator.telegram_id,
-                    f"Your auction '{auction.title}' has ended. Winner: {winner.username} with a bid of {winning_bid.amount} XTR."
-                )
-            else:
-                await send_notification(
-                    auction.creator.telegram_id,
-                    f"Your auction '{auction.title}' has ended without any bids."
-                )
-
-            db_session.commit()
-            logger.info(f"Auction {auction.id} closed successfully")
-
-        logger.info(f"Closed {len(ended_auctions)} auctions")
-
-    except Exception as e:
-        logger.error(f"Error in close_auctions: {str(e)}")
-        db_session.rollback()
-
-async def update_dutch_auctions():
-    logger.info("Starting update_dutch_auctions")
+    If the batch fails, the lots are retried one at a time so one bad lot
+    can't hold back the others. Returns the ids that could not be closed.
+    """
+    logger.info(f"Closing {len(auction_ids)} auctions")
     try:
-        with db_session.begin():
-            current_time = datetime.utcnow()
-            dutch_auctions = db_session.query(Auction).filter(
-                Auction.is_active == True,
-                Auction.auction_type == AuctionType.DUTCH
-            ).all()
-
-            for auction in dutch_auctions:
-                time_elapsed = (current_time - auction.end_time).total_seconds()
-                intervals_passed = int(time_elapsed / auction.dutch_interval)
-                new_price = max(0, auction.starting_price - (intervals_passed * auction.dutch_price_decrement))
-                
-                if new_price <= 0:
-                    auction.is_active = False
-                    logger.info(f"Dutch auction {auction.id} ended without a winner")
-                else:
-                    auction.current_dutch_price = new_price
-
-            db_session.commit()
-            logger.info(f"Updated {len(dutch_auctions)} Dutch auctions")
+        closed = await _close_batch(auction_ids)
     except Exception as e:
-        db_session.rollback()
-        logger.error(f'Error in update_dutch_auctions: {str(e)}')
-
-async def main():
-    bot_application = setup_bot()
+        if len(auction_ids) == 1:
+            logger.error(f"Error closing auction {auction_ids[0]}: {str(e)}")
+            return auction_ids
+        logger.error(f"Error closing a batch of {len(auction_ids)} auctions, retrying one by one: {str(e)}")
+        failed = []
+        for auction_id in auction_ids:
+            failed += await close_auctions([auction_id])
+        return failed
+    metrics.JOB_ROWS.inc('close_auctions', amount=len(closed))
+
+    for lot in closed:
+        _announce_close(*lot)
+    return []
+
+@metrics.timed_job('close_auctions')
+async def _close_batch(auction_ids):
+    async with async_session('scheduler') as session:
+        # Locked in id order before their holds are touched, the order the bid engine uses too.
+        await session.execute(
+            select(Auction.id).where(Auction.id.in_(sorted(auction_ids))).order_by(Auction.id).with_for_update()
+        )
+        # Only the first closer wins; a lot already closed (e.g. a Dutch lot
+        # that was accepted) or pushed back is left alone.
+        closed_ids = (await session.execute(
+            update(Auction)
+            .where(Auction.id.in_(auction_ids), Auction.is_active == True, Auction.end_time <= datetime.utcnow())
+            .values(is_active=False, version=Auction.version + 1)
+            .returning(Auction.id)
+            .execution_options(synchronize_session=False)
+        )).scalars().all()
+        if not closed_ids:
+            return []
+
+        auctions = (await session.execute(
+            select(Auction).where(Auction.id.in_(closed_ids)).options(selectinload(Auction.creator))
+        )).scalars().all()
+        resolutions = await session.run_sync(
+            sealed.resolve, [auction for auction in auctions if auction.auction_type == AuctionType.CLOSED]
+        )
+        winning_bid_ids = [
+            resolutions[auction.id].winning_bid_id if auction.id in resolutions else auction.highest_bid_id
+            for auction in auctions
+        ]
+        winning_bids = {bid.id: bid for bid in (await session.execute(
+            select(Bid)
+            .where(Bid.id.in_([bid_id for bid_id in winning_bid_ids if bid_id is not None]))
+            .options(selectinload(Bid.bidder))
+        )).scalars()}
+
+        closed = []
+        for auction, winning_bid_id in zip(auctions, winning_bid_ids):
+            final_price = auction.current_price
+            winner = None
+            settlement = escrow.settle_statements(auction.id)
+            winning_bid = winning_bids.get(winning_bid_id)
+            if winning_bid:
+                price = resolutions[auction.id].price if auction.id in resolutions else winning_bid.amount
+                final_price = price
+                winner = (winning_bid.bidder.telegram_id, winning_bid.bidder.username, winning_bid.amount, price)
+                settlement = escrow.settle_statements(auction.id, winning_bid.bidder_id, price, auction.creator_id)
+            # The winner pays the creator from their hold; the other holds are released.
+            for statement in settlement:
+                await session.execute(statement)
+            closed.append((auction.id, auction.title, final_price, auction.creator.telegram_id, winner))
+        await session.commit()
+    return closed
+
+def _announce_close(auction_id, title, final_price, creator_telegram_id, winner):
+    bid_engine.evict(auction_id)
+    listing.invalidate_closed_auction(auction_id)
+    live_broker.publish(auction_id, 'closed', {'current_price': final_price})
+
+    if winner:
+        winner_telegram_id, winner_username, winning_amount, price = winner
+        # Second-price sealed lots charge the winner less than their bid.
+        payment = f" Under second-price rules the winner pays {price} XTR." if price != winning_amount else ""
+        send_notification(
+            winner_telegram_id,
+            f"Congratulations! You won the auction '{title}' with a bid of {winning_amount} XTR.{payment}"
+        )
+        send_notification(
+            creator_telegram_id,
+            f"Your auction '{title}' has ended. Winner: {winner_username} with a bid of {winning_amount} XTR.{payment}"
+        )
+    else:
+        send_notification(
+            creator_telegram_id,
+            f"Your auction '{title}' has ended without any bids."
+        )
+    logger.info(f"Auction {auction_id} closed successfully")
+
+close_scheduler = CloseScheduler(close_auctions)
+
+def schedule_announced_deadline(payload):
+    auction_id, end_time = cluster.parse_deadline(payload)
+    close_scheduler.schedule(auction_id, end_time)
+
+async def main(roles=None):
+    roles = roles or cluster.parse_roles(Config.ROLES)
+    if Config.BOT_MODE == 'webhook' and 'bot' in roles:
+        # Updates arrive on the web server and are queued in this process.
+        if 'web' not in roles:
+            raise ValueError("BOT_MODE=webhook needs the bot and web roles in the same process")
+        if not Config.TELEGRAM_WEBHOOK_SECRET:
+            raise ValueError("BOT_MODE=webhook needs TELEGRAM_WEBHOOK_SECRET")
+    logging.info(f"Starting with roles: {', '.join(sorted(roles))}")
+    # The scheduler role needs a bot too, to notify winners.
+    bot_application = setup_bot() if roles & {'bot', 'scheduler'} else None
     scheduler = AsyncIOScheduler()
-    scheduler.add_job(close_auctions, 'interval', minutes=1)
-    scheduler.add_job(update_dutch_auctions, 'interval', seconds=10)  # Update Dutch auctions every 10 seconds
-    scheduler.start()
+    scheduler.add_job(metrics.timed_job('close_scheduler_resync')(close_scheduler.resync), 'interval', minutes=5)
+    scheduler.add_job(metrics.timed_job('ledger_snapshots')(ledger.take_snapshots_async),
+                      'interval', minutes=Config.LEDGER_SNAPSHOT_MINUTES)
+    scheduler.add_job(metrics.timed_job('ledger_reconcile')(ledger.reconcile_async),
+                      'interval', hours=Config.LEDGER_RECONCILE_HOURS)
+    scheduler.add_job(metrics.timed_job('watch_alerts')(watch_alerts.run),
+                      'interval', seconds=Config.WATCH_ALERT_WINDOW)
+    election = cluster.LeaderElection(Config.SCHEDULER_LOCK_KEY, Config.LEADER_RETRY_SECONDS)
+    leader_tasks = []
+
+    async def on_elected():
+        # Not from where this process left off: another leader ran the jobs since.
+        watch_alerts.reset()
+        leader_tasks.append(asyncio.ensure_future(close_scheduler.run()))
+        if cluster.is_postgres():
+            deadlines = cluster.PgChannel(cluster.DEADLINES_CHANNEL, schedule_announced_deadline)
+            leader_tasks.append(asyncio.ensure_future(deadlines.run()))
+        if scheduler.running:
+            scheduler.resume()
+        else:
+            scheduler.start()
+
+    async def on_demoted():
+        scheduler.pause()
+        for task in leader_tasks:
+            task.cancel()
+        await asyncio.gather(*leader_tasks, return_exceptions=True)
+        leader_tasks.clear()
 
     async def start_bot():
         await bot_application.initialize()
+        dispatcher.start(bot_application.bot)
+        if 'bot' not in roles:
+            return
         await bot_application.start()
-        await bot_application.updater.start_polling()
+        if Config.BOT_MODE != 'webhook':
+            await bot_application.updater.start_polling()
+        elif Config.TELEGRAM_WEBHOOK_URL:
+            await bot_application.bot.set_webhook(
+                Config.TELEGRAM_WEBHOOK_URL,
+                secret_token=Config.TELEGRAM_WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=Config.BOT_UPDATE_CONCURRENCY,
+            )
+            logging.info(f"Receiving bot updates at {Config.TELEGRAM_WEBHOOK_URL}")
+        else:
+            # Nothing registered with Telegram: updates only come from local POSTs.
+            logging.info(f"Webhook not registered; accepting updates on {Config.TELEGRAM_WEBHOOK_PATH}")
 
     async def start_app():
         config = HyperConfig()
@@ -300,18 +439,45 @@ async def main():
             f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5000')}"
         ]
         config.use_reloader = False
-        await serve(app, config)
+        await serve(AsgiDispatcher(create_app()), config)
+
+    tasks = [asyncio.Event().wait()]  # keeps a bot-only process alive
+    if bot_application:
+        tasks.append(start_bot())
+    if 'web' in roles:
+        # Serves at once; /readyz passes when the pools are warm.
+        tasks.append(start_app())
+        # The pool of each workload this process runs: its role names are the workload names.
+        tasks.append(health.warm_up(tuple(workload for workload in WORKLOADS if workload in roles)))
+    if 'scheduler' in roles:
+        tasks.append(election.run(on_elected, on_demoted))
+    if cluster.is_postgres() and roles & {'web', 'scheduler'}:
+        # Live events from the other processes, e.g. bids taken by another web worker.
+        tasks.append(cluster.EventRelay(live_broker).run())
+    if cluster.is_postgres() and 'web' in roles:
+        tasks.append(cluster.PrincipalRelay(user_cache).run())
 
     try:
-        await asyncio.gather(start_bot(), start_app())
+        await asyncio.gather(*tasks)
     except asyncio.CancelledError:
         logging.info("Tasks were cancelled")
     except Exception as e:
         logging.error(f"Error in main function: {e}")
     finally:
-        await bot_application.shutdown()
-        scheduler.shutdown()
+        await dispatcher.stop()
+        if bot_application:
+            if bot_application.updater.running:
+                await bot_application.updater.stop()
+            if bot_application.running:
+                await bot_application.stop()
+            await bot_application.shutdown()
+        if scheduler.running:
+            scheduler.shutdown()
+        await dispose_async_engine()
         logging.info("Application shutdown complete")
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--role', default=Config.ROLES,
+                        help="comma-separated roles to run: web, bot, scheduler (default: all, or $ROLES)")
+    asyncio.run(main(cluster.parse_roles(parser.parse_args().role)))
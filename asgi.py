@@ -0,0 +1,205 @@
+import asyncio
+import hmac
+import json
+import logging
+import re
+from functools import partial
+
+from hypercorn.app_wrappers import WSGIWrapper
+from telegram import Update
+
+from config import Config
+from live import live_broker
+import health
+import metrics
+import telegram_bot
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = 15  # seconds
+MAX_UPDATE_SIZE = 1024 * 1024  # bytes; Telegram updates are far smaller
+
+# Long-lived or async-native endpoints served directly on the event loop;
+# everything else goes to the Flask app in hypercorn's WSGI thread pool.
+routes = []
+
+
+def route(pattern):
+    def decorator(handler):
+        routes.append((re.compile(pattern), handler))
+        return handler
+    return decorator
+
+
+class AsgiDispatcher:
+    def __init__(self, wsgi_app, max_body_size=16 * 1024 * 1024):
+        self.wsgi = WSGIWrapper(wsgi_app, max_body_size)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+
+        if scope['type'] == 'http':
+            for pattern, handler in routes:
+                match = pattern.fullmatch(scope['path'])
+                if match:
+                    await handler(scope, receive, send, **match.groupdict())
+                    return
+
+        loop = asyncio.get_running_loop()
+        await self.wsgi(scope, receive, send, partial(loop.run_in_executor, None), partial(_call_soon, loop))
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def _call_soon(loop, func, *args):
+    return asyncio.run_coroutine_threadsafe(func(*args), loop).result()
+
+
+def _header(scope, name):
+    for key, value in scope.get('headers', []):
+        if key == name:
+            return value.decode('latin1')
+    return None
+
+
+async def _respond(send, status, body=b'', content_type=b'text/plain; charset=utf-8'):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type)],
+    })
+    await send({'type': 'http.response.body', 'body': body, 'more_body': False})
+
+
+async def _read_body(receive, limit):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if len(body) > limit:
+            return None
+        if not message.get('more_body', False):
+            return body
+
+
+@route(re.escape(Config.TELEGRAM_WEBHOOK_PATH))
+async def telegram_webhook(scope, receive, send):
+    """Takes bot updates from Telegram in webhook mode.
+
+    The update is queued for the bot application, which processes it
+    concurrently with others (see ChatOrderedUpdateProcessor), so Telegram
+    gets its 200 without waiting for the handler.
+    """
+    if scope['method'] != 'POST':
+        await _respond(send, 405)
+        return
+    secret = Config.TELEGRAM_WEBHOOK_SECRET
+    token = _header(scope, b'x-telegram-bot-api-secret-token') or ''
+    if not secret or not hmac.compare_digest(token.encode(), secret.encode()):
+        await _respond(send, 403)
+        return
+    application = telegram_bot.application
+    if Config.BOT_MODE != 'webhook' or application is None or not application.running:
+        await _respond(send, 503, b'bot is not receiving webhook updates')
+        return
+
+    body = await _read_body(receive, MAX_UPDATE_SIZE)
+    if body is None:
+        await _respond(send, 413)
+        return
+    try:
+        update = Update.de_json(json.loads(body), application.bot)
+    except (ValueError, TypeError, KeyError) as e:
+        logger.warning(f"Rejected malformed webhook update: {str(e)}")
+        await _respond(send, 400)
+        return
+    await application.update_queue.put(update)
+    await _respond(send, 200)
+
+
+@route(r'/metrics')
+async def metrics_endpoint(scope, receive, send):
+    """This process's metrics for Prometheus; needs METRICS_TOKEN as a bearer token if it is set."""
+    token = Config.METRICS_TOKEN
+    if token and not hmac.compare_digest((_header(scope, b'authorization') or '').encode(), f"Bearer {token}".encode()):
+        await _respond(send, 401)
+        return
+    await _respond(send, 200, metrics.render().encode(), b'text/plain; version=0.0.4; charset=utf-8')
+
+
+@route(r'/livez')
+async def liveness(scope, receive, send):
+    await _respond(send, 200, b'ok')
+
+
+@route(r'/readyz')
+async def readiness(scope, receive, send):
+    """503 until the database pools are warm, and whenever the database stops answering."""
+    ready, reason = await health.readiness()
+    await _respond(send, 200 if ready else 503, reason.encode())
+
+
+@route(r'/api/auction/(?P<auction_id>\d+)/stream')
+async def auction_stream(scope, receive, send, auction_id):
+    last_event_id = _header(scope, b'last-event-id')
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ],
+    })
+
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        async with live_broker.subscribe(int(auction_id), last_event_id) as (reset, backlog, queue):
+            if reset:
+                await _send_chunk(send, b'event: reset\ndata: {}\n\n')
+            for event in backlog:
+                await _send_chunk(send, event.payload)
+
+            while not disconnected.done():
+                getter = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait(
+                    {getter, disconnected},
+                    timeout=HEARTBEAT_INTERVAL,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if getter not in done:
+                    getter.cancel()
+                    if not disconnected.done():
+                        await _send_chunk(send, b': heartbeat\n\n')
+                    continue
+                event = getter.result()
+                if event is None:
+                    break
+                await _send_chunk(send, event.payload)
+    finally:
+        disconnected.cancel()
+
+    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def _send_chunk(send, body):
+    await send({'type': 'http.response.body', 'body': body, 'more_body': True})
@@ -3,6 +3,7 @@ from flask_login import login_user, logout_user, login_required, current_user
 from models import User
 from sqlalchemy import select
 from db import db_session
+from principals import user_cache
 import hmac
 import hashlib
 from config import Config
@@ -33,9 +34,11 @@ def telegram_auth():
         user = User(telegram_id=user_id, username=username, is_active=True)
         db_session.add(user)
         db_session.commit()
+    # Logging in again picks up any change the cache hasn't heard about.
+    user_cache.invalidate(user.id)
     login_user(user)
 
-    return redirect(url_for('index'))
+    return redirect(url_for('pages.index'))
 
 
 @auth.route('/logout')
@@ -47,7 +50,7 @@ def logout():
         logger.info(f"User logged out: {user_id}")
     else:
         logger.info("Logout attempted for already logged out user")
-    return redirect(url_for('index'))
+    return redirect(url_for('pages.index'))
 
 
 def validate_telegram_auth(auth_data):
@@ -0,0 +1,435 @@
+"""Load test for bidding, listing, search and closing.
+
+Seeds a throwaway database (BENCH_DATABASE_URL, a temporary SQLite file by
+default; point it at a scratch Postgres database for production-like numbers),
+drives the Flask app from concurrent client threads with Telegram stubbed out,
+and reports throughput and latency per endpoint, the time it takes to
+close a backlog of expired lots, and how long a new process takes to be
+ready for traffic.
+
+    python benchmark.py
+    python benchmark.py --auctions 20000 --threads 32 --json results.json
+    python benchmark.py --compare results.json   # exit 1 on a regression
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+_default_url = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'tauction_benchmark.db')}"
+BENCH_DATABASE_URL = os.environ.get('BENCH_DATABASE_URL', _default_url)
+os.environ.setdefault('DATABASE_URL', BENCH_DATABASE_URL)
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '0:benchmark')
+
+from sqlalchemy import create_engine, insert, select
+
+import app as app_module
+import consistency
+from db import Base, db_session, get_engine
+import ledger
+from models import Auction, AuctionType, Bid, LedgerEntry, PricingRule, User
+from close_scheduler import CLOSE_BATCH_SIZE
+from notifications import TokenBucket, dispatcher
+
+# Lot titles draw on this vocabulary so searches match a realistic share of lots.
+WORDS = ['vintage', 'rare', 'signed', 'gold', 'silver', 'watch', 'coin', 'stamp', 'poster', 'vinyl',
+         'camera', 'lamp', 'book', 'print', 'card', 'figure', 'sticker', 'badge', 'mug', 'ticket']
+
+
+class StubBot:
+    """Stands in for telegram.Bot; records what would have been sent."""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        self.sent.append((chat_id, text))
+
+
+app = app_module.create_app()
+
+
+def seed(users, auctions, bids_per_auction, closing):
+    """Creates the schema and bulk-loads the benchmark data set."""
+    engine = get_engine()
+    if engine.dialect.name == 'sqlite':
+        # Same file, but a separate engine so the drop doesn't wait on the pool.
+        with create_engine(BENCH_DATABASE_URL).begin() as conn:
+            Base.metadata.drop_all(conn)
+    else:
+        Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {'id': i, 'username': f'user{i}', 'telegram_id': str(i)}
+            for i in range(1, users + 1)
+        ])
+        conn.execute(insert(LedgerEntry), [
+            {'user_id': i, 'kind': ledger.OPENING, 'balance_delta': ledger.to_minor(10 ** 9), 'held_delta': 0}
+            for i in range(1, users + 1)
+        ])
+        lots = []
+        for i in range(1, auctions + 1):
+            auction_type = rng.choice([AuctionType.ENGLISH, AuctionType.ENGLISH, AuctionType.DUTCH,
+                                       AuctionType.CLOSED, AuctionType.EVERLASTING])
+            lot = {
+                'id': i,
+                'title': f"Lot {i} {' '.join(rng.sample(WORDS, 2))}",
+                'description': f"Benchmark lot, {' '.join(rng.sample(WORDS, 4))}",
+                'starting_price': 1000,
+                'current_price': 1000,
+                'start_time': now,
+                'end_time': now + timedelta(days=7),
+                'is_active': True,
+                'creator_id': rng.randint(1, users),
+                'auction_type': auction_type,
+            }
+            if auction_type == AuctionType.DUTCH:
+                lot.update(dutch_price_decrement=1, dutch_interval=60)
+            lots.append(lot)
+        # Already past their deadline, for the closing benchmark; a third of
+        # them sealed, to be resolved at the close.
+        for i in range(auctions + 1, auctions + closing + 1):
+            lots.append({
+                'id': i,
+                'title': f'Expired lot {i}',
+                'description': 'Benchmark lot',
+                'starting_price': 1,
+                'current_price': 1,
+                'start_time': now - timedelta(days=1),
+                'end_time': now - timedelta(seconds=1),
+                'is_active': True,
+                'creator_id': rng.randint(1, users),
+                'auction_type': AuctionType.CLOSED if i % 3 == 0 else AuctionType.ENGLISH,
+                'pricing_rule': PricingRule.SECOND_PRICE if i % 6 == 0 else PricingRule.FIRST_PRICE,
+            })
+        conn.execute(insert(Auction), lots)
+        conn.execute(insert(Bid), [
+            {
+                'auction_id': auction_id,
+                'bidder_id': rng.randint(1, users),
+                'amount': rng.uniform(1, 999),
+                'timestamp': now - timedelta(seconds=rng.randint(0, 10 ** 5)),
+            }
+            for auction_id in range(1, auctions + closing + 1)
+            for _ in range(bids_per_auction)
+        ])
+    consistency.recompute_aggregates()
+    db_session.remove()
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def drive(name, threads, requests, make_request):
+    """Runs `requests` calls of make_request(client, thread_index, n) across `threads` clients."""
+    counter = itertools.count()
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+
+    def worker(thread_index):
+        client = app.test_client()
+        local = []
+        while True:
+            n = next(counter)
+            if n >= requests:
+                break
+            started = time.perf_counter()
+            ok = make_request(client, thread_index, n)
+            local.append(time.perf_counter() - started)
+            if not ok:
+                with lock:
+                    failures.append(n)
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(worker, range(threads)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        'name': name,
+        'requests': len(latencies),
+        'failures': len(failures),
+        'seconds': elapsed,
+        'per_second': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'mean_ms': statistics.fmean(latencies) * 1000,
+    }
+
+
+def bench_bids(args):
+    app.config['WTF_CSRF_ENABLED'] = False
+    # A small hot set, so bids contend the way they do on a popular lot.
+    hot = db_session.execute(
+        select(Auction.id)
+        .where(Auction.auction_type.in_([AuctionType.ENGLISH, AuctionType.EVERLASTING]),
+               Auction.id <= args.auctions)
+        .order_by(Auction.id)
+        .limit(args.hot_auctions)
+    ).scalars().all()
+    db_session.remove()
+    amounts = itertools.count(10 ** 6)
+    logged_in = {}
+
+    def place_bid(client, thread_index, n):
+        if thread_index not in logged_in:
+            with client.session_transaction() as session:
+                session['_user_id'] = str(thread_index % args.users + 1)
+                session['_fresh'] = True
+            logged_in[thread_index] = True
+        response = client.post(f'/auction/{hot[n % len(hot)]}', data={'amount': next(amounts)},
+                               headers={'X-Requested-With': 'XMLHttpRequest'})
+        return response.status_code == 200 and response.get_json()['success']
+
+    result = drive('auction_detail POST', args.threads, args.requests, place_bid)
+    result['accepted_per_second'] = (result['requests'] - result['failures']) / result['seconds']
+    return result
+
+
+def bench_holds(args):
+    """Bids spread over many lots, first by distinct users, then all by one user.
+
+    Holds only lock the bidder's own row, so the first run should scale like
+    plain bidding; the second shows the cost of contention on a single user.
+    """
+    app.config['WTF_CSRF_ENABLED'] = False
+    lots = db_session.execute(
+        select(Auction.id)
+        .where(Auction.auction_type.in_([AuctionType.ENGLISH, AuctionType.EVERLASTING]),
+               Auction.id <= args.auctions)
+        .order_by(Auction.id.desc())
+        .limit(args.threads * 10)
+    ).scalars().all()
+    db_session.remove()
+    amounts = itertools.count(2 * 10 ** 6)
+    results = []
+
+    for name, user_for in (('bids, user per thread', lambda thread_index: thread_index % args.users + 1),
+                           ('bids, one shared user', lambda thread_index: 1)):
+        clients = {}
+
+        def place_bid(client, thread_index, n):
+            if client not in clients:
+                with client.session_transaction() as session:
+                    session['_user_id'] = str(user_for(thread_index))
+                    session['_fresh'] = True
+                clients[client] = True
+            response = client.post(f'/auction/{lots[n % len(lots)]}', data={'amount': next(amounts)},
+                                   headers={'X-Requested-With': 'XMLHttpRequest'})
+            return response.status_code == 200 and response.get_json()['success']
+
+        results.append(drive(name, args.threads, args.requests, place_bid))
+
+    inconsistent = consistency.find_inconsistent_holds()
+    db_session.remove()
+    if inconsistent:
+        print(f"WARNING held balances out of step with holds for users {inconsistent[:20]}")
+    return results
+
+
+def bench_index(args):
+    def index(client, thread_index, n):
+        return client.get('/').status_code == 200
+
+    return drive('index', args.threads, args.requests, index)
+
+
+def bench_bids_api(args):
+    def bids(client, thread_index, n):
+        auction_id = n % args.auctions + 1
+        return client.get(f'/api/auction/{auction_id}/bids').status_code == 200
+
+    return drive('/api/auction/<id>/bids', args.threads, args.requests, bids)
+
+
+def bench_search(args):
+    queries = [f'{a} {b}' for a, b in itertools.combinations(WORDS[:8], 2)]
+
+    def search(client, thread_index, n):
+        return client.get('/search', query_string={'q': queries[n % len(queries)]}).status_code == 200
+
+    client = app.test_client()
+    client.get('/search', query_string={'q': WORDS[0]})  # builds the in-process index on SQLite
+    return drive('/search', args.threads, args.requests, search)
+
+
+def bench_close(args):
+    """Times loading the deadline heap, closing every expired lot and notifying."""
+    bot = StubBot()
+    scheduler = app_module.close_scheduler
+    # Telegram's rate limits would dominate; measure our side of the pipeline.
+    dispatcher.global_bucket = TokenBucket(10 ** 6)
+    dispatcher.per_chat_rate = 10 ** 6
+
+    async def run():
+        dispatcher.start(bot)
+        started = time.perf_counter()
+        await scheduler.load()
+        loaded = time.perf_counter()
+        due = scheduler._pop_due(datetime.utcnow())
+        for start in range(0, len(due), CLOSE_BATCH_SIZE):
+            await scheduler.close_func(due[start:start + CLOSE_BATCH_SIZE])
+        closed = len(due)
+        finished = time.perf_counter()
+        await asyncio.sleep(0)  # lets the queued hand-offs reach the dispatcher
+        await dispatcher.join()
+        notified = time.perf_counter()
+        await dispatcher.stop()
+        return loaded - started, finished - loaded, notified - finished, closed
+
+    load_seconds, close_seconds, notify_seconds, closed = asyncio.run(run())
+    return {
+        'name': 'close expired lots',
+        'lots': closed,
+        'load_seconds': load_seconds,
+        'close_seconds': close_seconds,
+        'notify_seconds': notify_seconds,
+        'notifications': len(bot.sent),
+        'per_second': closed / close_seconds if close_seconds else 0,
+    }
+
+
+# Run in a fresh interpreter per start: what a new worker pays before it
+# can take traffic, and for its first request.
+COLD_START_PROBE = """
+import asyncio, time
+started = time.perf_counter()
+import app, health
+imported = time.perf_counter()
+flask_app = app.create_app()
+created = time.perf_counter()
+asyncio.run(health.warm_up(retry_seconds=0.1))
+warmed = time.perf_counter()
+status = flask_app.test_client().get('/').status_code
+served = time.perf_counter()
+print(imported - started, created - imported, warmed - created, served - warmed, status)
+"""
+
+
+def bench_cold_start(args):
+    """Times importing the app, create_app(), warming the pools and the first request."""
+    samples = []
+    for _ in range(args.cold_starts):
+        output = subprocess.run(
+            [sys.executable, '-c', COLD_START_PROBE], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.split()
+        if output[-1] != '200':
+            raise RuntimeError(f"first request after a cold start returned {output[-1]}")
+        samples.append([float(value) * 1000 for value in output[-5:-1]])
+    import_ms, create_ms, warm_ms, first_ms = (statistics.median(column) for column in zip(*samples))
+    ready_ms = import_ms + create_ms + warm_ms
+    return {
+        'name': 'cold start',
+        'starts': len(samples),
+        'import_ms': import_ms,
+        'create_app_ms': create_ms,
+        'warm_up_ms': warm_ms,
+        'first_request_ms': first_ms,
+        'ready_ms': ready_ms,
+        'per_second': 1000 / ready_ms,  # worker starts per second, for --compare
+    }
+
+
+BENCHMARKS = {
+    'bids': bench_bids,
+    'holds': bench_holds,
+    'index': bench_index,
+    'bids_api': bench_bids_api,
+    'search': bench_search,
+    'close': bench_close,
+    'cold_start': bench_cold_start,
+}
+
+
+def report(results):
+    for result in results:
+        if 'p99_ms' in result:
+            print(f"{result['name']:<26} {result['per_second']:9.1f} req/s  "
+                  f"p50 {result['p50_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms  "
+                  f"failures {result['failures']}")
+        elif 'ready_ms' in result:
+            print(f"{result['name']:<26} ready in {result['ready_ms']:.0f} ms (import {result['import_ms']:.0f}, "
+                  f"create_app {result['create_app_ms']:.1f}, warm-up {result['warm_up_ms']:.0f}), "
+                  f"first request {result['first_request_ms']:.0f} ms, median of {result['starts']}")
+        else:
+            print(f"{result['name']:<26} {result['lots']} lots: load {result['load_seconds']:.2f}s, "
+                  f"close {result['close_seconds']:.2f}s ({result['per_second']:.1f}/s), "
+                  f"{result['notifications']} notifications drained in {result['notify_seconds']:.2f}s")
+
+
+def compare(results, baseline_path, tolerance):
+    """Returns the metrics that got worse than the baseline by more than `tolerance`."""
+    with open(baseline_path) as f:
+        baseline = {result['name']: result for result in json.load(f)['results']}
+    regressions = []
+    for result in results:
+        before = baseline.get(result['name'])
+        if before is None:
+            continue
+        if result['per_second'] < before['per_second'] * (1 - tolerance):
+            regressions.append(f"{result['name']}: {before['per_second']:.1f} -> {result['per_second']:.1f}/s")
+        if 'p99_ms' in result and result['p99_ms'] > before['p99_ms'] * (1 + tolerance):
+            regressions.append(f"{result['name']}: p99 {before['p99_ms']:.2f} -> {result['p99_ms']:.2f} ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--auctions', type=int, default=2000)
+    parser.add_argument('--bids-per-auction', type=int, default=5)
+    parser.add_argument('--closing', type=int, default=10000, help='expired lots for the close benchmark')
+    parser.add_argument('--hot-auctions', type=int, default=20, help='lots that receive the benchmark bids')
+    parser.add_argument('--cold-starts', type=int, default=5, help='fresh interpreters for the cold start benchmark')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=2000, help='requests per endpoint')
+    parser.add_argument('--only', choices=sorted(BENCHMARKS), action='append')
+    parser.add_argument('--json', metavar='PATH', help='write the results to PATH')
+    parser.add_argument('--compare', metavar='PATH', help='fail if worse than the results in PATH')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    print(f"Seeding {args.users} users, {args.auctions} + {args.closing} auctions, "
+          f"{args.bids_per_auction} bids each on {get_engine().dialect.name}")
+    seed(args.users, args.auctions, args.bids_per_auction, args.closing)
+
+    results = []
+    for name in args.only or BENCHMARKS:
+        result = BENCHMARKS[name](args)
+        results.extend(result if isinstance(result, list) else [result])
+        db_session.remove()
+    report(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'database': get_engine().dialect.name, 'args': vars(args), 'results': results}, f, indent=2)
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
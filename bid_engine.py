@@ -0,0 +1,426 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import case, delete, insert, or_, select, update
+
+from config import Config
+from db import db_session
+from live import live_broker
+import escrow
+import listing
+from models import Auction, AuctionType, BalanceHold, Bid, dutch_price
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BidResult:
+    accepted: bool
+    message: str
+    category: str
+    current_price: Optional[float] = None
+
+
+@dataclass
+class AuctionState:
+    id: int
+    auction_type: AuctionType
+    starting_price: float
+    current_price: Optional[float]
+    start_time: datetime
+    end_time: datetime
+    is_active: bool
+    creator_id: Optional[int] = None
+    dutch_price_decrement: Optional[float] = None
+    dutch_interval: Optional[int] = None
+    highest_bid_id: Optional[int] = None
+    highest_bid_amount: Optional[float] = None
+    bid_count: int = 0
+    holds: dict = field(default_factory=dict)  # user_id -> amount reserved on this lot
+
+    @property
+    def current_dutch_price(self):
+        return dutch_price(self.starting_price, self.dutch_price_decrement, self.dutch_interval, self.start_time)
+
+
+@dataclass
+class _PlaceBid:
+    auction_id: int
+    user_id: int
+    username: str
+    amount: float
+    future: Future
+
+
+@dataclass
+class _Evict:
+    auction_id: int
+
+
+class StaleStateError(Exception):
+    """The auction row was changed by another writer since it was loaded."""
+
+    def __init__(self, auction_id):
+        super().__init__(f"Auction {auction_id} was modified concurrently")
+        self.auction_id = auction_id
+
+
+class _Shard:
+    def __init__(self, index, batch_size):
+        self.index = index
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.states = {}
+        self.thread = threading.Thread(target=self._run, name=f"bid-engine-{index}", daemon=True)
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._process(batch)
+            except Exception as e:
+                logger.error(f"Bid engine shard {self.index} failed to process a batch: {str(e)}")
+                # Holds may have been changed in memory for a transaction that won't commit.
+                self.states.clear()
+                for command in batch:
+                    if isinstance(command, _PlaceBid) and not command.future.done():
+                        command.future.set_result(_retry_result())
+            finally:
+                db_session.remove()
+
+    def _process(self, batch):
+        # Applied once the batch is written so that bids already validated
+        # in this batch are persisted against one state.
+        evicted = [command.auction_id for command in batch if isinstance(command, _Evict)]
+        # A bid whose caller gave up waiting is dropped here, before it can
+        # hold funds; from now on the caller waits for the result.
+        commands = [
+            command for command in batch
+            if isinstance(command, _PlaceBid) and command.future.set_running_or_notify_cancel()
+        ]
+        while commands:
+            try:
+                self._place(commands)
+                break
+            except StaleStateError as e:
+                # Only the lot another process wrote to fails. The rest of the
+                # batch is validated again from the database and retried.
+                db_session.rollback()
+                logger.warning(f"Bid engine shard {self.index}: {str(e)}, retrying the rest of the batch")
+                for auction_id in {command.auction_id for command in commands}:
+                    self.states.pop(auction_id, None)
+                for command in commands:
+                    if command.auction_id == e.auction_id:
+                        command.future.set_result(_retry_result())
+                commands = [command for command in commands if command.auction_id != e.auction_id]
+
+        for auction_id in evicted:
+            self.states.pop(auction_id, None)
+
+    def _place(self, commands):
+        accepted = []
+        rejected = []
+        touched = {}
+        # Auction rows before anything that refers to them, in id order, as
+        # close_auctions takes them: a bid and a close of the same lot wait
+        # for each other instead of deadlocking on its holds.
+        db_session.execute(
+            select(Auction.id)
+            .where(Auction.id.in_(sorted({command.auction_id for command in commands})))
+            .order_by(Auction.id)
+            .with_for_update()
+        )
+        # Then every bidder of the batch, rather than one by one as they come.
+        escrow.lock_users(db_session, {command.user_id for command in commands})
+        for command in commands:
+            state = self._get_state(command.auction_id)
+            if state is None:
+                rejected.append((command, BidResult(False, 'Auction not found.', 'danger')))
+                continue
+
+            # Remember the persisted price before the first change so the
+            # write below can detect a concurrent writer in another process.
+            if state.id not in touched:
+                touched[state.id] = (state.current_price, state.is_active)
+
+            result = _apply_bid(state, command, self._reserve)
+            if result.accepted:
+                accepted.append((command, result))
+            else:
+                rejected.append((command, result))
+
+        if accepted:
+            self._commit(accepted, touched)
+
+        # Not before: a retry after a stale lot validates these commands again.
+        for command, result in rejected:
+            command.future.set_result(result)
+
+    def _commit(self, accepted, touched):
+        now = datetime.utcnow()
+        try:
+            self._persist(accepted, touched, now)
+        except StaleStateError:
+            raise
+        except Exception as e:
+            db_session.rollback()
+            logger.error(f"Bid engine shard {self.index} failed to persist {len(accepted)} bids: {str(e)}")
+            for auction_id in touched:
+                self.states.pop(auction_id, None)
+            for command, _ in accepted:
+                command.future.set_result(_retry_result())
+            return
+
+        for auction_id in {command.auction_id for command, _ in accepted}:
+            if self.states[auction_id].is_active:
+                listing.invalidate_auction(auction_id)
+            else:
+                listing.invalidate_closed_auction(auction_id)
+
+        for command, result in accepted:
+            command.future.set_result(result)
+            event = {
+                'bidder': command.username,
+                'timestamp': now.isoformat(),
+                'is_active': self.states[command.auction_id].is_active,
+            }
+            if self.states[command.auction_id].auction_type == AuctionType.CLOSED:
+                event['sealed'] = True
+            else:
+                event.update(amount=command.amount, current_price=result.current_price)
+            live_broker.publish(command.auction_id, 'bid', event)
+
+    def _persist(self, accepted, touched, now):
+        bid_ids = db_session.execute(
+            insert(Bid).returning(Bid.id, sort_by_parameter_order=True),
+            [
+                {
+                    'amount': command.amount,
+                    'bidder_id': command.user_id,
+                    'auction_id': command.auction_id,
+                    'timestamp': now,
+                }
+                for command, _ in accepted
+            ]
+        ).scalars().all()
+
+        bids_by_auction = {}
+        for bid_id, (command, _) in zip(bid_ids, accepted):
+            bids_by_auction.setdefault(command.auction_id, []).append((bid_id, command.amount))
+
+        highest = {}
+        for auction_id, bids in bids_by_auction.items():
+            state = self.states[auction_id]
+            old_price, old_active = touched[auction_id]
+            values = {
+                'bid_count': Auction.bid_count + len(bids),
+                'last_bid_at': now,
+                'version': Auction.version + 1,
+            }
+            # Closing a lot from outside the engine also invalidates the batch.
+            stmt = update(Auction).where(Auction.id == auction_id, Auction.is_active == old_active)
+            # Sealed lots have no price and no leader until sealed.resolve() ranks them.
+            if state.auction_type != AuctionType.CLOSED:
+                # First of the highest amounts in the batch; ties go to the earlier bid.
+                top_id, top_amount = max(bids, key=lambda bid: bid[1])
+                is_higher = or_(Auction.highest_bid_amount.is_(None), Auction.highest_bid_amount < top_amount)
+                values.update(
+                    highest_bid_id=case((is_higher, top_id), else_=Auction.highest_bid_id),
+                    highest_bid_amount=case((is_higher, top_amount), else_=Auction.highest_bid_amount),
+                )
+                if state.highest_bid_amount is None or state.highest_bid_amount < top_amount:
+                    highest[auction_id] = (top_id, top_amount)
+                if old_price is None:
+                    stmt = stmt.where(Auction.current_price.is_(None))
+                else:
+                    stmt = stmt.where(Auction.current_price == old_price)
+                values.update(current_price=state.current_price, is_active=state.is_active)
+            result = db_session.execute(stmt.values(**values).execution_options(synchronize_session=False))
+            if result.rowcount != 1:
+                raise StaleStateError(auction_id)
+            if old_active and not state.is_active:
+                # An accepted Dutch bid ends the lot: the winner pays from the hold.
+                winner, = state.holds
+                for statement in escrow.settle_statements(auction_id, winner, state.current_price, state.creator_id):
+                    db_session.execute(statement)
+
+        db_session.commit()
+
+        for auction_id, (bid_id, amount) in highest.items():
+            self.states[auction_id].highest_bid_id = bid_id
+            self.states[auction_id].highest_bid_amount = amount
+
+    def _reserve(self, state, command):
+        """Holds the bid amount on the bidder's balance, in the batch transaction."""
+        user_id, amount = command.user_id, command.amount
+        held = state.holds.get(user_id)
+        # A bidder's new bid replaces their own hold on the lot, so only the
+        # difference has to be available.
+        if not escrow.reserve(db_session, user_id, amount - (held or 0), state.id):
+            return False
+
+        if state.auction_type == AuctionType.CLOSED:
+            # Sealed bids all stay open until the close; keep the largest.
+            if held is not None and held >= amount:
+                return True
+        else:
+            # Only the leading bid is held; everyone outbid gets their funds back.
+            outbid = [outbid_id for outbid_id in state.holds if outbid_id != user_id]
+            for outbid_id in outbid:
+                escrow.release(db_session, outbid_id, state.holds.pop(outbid_id), state.id)
+            if outbid:
+                db_session.execute(delete(BalanceHold).where(
+                    BalanceHold.auction_id == state.id, BalanceHold.user_id.in_(outbid)
+                ))
+
+        if held is None:
+            db_session.execute(insert(BalanceHold).values(user_id=user_id, auction_id=state.id, amount=amount))
+        else:
+            db_session.execute(
+                update(BalanceHold)
+                .where(BalanceHold.user_id == user_id, BalanceHold.auction_id == state.id)
+                .values(amount=amount)
+                .execution_options(synchronize_session=False)
+            )
+        state.holds[user_id] = amount
+        return True
+
+    def _get_state(self, auction_id):
+        state = self.states.get(auction_id)
+        if state is None:
+            state = _load_state(auction_id)
+            if state is not None:
+                self.states[auction_id] = state
+        return state
+
+
+def _retry_result():
+    return BidResult(False, 'Your bid could not be placed. Please try again.', 'danger')
+
+
+def _pending_result():
+    return BidResult(False, 'Your bid is still being processed. Refresh the page to see if it was placed.', 'warning')
+
+
+def _load_state(auction_id):
+    auction = db_session.get(Auction, auction_id)
+    if auction is None:
+        return None
+    state = AuctionState(
+        id=auction.id,
+        auction_type=auction.auction_type,
+        starting_price=auction.starting_price,
+        current_price=auction.current_price,
+        start_time=auction.start_time,
+        end_time=auction.end_time,
+        is_active=bool(auction.is_active),
+        creator_id=auction.creator_id,
+        dutch_price_decrement=auction.dutch_price_decrement,
+        dutch_interval=auction.dutch_interval,
+        highest_bid_id=auction.highest_bid_id,
+        highest_bid_amount=auction.highest_bid_amount,
+        bid_count=auction.bid_count or 0,
+        holds=dict(db_session.execute(
+            select(BalanceHold.user_id, BalanceHold.amount).where(BalanceHold.auction_id == auction_id)
+        ).all()),
+    )
+    # The state is owned by the shard from now on; don't keep the ORM row
+    # around. Not a rollback: holds reserved earlier in the batch must survive.
+    db_session.expunge(auction)
+    return state
+
+
+def _apply_bid(state, command, reserve):
+    amount = command.amount
+
+    if not state.is_active or datetime.utcnow() >= state.end_time:
+        return BidResult(False, 'This auction has ended. Bidding is no longer allowed.', 'warning')
+
+    if state.auction_type == AuctionType.DUTCH:
+        if amount != state.current_dutch_price:
+            return BidResult(False, 'For Dutch auctions, you must accept the current price.', 'danger')
+    elif state.auction_type == AuctionType.CLOSED:
+        if amount <= state.starting_price:
+            return BidResult(False, 'Your bid must be higher than the starting price.', 'danger')
+    elif amount <= state.current_price:
+        return BidResult(False, 'Your bid must be higher than the current price.', 'danger')
+
+    # Last check, so funds are only reserved for a bid that is accepted.
+    if not reserve(state, command):
+        return BidResult(False, 'You don\'t have enough XTR for this bid.', 'danger')
+
+    if state.auction_type == AuctionType.DUTCH:
+        # End the auction immediately for Dutch auctions
+        state.is_active = False
+        state.current_price = amount
+        message = 'Congratulations! You won the Dutch auction!'
+    elif state.auction_type == AuctionType.CLOSED:
+        # For closed auctions, we don't update the current price
+        message = 'Your bid has been placed successfully!'
+    else:
+        state.current_price = amount
+        message = 'Your bid has been successfully placed!'
+
+    state.bid_count += 1
+    return BidResult(True, message, 'success', state.current_price)
+
+
+class BidEngine:
+    """Serializes bids per auction through a fixed set of single-writer shards.
+
+    Each auction is pinned to one shard by id, so its live state is only ever
+    read and written by that shard's thread. Commands queued while a batch is
+    being written are validated together and persisted in one transaction.
+    """
+
+    def __init__(self, shards=4, batch_size=100, timeout=10):
+        self.timeout = timeout
+        self._shards = [_Shard(i, batch_size) for i in range(shards)]
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            for shard in self._shards:
+                shard.thread.start()
+            self._started = True
+            logger.info(f"Bid engine started with {len(self._shards)} shards")
+
+    def _shard_for(self, auction_id):
+        return self._shards[auction_id % len(self._shards)]
+
+    def place_bid(self, auction_id, user_id, username, amount):
+        self.start()
+        future = Future()
+        self._shard_for(auction_id).queue.put(_PlaceBid(auction_id, user_id, username, amount, future))
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            logger.error(f"Timed out waiting for bid on auction {auction_id}")
+            if future.cancel():
+                return _retry_result()
+            # Already being written: it may still go through.
+            return _pending_result()
+
+    def evict(self, auction_id):
+        """Drop the cached state of an auction changed outside the engine."""
+        if self._started:
+            self._shard_for(auction_id).queue.put(_Evict(auction_id))
+
+
+bid_engine = BidEngine(
+    shards=Config.BID_ENGINE_SHARDS,
+    batch_size=Config.BID_ENGINE_BATCH_SIZE,
+)
@@ -0,0 +1,51 @@
+"""The bid history API's payload, cached by auction version.
+
+Every write that changes what the API shows (a bid, a Dutch acceptance, a
+close) bumps Auction.version in the same statement. The version is the
+ETag, so a poll that sends it back in If-None-Match is answered 304 after
+reading one integer by primary key. A client without a matching ETag gets
+the rendered payload from fragment_cache, keyed by (auction_id, version);
+only the first poll after a change queries the bids and renders the
+fragment. Stale versions are never looked up again and age out of the LRU.
+"""
+from flask import render_template
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+
+from cache import LRUCache
+from config import Config
+from models import Auction, Bid
+
+fragment_cache = LRUCache(maxsize=Config.BID_HISTORY_CACHE_SIZE)
+
+
+def etag(auction_id, version):
+    return f"a{auction_id}-v{version}"
+
+
+def current_version(session, auction_id):
+    """The auction's version, or None if there is no such auction."""
+    return session.execute(select(Auction.version).where(Auction.id == auction_id)).scalar_one_or_none()
+
+
+def payload(session, auction_id, version):
+    """The API's JSON payload and the version it was rendered at, None if the auction is gone."""
+    cached = fragment_cache.get((auction_id, version))
+    if cached is not None:
+        return cached, version
+
+    auction = session.get(Auction, auction_id)
+    if auction is None:
+        return None, None
+    bids = session.execute(
+        select(Bid).where(Bid.auction_id == auction_id).options(joinedload(Bid.bidder))
+        .order_by(Bid.timestamp.desc()).limit(10)
+    ).scalars().all()
+    data = {
+        'current_price': auction.current_price,
+        'bid_history_html': render_template('bid_history.html', bids=bids, sealed=auction.bids_sealed),
+    }
+    # Keyed by the version actually read: a bid landing between the two
+    # reads is cached under its own version, never under the older one.
+    fragment_cache.set((auction_id, auction.version), data)
+    return data, auction.version
@@ -0,0 +1,143 @@
+import asyncio
+import heapq
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from db import async_session
+from models import Auction, AuctionType
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on one sleep, so a changed system clock can't stall closing.
+MAX_SLEEP = 60  # seconds
+# Lots due at the same tick are handed to close_func together, this many at a time.
+CLOSE_BATCH_SIZE = 500
+# A lot that failed to close is tried again after 1, 2, 4... seconds, up to this.
+RETRY_DELAY = 1  # seconds
+MAX_RETRY_DELAY = 30  # seconds
+
+
+class CloseScheduler:
+    """Closes auctions at their deadlines from an in-memory min-heap of end_times.
+
+    The heap is loaded from the database when run() starts and kept current
+    by schedule() when auctions are created. Everlasting auctions never enter
+    it. Entries are dropped lazily: an entry only fires if it still matches
+    the deadline recorded for its auction. schedule() is a no-op while run()
+    isn't running, e.g. in a web-only process or a standby scheduler.
+
+    close_func is awaited with a list of due auction ids and returns the ids
+    it could not close. Those are scheduled again with a backoff instead of
+    waiting for the next resync.
+    """
+
+    def __init__(self, close_func):
+        self.close_func = close_func
+        self._heap = []
+        self._deadlines = {}
+        self._attempts = {}  # auction_id -> failed closes in a row
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+
+    async def load(self):
+        async with async_session('scheduler') as session:
+            rows = (await session.execute(
+                # In deadline order, so the read can only come off ix_auctions_active_end_time.
+                select(Auction.id, Auction.end_time).where(
+                    Auction.is_active == True,
+                    Auction.auction_type != AuctionType.EVERLASTING
+                ).order_by(Auction.end_time)
+            )).all()
+        # Merged rather than replaced, so a schedule() racing a resync is kept.
+        with self._lock:
+            for auction_id, end_time in rows:
+                if self._deadlines.get(auction_id) != end_time:
+                    self._deadlines[auction_id] = end_time
+                    heapq.heappush(self._heap, (end_time, auction_id))
+        logger.info(f"Close scheduler loaded {len(rows)} deadlines")
+        self._wake()
+
+    async def resync(self):
+        """Reload deadlines, picking up auctions written by other processes."""
+        await self.load()
+
+    def schedule(self, auction_id, end_time, auction_type=None):
+        if auction_type == AuctionType.EVERLASTING or self._loop is None:
+            return
+        with self._lock:
+            self._deadlines[auction_id] = end_time
+            heapq.heappush(self._heap, (end_time, auction_id))
+        self._wake()
+
+    def cancel(self, auction_id):
+        with self._lock:
+            self._deadlines.pop(auction_id, None)
+            self._attempts.pop(auction_id, None)
+
+    def _retry(self, auction_ids, now):
+        with self._lock:
+            for auction_id in auction_ids:
+                # Rescheduled while it was being closed: the new deadline stands.
+                if auction_id in self._deadlines:
+                    continue
+                attempts = self._attempts[auction_id] = self._attempts.get(auction_id, 0) + 1
+                retry_at = now + timedelta(seconds=min(MAX_RETRY_DELAY, RETRY_DELAY * 2 ** (attempts - 1)))
+                self._deadlines[auction_id] = retry_at
+                heapq.heappush(self._heap, (retry_at, auction_id))
+
+    def _wake(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _pop_due(self, now):
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                end_time, auction_id = heapq.heappop(self._heap)
+                if self._deadlines.get(auction_id) == end_time:
+                    del self._deadlines[auction_id]
+                    due.append(auction_id)
+        return due
+
+    def _next_delay(self, now):
+        with self._lock:
+            if not self._heap:
+                return MAX_SLEEP
+            return min(MAX_SLEEP, max(0, (self._heap[0][0] - now).total_seconds()))
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        try:
+            await self.load()
+            while True:
+                due = self._pop_due(datetime.utcnow())
+                for start in range(0, len(due), CLOSE_BATCH_SIZE):
+                    batch = due[start:start + CLOSE_BATCH_SIZE]
+                    try:
+                        failed = await self.close_func(batch) or []
+                    except Exception as e:
+                        logger.error(f"Error closing auctions {batch[:20]}: {str(e)}")
+                        failed = batch
+                    with self._lock:
+                        for auction_id in set(batch) - set(failed):
+                            self._attempts.pop(auction_id, None)
+                    if failed:
+                        logger.warning(f"Retrying {len(failed)} auctions that failed to close: {failed[:20]}")
+                        self._retry(failed, datetime.utcnow())
+
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self._next_delay(datetime.utcnow()))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._loop = None
+            with self._lock:
+                self._heap.clear()
+                self._deadlines.clear()
+                self._attempts.clear()
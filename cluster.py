@@ -0,0 +1,241 @@
+"""Running the app as several processes.
+
+A process runs any of the web, bot and scheduler roles. Web processes scale
+out freely; scheduler processes elect one leader with a Postgres advisory
+lock, so background jobs run exactly once. Processes talk to each other
+through Postgres LISTEN/NOTIFY: new auction deadlines go to the leader, and
+live auction events and user cache invalidations go to every web process.
+
+On SQLite everything runs in one process, so this process is always the
+leader and nothing is relayed.
+"""
+import asyncio
+import json
+import logging
+import os
+import uuid
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+from db import get_direct_engine
+
+logger = logging.getLogger(__name__)
+
+ROLES = ('web', 'bot', 'scheduler')
+
+DEADLINES_CHANNEL = 'auction_deadlines'
+EVENTS_CHANNEL = 'auction_events'
+USERS_CHANNEL = 'user_invalidations'
+
+# Identifies this process's own NOTIFY messages when they come back.
+ORIGIN = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+def parse_roles(value):
+    roles = {role.strip() for role in value.split(',') if role.strip()}
+    unknown = roles - set(ROLES)
+    if unknown or not roles:
+        raise ValueError(f"Unknown roles {sorted(unknown)}; expected a comma-separated subset of {ROLES}")
+    return roles
+
+
+def is_postgres():
+    return get_direct_engine().dialect.name == 'postgresql'
+
+
+def announce_deadline(session, auction_id, end_time):
+    """Tells the scheduler leader about a new deadline when `session` commits."""
+    if session.get_bind().dialect.name != 'postgresql':
+        return
+    session.execute(select(func.pg_notify(DEADLINES_CHANNEL, f"{auction_id} {end_time.isoformat()}")))
+
+
+def announce_user_change(session, user_id):
+    """Drops the user from every web process's principal cache when `session` commits."""
+    if session.get_bind().dialect.name != 'postgresql':
+        return
+    session.execute(select(func.pg_notify(USERS_CHANNEL, f"{ORIGIN} {user_id}")))
+
+
+def parse_deadline(payload):
+    auction_id, end_time = payload.split(' ', 1)
+    return int(auction_id), datetime.fromisoformat(end_time)
+
+
+class _DedicatedConnection:
+    """An asyncpg connection of its own, outside every workload pool.
+
+    Session-level state (advisory locks, LISTEN) lives as long as the
+    connection, so it comes from the unpooled direct engine, which also
+    bypasses a transaction-mode PgBouncer, and is invalidated when done.
+    """
+
+    def __init__(self):
+        self._connection = None
+
+    async def open(self):
+        self._connection = await get_direct_engine().connect()
+        return (await self._connection.get_raw_connection()).driver_connection
+
+    async def close(self):
+        if self._connection is not None:
+            try:
+                await self._connection.invalidate()
+            except Exception as e:
+                logger.warning(f"Error closing dedicated connection: {str(e)}")
+            self._connection = None
+
+
+class LeaderElection:
+    """Holds a Postgres advisory lock while this process is the job runner.
+
+    Every candidate retries pg_try_advisory_lock every `retry_interval`
+    seconds. The lock belongs to the leader's connection, so if the leader
+    dies or loses the database the lock is released and a standby takes over
+    on its next attempt. The leader checks its connection on the same
+    interval and steps down as soon as it fails.
+    """
+
+    def __init__(self, lock_key, retry_interval=5):
+        self.lock_key = lock_key
+        self.retry_interval = retry_interval
+        self.is_leader = False
+        self._connection = _DedicatedConnection()
+        self._driver = None
+
+    async def run(self, on_elected, on_demoted):
+        try:
+            if not is_postgres():
+                self.is_leader = True
+                await on_elected()
+                await asyncio.Event().wait()
+            while True:
+                if self.is_leader:
+                    if not await self._still_held():
+                        logger.warning("Lost the scheduler leader lock; stepping down")
+                        self.is_leader = False
+                        await self._connection.close()
+                        await on_demoted()
+                elif await self._try_acquire():
+                    logger.info(f"Elected scheduler leader ({ORIGIN})")
+                    self.is_leader = True
+                    await on_elected()
+                await asyncio.sleep(self.retry_interval)
+        finally:
+            if self.is_leader:
+                self.is_leader = False
+                await on_demoted()
+            await self._connection.close()
+
+    async def _try_acquire(self):
+        try:
+            driver = await self._connection.open()
+            if await driver.fetchval('SELECT pg_try_advisory_lock($1)', self.lock_key):
+                self._driver = driver
+                return True
+        except Exception as e:
+            logger.error(f"Leader election attempt failed: {str(e)}")
+        await self._connection.close()
+        return False
+
+    async def _still_held(self):
+        try:
+            return await asyncio.wait_for(self._driver.fetchval('SELECT 1'), self.retry_interval) == 1
+        except Exception:
+            return False
+
+
+class PgChannel:
+    """LISTENs on one Postgres channel and NOTIFYs on it from any thread.
+
+    The connection is re-established after a failure; messages sent while it
+    is down are dropped, as they are only hints (the close scheduler resyncs
+    and live clients reload on reconnect).
+    """
+
+    def __init__(self, channel, on_message, reconnect_interval=5):
+        self.channel = channel
+        self.on_message = on_message
+        self.reconnect_interval = reconnect_interval
+        self._loop = None
+        self._outbox = None
+        self._connection = _DedicatedConnection()
+
+    def send(self, payload):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._outbox.put_nowait, payload)
+
+    def _received(self, connection, pid, channel, payload):
+        try:
+            self.on_message(payload)
+        except Exception as e:
+            logger.error(f"Error handling a message on {self.channel}: {str(e)}")
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._outbox = asyncio.Queue()
+        try:
+            while True:
+                try:
+                    driver = await self._connection.open()
+                    await driver.add_listener(self.channel, self._received)
+                    logger.info(f"Listening on {self.channel}")
+                    while True:
+                        payload = await self._outbox.get()
+                        await driver.execute('SELECT pg_notify($1, $2)', self.channel, payload)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Connection for {self.channel} failed: {str(e)}")
+                await self._connection.close()
+                await asyncio.sleep(self.reconnect_interval)
+        finally:
+            self._loop = None
+            await self._connection.close()
+
+
+class EventRelay:
+    """Mirrors live auction events between processes through EVENTS_CHANNEL."""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.channel = PgChannel(EVENTS_CHANNEL, self._received)
+
+    def send(self, auction_id, event_type, data):
+        self.channel.send(json.dumps({'origin': ORIGIN, 'auction_id': auction_id, 'type': event_type, 'data': data}))
+
+    def _received(self, payload):
+        message = json.loads(payload)
+        if message['origin'] != ORIGIN:
+            self.broker.publish_local(message['auction_id'], message['type'], message['data'])
+
+    async def run(self):
+        self.broker.relay = self
+        try:
+            await self.channel.run()
+        finally:
+            self.broker.relay = None
+
+
+class PrincipalRelay:
+    """Passes user cache invalidations between processes through USERS_CHANNEL."""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.channel = PgChannel(USERS_CHANNEL, self._received)
+
+    def send(self, user_id):
+        self.channel.send(f"{ORIGIN} {user_id}")
+
+    def _received(self, payload):
+        origin, user_id = payload.split(' ', 1)
+        if origin != ORIGIN:
+            self.cache.invalidate_local(int(user_id))
+
+    async def run(self):
+        self.cache.relay = self
+        try:
+            await self.channel.run()
+        finally:
+            self.cache.relay = None
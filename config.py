@@ -2,10 +2,54 @@ import os
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess'
-    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL').replace('postgresql://', 'postgresql://')
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')  # checked when the engine is first needed
+    # LISTEN and advisory locks need a real session: point this past PgBouncer if DATABASE_URL goes through it.
+    DATABASE_DIRECT_URL = os.environ.get('DATABASE_DIRECT_URL')
+    DB_PGBOUNCER = os.environ.get('DB_PGBOUNCER', '').lower() in ('1', 'true', 'transaction')
+    # One pool per workload (see db.py), e.g. DB_POOL_WEB_SIZE, DB_POOL_SCHEDULER_OVERFLOW, DB_POOL_BOT_TIMEOUT.
+    DB_POOLS = {
+        workload: {
+            'pool_size': int(os.environ.get(f'DB_POOL_{workload.upper()}_SIZE', size)),
+            'max_overflow': int(os.environ.get(f'DB_POOL_{workload.upper()}_OVERFLOW', overflow)),
+            'pool_timeout': float(os.environ.get(f'DB_POOL_{workload.upper()}_TIMEOUT', timeout)),  # seconds
+        }
+        for workload, size, overflow, timeout in (('web', 10, 10, 5), ('scheduler', 3, 2, 30), ('bot', 5, 5, 10))
+    }
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
     PAYMENT_PROVIDER_TOKEN = os.environ.get('PAYMENT_PROVIDER_TOKEN')
     TELEGRAM_BOT_USERNAME = os.environ.get('TELEGRAM_BOT_USERNAME')
     YOOMONEY_SHOP_ID = os.environ.get('YOOMONEY_SHOP_ID')
     YOOMONEY_SECRET_KEY = os.environ.get('YOOMONEY_SECRET_KEY')
+    BID_ENGINE_SHARDS = int(os.environ.get('BID_ENGINE_SHARDS', 4))
+    BID_ENGINE_BATCH_SIZE = int(os.environ.get('BID_ENGINE_BATCH_SIZE', 100))
+    LISTING_PAGE_SIZE = int(os.environ.get('LISTING_PAGE_SIZE', 24))
+    LISTING_CACHE_SIZE = int(os.environ.get('LISTING_CACHE_SIZE', 512))
+    LISTING_CACHE_TTL = int(os.environ.get('LISTING_CACHE_TTL', 30))
+    BID_HISTORY_CACHE_SIZE = int(os.environ.get('BID_HISTORY_CACHE_SIZE', 1024))
+    NOTIFY_CONCURRENCY = int(os.environ.get('NOTIFY_CONCURRENCY', 8))
+    NOTIFY_GLOBAL_RATE = float(os.environ.get('NOTIFY_GLOBAL_RATE', 30))  # messages per second, all chats
+    NOTIFY_CHAT_RATE = float(os.environ.get('NOTIFY_CHAT_RATE', 1))  # messages per second, one chat
+    NOTIFY_MAX_ATTEMPTS = int(os.environ.get('NOTIFY_MAX_ATTEMPTS', 5))
+    WATCH_ALERT_WINDOW = int(os.environ.get('WATCH_ALERT_WINDOW', 30))  # seconds; at most one price alert per watched lot
+    WATCH_REMINDER_MINUTES = int(os.environ.get('WATCH_REMINDER_MINUTES', 15))  # "ending soon" lead time
+    WATCH_ALERT_BATCH = int(os.environ.get('WATCH_ALERT_BATCH', 1000))  # watchers fetched and queued at a time
+    LEDGER_SNAPSHOT_MINUTES = int(os.environ.get('LEDGER_SNAPSHOT_MINUTES', 10))
+    LEDGER_RECONCILE_HOURS = int(os.environ.get('LEDGER_RECONCILE_HOURS', 24))
+    ROLES = os.environ.get('ROLES', 'web,bot,scheduler')
+    SCHEDULER_LOCK_KEY = int(os.environ.get('SCHEDULER_LOCK_KEY', 0x54415543))  # advisory lock for the job runner
+    LEADER_RETRY_SECONDS = float(os.environ.get('LEADER_RETRY_SECONDS', 5))
+    BOT_MODE = os.environ.get('BOT_MODE', 'polling')  # 'polling' or 'webhook'
+    TELEGRAM_WEBHOOK_URL = os.environ.get('TELEGRAM_WEBHOOK_URL')  # public URL registered with Telegram
+    TELEGRAM_WEBHOOK_PATH = os.environ.get('TELEGRAM_WEBHOOK_PATH', '/telegram/webhook')
+    TELEGRAM_WEBHOOK_SECRET = os.environ.get('TELEGRAM_WEBHOOK_SECRET')
+    BOT_UPDATE_CONCURRENCY = int(os.environ.get('BOT_UPDATE_CONCURRENCY', 16))
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))  # seconds
+    ADMIN_PAGE_SIZE = int(os.environ.get('ADMIN_PAGE_SIZE', 50))
+    EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 1000))  # rows fetched and sent at a time
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # bearer token for /metrics; open if unset
+    QUERY_BUDGET = int(os.environ.get('QUERY_BUDGET', 20))  # SQL statements per request, unless the view sets its own
+    POOL_WARM_CONNECTIONS = int(os.environ.get('POOL_WARM_CONNECTIONS', 2))  # opened per pool before /readyz passes
+    READINESS_TIMEOUT = float(os.environ.get('READINESS_TIMEOUT', 2))  # seconds for the /readyz database check
+    WARM_UP_RETRY_SECONDS = float(os.environ.get('WARM_UP_RETRY_SECONDS', 5))
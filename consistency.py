@@ -0,0 +1,134 @@
+"""Checks denormalized totals against the rows they summarize.
+
+Bid aggregates on auctions are checked against the bids table, and each
+user's held total in the ledger against their open balance holds. Running
+sealed (Closed) lots have a bid count but no winning bid until they are
+resolved.
+
+    python consistency.py          # report drift
+    python consistency.py --fix    # recompute the drifted totals
+"""
+import logging
+import sys
+
+from sqlalchemy import and_, case, func, or_, select, update
+
+from db import db_session
+import ledger
+from models import Auction, AuctionType, BalanceHold, Bid, User
+
+logger = logging.getLogger(__name__)
+
+
+def _bid_stats():
+    return (
+        select(
+            Bid.auction_id,
+            func.count(Bid.id).label('bid_count'),
+            func.max(Bid.amount).label('highest_bid_amount'),
+            func.max(Bid.timestamp).label('last_bid_at'),
+        )
+        .group_by(Bid.auction_id)
+        .subquery()
+    )
+
+
+def _sealed():
+    return and_(Auction.auction_type == AuctionType.CLOSED, Auction.is_active == True)
+
+
+def find_inconsistent_auctions():
+    """Returns the ids of auctions whose aggregates don't match their bids."""
+    stats = _bid_stats()
+    highest_bid = Bid.__table__.alias('highest_bid')
+    sealed = _sealed()
+    stmt = (
+        select(Auction.id)
+        .outerjoin(stats, stats.c.auction_id == Auction.id)
+        .outerjoin(highest_bid, highest_bid.c.id == Auction.highest_bid_id)
+        .where(or_(
+            Auction.bid_count != func.coalesce(stats.c.bid_count, 0),
+            Auction.last_bid_at.is_distinct_from(stats.c.last_bid_at),
+            and_(sealed, or_(Auction.highest_bid_id.is_not(None), Auction.highest_bid_amount.is_not(None))),
+            and_(~sealed, Auction.highest_bid_amount.is_distinct_from(stats.c.highest_bid_amount)),
+            and_(~sealed, Auction.highest_bid_id.is_not(None), or_(
+                highest_bid.c.id.is_(None),
+                highest_bid.c.auction_id != Auction.id,
+                highest_bid.c.amount != Auction.highest_bid_amount,
+            )),
+        ))
+        .order_by(Auction.id)
+    )
+    return db_session.execute(stmt).scalars().all()
+
+
+def recompute_aggregates(auction_ids=None):
+    """Rewrites the aggregates from the bids table; all auctions if no ids are given."""
+    bids = Bid.__table__.alias('b')
+    of_auction = bids.c.auction_id == Auction.id
+    sealed = _sealed()
+    stmt = update(Auction).values(
+        # Ties go to the earliest bid, as in the bid engine and sealed.resolve().
+        highest_bid_id=case((sealed, None), else_=select(bids.c.id).where(of_auction)
+            .order_by(bids.c.amount.desc(), bids.c.id).limit(1).scalar_subquery()),
+        highest_bid_amount=case((sealed, None), else_=select(func.max(bids.c.amount)).where(of_auction)
+            .scalar_subquery()),
+        bid_count=select(func.count(bids.c.id)).where(of_auction).scalar_subquery(),
+        last_bid_at=select(func.max(bids.c.timestamp)).where(of_auction).scalar_subquery(),
+        version=Auction.version + 1,
+    )
+    if auction_ids is not None:
+        stmt = stmt.where(Auction.id.in_(auction_ids))
+    db_session.execute(stmt.execution_options(synchronize_session=False))
+    db_session.commit()
+
+
+def _held_drift():
+    """(user_id, ledger held - held by open bids) per user, in ledger minor units."""
+    _, ledger_held = ledger.totals(User.id)
+    open_holds = func.coalesce(
+        select(func.sum(ledger.to_minor_sql(BalanceHold.amount)))
+        .where(BalanceHold.user_id == User.id)
+        .scalar_subquery(), 0
+    )
+    drift = (ledger_held - open_holds).label('drift')
+    return select(User.id, drift).where(drift != 0).order_by(User.id)
+
+
+def find_inconsistent_holds():
+    """Returns the ids of users whose held total in the ledger isn't the sum of their holds."""
+    return [user_id for user_id, _ in db_session.execute(_held_drift()).all()]
+
+
+def repair_held(user_ids=None):
+    """Appends an adjustment entry per drifted user; the ledger itself is never rewritten."""
+    stmt = _held_drift()
+    if user_ids is not None:
+        stmt = stmt.where(User.id.in_(user_ids))
+    for user_id, drift in db_session.execute(stmt).all():
+        db_session.execute(ledger.entry(user_id, ledger.ADJUSTMENT, held_delta=-drift))
+    db_session.commit()
+
+
+def check(fix=False):
+    auction_ids = find_inconsistent_auctions()
+    if auction_ids:
+        logger.warning(f"{len(auction_ids)} auctions have stale bid aggregates: {auction_ids[:20]}")
+        if fix:
+            recompute_aggregates(auction_ids)
+            logger.info(f"Recomputed bid aggregates for {len(auction_ids)} auctions")
+    user_ids = find_inconsistent_holds()
+    if user_ids:
+        logger.warning(f"{len(user_ids)} users have a stale held balance: {user_ids[:20]}")
+        if fix:
+            repair_held(user_ids)
+            logger.info(f"Recomputed held balances for {len(user_ids)} users")
+    return auction_ids, user_ids
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    fix = '--fix' in sys.argv
+    auction_ids, user_ids = check(fix=fix)
+    print(f"{len(auction_ids)} inconsistent auctions, {len(user_ids)} inconsistent users")
+    sys.exit(1 if (auction_ids or user_ids) and not fix else 0)
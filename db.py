@@ -1,32 +1,132 @@
-import time
-import logging
+import threading
+import uuid
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
 from config import Config
 
-engine = create_engine(Config.SQLALCHEMY_DATABASE_URI, pool_pre_ping=True)
+# Nothing here connects at import. Engines are created by the first session
+# that runs a query, and a dead database shows up as a failing readiness
+# check (see health.py), not as a process that won't start. The schema is
+# managed by Alembic alone.
+#
+# Each workload gets its own engine and pool, sized by Config.DB_POOLS, so
+# a burst of background work can't take the connections page requests
+# need: 'web' (Flask routes and the bid engine, sync), 'scheduler' (jobs
+# and closes, async) and 'bot' (bot handlers and the notification
+# dispatcher, async). The session-level features in cluster.py (LISTEN,
+# advisory locks) use unpooled connections of their own.
+WORKLOADS = ('web', 'scheduler', 'bot')
 
-def get_db_connection(max_retries=3, retry_delay=5):
-    for attempt in range(max_retries):
-        try:
-            # Verify the connection is still valid
-            engine.connect()
-            return engine
-        except OperationalError as e:
-            if attempt < max_retries - 1:
-                logging.warning(f"Database connection attempt {attempt + 1} failed. Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
-            else:
-                logging.error(f"Failed to connect to the database after {max_retries} attempts.")
-                raise
+_engines = {}
+_engine_hooks = []
+_engine_lock = threading.Lock()
 
-db_session = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=get_db_connection()))
+def database_url():
+    if not Config.SQLALCHEMY_DATABASE_URI:
+        raise RuntimeError("DATABASE_URL is not set")
+    return Config.SQLALCHEMY_DATABASE_URI
+
+def on_engine_created(hook):
+    """Calls hook(engine, workload) for every engine once it exists, e.g. to instrument it.
+
+    Async engines are passed as their sync_engine, which is where events attach.
+    """
+    if hook in _engine_hooks:
+        return
+    _engine_hooks.append(hook)
+    for workload, engine in list(_engines.items()):
+        hook(getattr(engine, 'sync_engine', engine), workload)
+
+def _engine_options(url, workload):
+    options = dict(Config.DB_POOLS[workload], pool_pre_ping=True)
+    if Config.DB_PGBOUNCER:
+        # PgBouncer in transaction mode hands each transaction to any server
+        # connection, so statements prepared on one may be missing on the next.
+        if '+asyncpg' in url:
+            options['connect_args'] = {
+                'statement_cache_size': 0,
+                'prepared_statement_cache_size': 0,
+                'prepared_statement_name_func': lambda: f"__asyncpg_{uuid.uuid4()}__",
+            }
+        elif '+psycopg:' in url:
+            options['connect_args'] = {'prepare_threshold': None}
+    return options
+
+def _get(workload, create):
+    engine = _engines.get(workload)
+    if engine is None:
+        # The first requests of a new worker may race to create it.
+        with _engine_lock:
+            engine = _engines.get(workload)
+            if engine is None:
+                engine = create()
+                for hook in _engine_hooks:
+                    hook(getattr(engine, 'sync_engine', engine), workload)
+                _engines[workload] = engine
+    return engine
+
+def get_engine(workload='web'):
+    url = database_url()
+    return _get(workload, lambda: create_engine(url, **_engine_options(url, workload)))
+
+class _Session(Session):
+    # Sessions are created on first use, so this is when the engine is too.
+    def __init__(self, bind=None, **kwargs):
+        super().__init__(bind=bind or get_engine('web'), **kwargs)
+
+db_session = scoped_session(sessionmaker(class_=_Session, autocommit=False, autoflush=False))
+
+# Code running on the event loop (scheduler jobs, bot handlers, the
+# notification dispatcher) uses the async engines so database I/O never
+# blocks the loop. Flask routes keep db_session: hypercorn runs them in its
+# WSGI thread pool.
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'postgres': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+_async_sessionmakers = {}
+
+def async_database_url(url):
+    scheme, rest = url.split('://', 1)
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}://{rest}"
+
+def get_async_engine(workload):
+    url = async_database_url(database_url())
+    return _get(workload, lambda: create_async_engine(url, **_engine_options(url, workload)))
+
+def get_direct_engine():
+    """Unpooled async connections for session-level state, bypassing PgBouncer if DATABASE_DIRECT_URL is set."""
+    url = async_database_url(Config.DATABASE_DIRECT_URL or database_url())
+    return _get('direct', lambda: create_async_engine(url, poolclass=NullPool))
+
+def async_session(workload):
+    """A session on the async engine of `workload`: 'scheduler' or 'bot'."""
+    factory = _async_sessionmakers.get(workload)
+    if factory is None:
+        factory = _async_sessionmakers[workload] = async_sessionmaker(
+            get_async_engine(workload), autoflush=False, expire_on_commit=False
+        )
+    return factory()
+
+async def dispose_async_engine():
+    for workload, engine in list(_engines.items()):
+        if hasattr(engine, 'sync_engine'):
+            await engine.dispose()
+            del _engines[workload]
+            _async_sessionmakers.pop(workload, None)
+
+def conflict_insert(session, table):
+    """An INSERT into `table` that supports .on_conflict_do_nothing() on the session's database."""
+    # Both dialects spell INSERT ... ON CONFLICT DO NOTHING the same way.
+    dialect = postgresql if session.get_bind().dialect.name == 'postgresql' else sqlite
+    return dialect.insert(table)
 
 Base = declarative_base()
 Base.query = db_session.query_property()
-
-def init_db():
-    import models
-    Base.metadata.create_all(bind=engine)
@@ -0,0 +1,94 @@
+"""Holds on XTR balances for open bids.
+
+A bid reserves its amount with a 'hold' ledger entry, which moves it from
+the user's available funds into their held total; see ledger.py. The check
+and the insert are one INSERT ... SELECT, taken under a lock on the bidder's
+own users row (lock_users), so two bids can't both spend the same balance
+and only bids by the same bidder ever wait on each other.
+
+The functions take the session to run in, so they join the caller's
+transaction: the bid engine's sync session or close_auctions' async one.
+"""
+from sqlalchemy import delete, func, insert, literal, select
+
+import ledger
+from models import BalanceHold, LedgerEntry, User
+
+
+def lock_users(session, user_ids):
+    """Locks the users rows of everyone about to reserve funds in this transaction.
+
+    All at once and in id order, so two transactions with bidders in common
+    wait for each other instead of deadlocking.
+    """
+    session.execute(select(User.id).where(User.id.in_(sorted(user_ids))).order_by(User.id).with_for_update())
+
+
+def reserve(session, user_id, amount, auction_id=None):
+    """Holds `amount` XTR of the user's available funds.
+
+    Returns False, changing nothing, if the user can't cover it. The caller
+    holds lock_users() for the user; the available-funds check happens in
+    the same statement as the insert.
+    """
+    amount = ledger.to_minor(amount)
+    if amount <= 0:
+        return True
+    result = session.execute(
+        insert(LedgerEntry).from_select(
+            ['user_id', 'kind', 'balance_delta', 'held_delta', 'auction_id'],
+            select(
+                literal(user_id), literal(ledger.HOLD), literal(0), literal(amount),
+                literal(auction_id),
+            ).where(ledger.available_minor(user_id) >= amount)
+        )
+    )
+    return result.rowcount == 1
+
+
+def release(session, user_id, amount, auction_id=None):
+    amount = ledger.to_minor(amount)
+    if amount <= 0:
+        return
+    session.execute(ledger.entry(user_id, ledger.RELEASE, held_delta=-amount, auction_id=auction_id))
+
+
+def settle_statements(auction_id, winner_id=None, amount=None, creator_id=None):
+    """Statements that close out every hold on an auction.
+
+    The winner pays `amount` to the creator out of their hold; everyone else
+    gets their hold back. Returned rather than executed so the sync and async
+    sessions can share them.
+    """
+    holds = select(BalanceHold.user_id, BalanceHold.amount).where(BalanceHold.auction_id == auction_id)
+    statements = []
+    if winner_id is not None:
+        winner_hold = (
+            select(BalanceHold.amount)
+            .where(BalanceHold.auction_id == auction_id, BalanceHold.user_id == winner_id)
+            .scalar_subquery()
+        )
+        amount = ledger.to_minor(amount)
+        statements.append(
+            insert(LedgerEntry).from_select(
+                ['user_id', 'kind', 'balance_delta', 'held_delta', 'auction_id'],
+                select(
+                    literal(winner_id), literal(ledger.SETTLEMENT), literal(-amount),
+                    -func.coalesce(ledger.to_minor_sql(winner_hold), 0), literal(auction_id),
+                )
+            )
+        )
+        statements.append(ledger.entry(creator_id, ledger.SETTLEMENT, balance_delta=amount, auction_id=auction_id))
+        holds = holds.where(BalanceHold.user_id != winner_id)
+    holds = holds.subquery()
+    statements.append(
+        insert(LedgerEntry).from_select(
+            ['user_id', 'kind', 'balance_delta', 'held_delta', 'auction_id'],
+            select(
+                holds.c.user_id, literal(ledger.RELEASE), literal(0),
+                -ledger.to_minor_sql(holds.c.amount), literal(auction_id),
+            )
+        )
+    )
+    statements.append(delete(BalanceHold).where(BalanceHold.auction_id == auction_id))
+    return statements
@@ -0,0 +1,58 @@
+"""Streaming CSV and JSON Lines exports.
+
+The rows come from a result executed with yield_per, which on Postgres
+reads through a server-side cursor. Each partition of rows is encoded and
+sent as one chunk of the response, so memory use stays at one chunk
+whatever the size of the table.
+"""
+import csv
+import enum
+import io
+import json
+from datetime import datetime
+
+MIMETYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+# Spreadsheets run cells starting with these as formulas.
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _plain(value):
+    if isinstance(value, enum.Enum):
+        return value.name
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _csv_cell(value):
+    value = _plain(value)
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return f"'{value}"
+    return value
+
+
+def csv_chunks(columns, partitions):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    for rows in partitions:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_csv_cell(value) for value in row] for row in rows)
+        yield buffer.getvalue()
+
+
+def jsonl_chunks(columns, partitions):
+    for rows in partitions:
+        yield ''.join(json.dumps(dict(zip(columns, map(_plain, row)))) + '\n' for row in rows)
+
+
+def chunks(fmt, columns, partitions):
+    """Encodes partitions of rows as `fmt` ('csv' or 'jsonl'), one chunk per partition."""
+    encode = csv_chunks if fmt == 'csv' else jsonl_chunks
+    return encode(columns, partitions)
@@ -1,7 +1,7 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, TextAreaField, FloatField, DateTimeField, SubmitField, SelectField, IntegerField
 from wtforms.validators import DataRequired, Length, NumberRange
-from models import AuctionType
+from models import AuctionType, PricingRule
 
 class AuctionForm(FlaskForm):
     title = StringField('Title', validators=[DataRequired(), Length(max=100)])
@@ -11,6 +11,7 @@ class AuctionForm(FlaskForm):
     auction_type = SelectField('Auction Type', choices=[(t.name, t.value) for t in AuctionType], validators=[DataRequired()])
     dutch_price_decrement = FloatField('Price Decrement (Dutch)', validators=[NumberRange(min=0)])
     dutch_interval = IntegerField('Interval in seconds (Dutch)', validators=[NumberRange(min=1)])
+    pricing_rule = SelectField('Winner Pays (Closed)', choices=[(r.name, r.value) for r in PricingRule], default=PricingRule.FIRST_PRICE.name)
     submit = SubmitField('Create Auction')
 
 class BidForm(FlaskForm):
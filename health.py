@@ -0,0 +1,84 @@
+"""Liveness and readiness of a web process, served at /livez and /readyz (see asgi.py).
+
+/livez only says the event loop is serving requests; an orchestrator
+restarts the process when it fails. /readyz stays 503 until warm_up() has
+opened POOL_WARM_CONNECTIONS connections in the pool of every workload the
+process runs, and after that only passes while the web pool gets an answer
+from the database within READINESS_TIMEOUT. A new worker therefore gets
+traffic once its first requests no longer pay for connecting, and the
+process starts just as fast when the database is down.
+"""
+import asyncio
+import logging
+
+from sqlalchemy import text
+
+from config import Config
+from db import get_async_engine, get_engine
+
+logger = logging.getLogger(__name__)
+
+_warm = False
+
+
+def _warm_web_pool(count):
+    # Held open together so the pool keeps `count` distinct connections.
+    connections = []
+    try:
+        for _ in range(count):
+            connection = get_engine('web').connect()
+            connections.append(connection)
+            connection.execute(text('SELECT 1'))
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+async def _warm_async_pool(workload, count):
+    engine = get_async_engine(workload)
+    connections = []
+    try:
+        for _ in range(count):
+            connection = await engine.connect()
+            connections.append(connection)
+            await connection.execute(text('SELECT 1'))
+    finally:
+        for connection in connections:
+            await connection.close()
+
+
+async def warm_up(workloads=('web',), count=None, retry_seconds=None):
+    """Opens the first connections of the workloads' pools, retrying until the database answers."""
+    global _warm
+    count = Config.POOL_WARM_CONNECTIONS if count is None else count
+    retry_seconds = Config.WARM_UP_RETRY_SECONDS if retry_seconds is None else retry_seconds
+    while True:
+        try:
+            for workload in workloads:
+                if workload == 'web':
+                    await asyncio.get_running_loop().run_in_executor(None, _warm_web_pool, count)
+                else:
+                    await _warm_async_pool(workload, count)
+            break
+        except Exception as e:
+            logger.warning(f"Database not reachable yet, retrying in {retry_seconds}s: {str(e)}")
+            await asyncio.sleep(retry_seconds)
+    _warm = True
+    logger.info(f"Database pools warmed with {count} connections each: {', '.join(workloads)}")
+
+
+def _ping():
+    with get_engine('web').connect() as connection:
+        connection.execute(text('SELECT 1'))
+
+
+async def readiness():
+    """(ready, reason) for /readyz."""
+    if not _warm:
+        return False, 'warming up'
+    try:
+        # Through the pool the pages use: a web pool with no free connection isn't ready.
+        await asyncio.wait_for(asyncio.get_running_loop().run_in_executor(None, _ping), Config.READINESS_TIMEOUT)
+    except Exception as e:
+        return False, f'database check failed: {type(e).__name__}'
+    return True, 'ready'
@@ -0,0 +1,246 @@
+"""Append-only XTR ledger.
+
+Every movement of a user's money is an inserted ledger_entries row with
+integer deltas in minor units: balance_delta for the funds they own and
+held_delta for the part reserved by open bids. Nothing is updated in place.
+
+Balances are read as the user's balance_snapshots row plus the entries after
+it in sequence() order. take_snapshots() folds committed entries into the
+snapshots incrementally without blocking writers; reconcile() rebuilds the
+snapshots that disagree with the full ledger.
+
+    python ledger.py snapshot
+    python ledger.py reconcile
+"""
+import logging
+import sys
+from datetime import datetime
+
+from sqlalchemy import BigInteger, and_, cast, delete, exists, func, insert, literal, select, text, update
+
+from db import async_session, conflict_insert, db_session
+from models import BalanceSnapshot, LedgerEntry, User
+
+logger = logging.getLogger(__name__)
+
+MINOR_UNITS = 100  # ledger units per XTR
+
+OPENING = 'opening'
+TOPUP = 'topup'
+HOLD = 'hold'
+RELEASE = 'release'
+SETTLEMENT = 'settlement'
+ADJUSTMENT = 'adjustment'
+
+
+def to_minor(xtr):
+    return int(round(xtr * MINOR_UNITS))
+
+
+def to_xtr(minor):
+    return minor / MINOR_UNITS
+
+
+def to_minor_sql(column):
+    return cast(func.round(column * MINOR_UNITS), BigInteger)
+
+
+def entry(user_id, kind, balance_delta=0, held_delta=0, auction_id=None, reference=None):
+    """An INSERT for one ledger entry; deltas are in minor units."""
+    return insert(LedgerEntry).values(
+        user_id=user_id,
+        kind=kind,
+        balance_delta=balance_delta,
+        held_delta=held_delta,
+        auction_id=auction_id,
+        reference=reference,
+        created_at=datetime.utcnow(),
+    )
+
+
+def topup_entry(session, user_id, balance_delta, reference):
+    """An INSERT for a top-up that does nothing if `reference` was already credited.
+
+    A redelivered payment update then inserts no row: check the rowcount.
+    """
+    return conflict_insert(session, LedgerEntry).values(
+        user_id=user_id,
+        kind=TOPUP,
+        balance_delta=balance_delta,
+        held_delta=0,
+        reference=reference,
+        created_at=datetime.utcnow(),
+    ).on_conflict_do_nothing(index_elements=['reference'], index_where=text(f"kind = '{TOPUP}'"))
+
+
+def sequence(entries):
+    """The order entries are folded into snapshots in, for a ledger_entries table or alias.
+
+    On PostgreSQL an id is drawn at insert time, so an open transaction can
+    still commit an entry below ids already visible; entries are ordered by
+    their writing transaction instead. SQLite has one writer at a time and
+    commits in id order. Matches ix_ledger_entries_user_id_sequence.
+    """
+    return func.coalesce(entries.c.txid, entries.c.id)
+
+
+def totals(user_id_column):
+    """Snapshot-plus-delta (balance, held) for the user in `user_id_column`."""
+    snapshot = BalanceSnapshot.__table__.alias('snapshot')
+    entries = LedgerEntry.__table__.alias('delta')
+    after_snapshot = and_(
+        entries.c.user_id == user_id_column,
+        # Two levels down: without correlate_except the users table would be
+        # added to this subquery's FROM and the watermark taken from any user.
+        sequence(entries) > func.coalesce(
+            select(snapshot.c.last_sequence).where(snapshot.c.user_id == user_id_column)
+            .correlate_except(snapshot).scalar_subquery(), 0
+        ),
+    )
+
+    def total(snapshot_column, delta_column):
+        return (
+            func.coalesce(select(snapshot_column).where(snapshot.c.user_id == user_id_column).scalar_subquery(), 0)
+            + func.coalesce(select(func.sum(delta_column)).where(after_snapshot).scalar_subquery(), 0)
+        )
+
+    return total(snapshot.c.balance, entries.c.balance_delta), total(snapshot.c.held, entries.c.held_delta)
+
+
+def available_minor(user_id):
+    """Scalar subquery for the funds a user can still commit, in minor units."""
+    balance, held = totals(literal(user_id))
+    return (balance - held).label('available')
+
+
+def balances_stmt(user_ids):
+    balance, held = totals(User.id)
+    return select(User.id, balance.label('balance'), held.label('held')).where(User.id.in_(user_ids))
+
+
+def balances(session, user_ids):
+    """{user_id: (balance, held)} in XTR; works for sync sessions only."""
+    rows = session.execute(balances_stmt(list(user_ids))).all()
+    return {user_id: (to_xtr(balance), to_xtr(held)) for user_id, balance, held in rows}
+
+
+def balance_of(session, user_id):
+    return balances(session, [user_id]).get(user_id, (0, 0))
+
+
+def _cutoff(session):
+    """The highest sequence at or below which every entry has committed."""
+    if session.get_bind().dialect.name == 'postgresql':
+        # Every transaction older than the oldest one still running has
+        # ended, and new ones get higher ids: nothing can appear at or below
+        # this later, and no writer is held up to find it.
+        return session.execute(select(func.txid_snapshot_xmin(func.txid_current_snapshot()) - 1)).scalar()
+    return session.execute(select(func.max(LedgerEntry.id))).scalar()
+
+
+def _advance_statement(cutoff):
+    """Folds each snapshot's entries in (last_sequence, cutoff] into it, for the users that have any."""
+    entries = LedgerEntry.__table__
+    new_entries = and_(
+        entries.c.user_id == BalanceSnapshot.user_id,
+        sequence(entries) > BalanceSnapshot.last_sequence,
+        sequence(entries) <= cutoff,
+    )
+    return (
+        update(BalanceSnapshot)
+        .where(BalanceSnapshot.last_sequence < cutoff, exists().where(new_entries))
+        .values(
+            balance=BalanceSnapshot.balance
+            + func.coalesce(select(func.sum(entries.c.balance_delta)).where(new_entries).scalar_subquery(), 0),
+            held=BalanceSnapshot.held
+            + func.coalesce(select(func.sum(entries.c.held_delta)).where(new_entries).scalar_subquery(), 0),
+            last_sequence=cutoff,
+            taken_at=datetime.utcnow(),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _create_statement(cutoff, user_ids=None):
+    """Snapshots the entries up to `cutoff` of the users without a snapshot, or only of `user_ids`."""
+    entries = LedgerEntry.__table__
+    stmt = select(
+        entries.c.user_id,
+        func.sum(entries.c.balance_delta),
+        func.sum(entries.c.held_delta),
+        literal(cutoff),
+        literal(datetime.utcnow()),
+    ).where(
+        sequence(entries) <= cutoff,
+        ~exists().where(BalanceSnapshot.user_id == entries.c.user_id),
+    ).group_by(entries.c.user_id)
+    if user_ids is not None:
+        stmt = stmt.where(entries.c.user_id.in_(user_ids))
+    return insert(BalanceSnapshot).from_select(['user_id', 'balance', 'held', 'last_sequence', 'taken_at'], stmt)
+
+
+def take_snapshots(session):
+    """Folds committed entries into the snapshots. Returns the new cutoff.
+
+    Runs in the caller's transaction; the caller commits.
+    """
+    cutoff = _cutoff(session)
+    if cutoff is None:
+        return None
+    session.execute(_advance_statement(cutoff))
+    session.execute(_create_statement(cutoff))
+    return cutoff
+
+
+def find_drift(session):
+    """Users whose snapshot-plus-delta totals differ from the full ledger."""
+    entries = LedgerEntry.__table__.alias('full_ledger')
+    by_user = entries.c.user_id == User.id
+    balance, held = totals(User.id)
+    full_balance = func.coalesce(select(func.sum(entries.c.balance_delta)).where(by_user).scalar_subquery(), 0)
+    full_held = func.coalesce(select(func.sum(entries.c.held_delta)).where(by_user).scalar_subquery(), 0)
+    stmt = select(User.id).where((balance != full_balance) | (held != full_held)).order_by(User.id)
+    return session.execute(stmt).scalars().all()
+
+
+def reconcile(session):
+    """Rebuilds the snapshots that disagree with the full ledger. Returns those users.
+
+    Runs in the caller's transaction; the caller commits.
+    """
+    drifted = find_drift(session)
+    if not drifted:
+        return drifted
+    logger.warning(f"{len(drifted)} users' snapshots disagree with the ledger: {drifted[:20]}")
+    cutoff = _cutoff(session)
+    session.execute(delete(BalanceSnapshot).where(BalanceSnapshot.user_id.in_(drifted)))
+    session.execute(_create_statement(cutoff, drifted))
+    logger.info(f"Rebuilt {len(drifted)} balance snapshots up to sequence {cutoff}")
+    return drifted
+
+
+async def take_snapshots_async():
+    async with async_session('scheduler') as session:
+        cutoff = await session.run_sync(take_snapshots)
+        await session.commit()
+    logger.info(f"Balance snapshots taken up to sequence {cutoff}")
+
+
+async def reconcile_async():
+    async with async_session('scheduler') as session:
+        drifted = await session.run_sync(reconcile)
+        await session.commit()
+    return drifted
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else 'snapshot'
+    if command == 'reconcile':
+        drifted = reconcile(db_session)
+        db_session.commit()
+        print(f"{len(drifted)} users had drifted")
+    else:
+        cutoff = take_snapshots(db_session)
+        db_session.commit()
+        print(f"Snapshots taken up to sequence {cutoff}")
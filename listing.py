@@ -0,0 +1,88 @@
+import logging
+from datetime import datetime
+
+from flask import render_template
+from sqlalchemy import tuple_
+
+from cache import LRUCache
+from config import Config
+from db import db_session
+from models import Auction
+
+logger = logging.getLogger(__name__)
+
+ACTIVE = 'active'
+INACTIVE = 'inactive'
+
+# Rendered listing fragments keyed by (section, cursor). Each entry is tagged
+# with the auctions it shows so a bid or close only drops the pages it touches.
+fragment_cache = LRUCache(maxsize=Config.LISTING_CACHE_SIZE, ttl=Config.LISTING_CACHE_TTL)
+
+
+def encode_cursor(auction):
+    return f"{auction.end_time.isoformat()}_{auction.id}"
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        end_time, auction_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(end_time), int(auction_id)
+    except ValueError:
+        return None
+
+
+def auctions_page(section, cursor=None, limit=None):
+    """Returns one keyset page of auctions and the cursor of the next page.
+
+    Active auctions are listed soonest-ending first, inactive ones most
+    recently ended first, both with id as the tie breaker.
+    """
+    limit = limit or Config.LISTING_PAGE_SIZE
+    query = db_session.query(Auction).filter(Auction.is_active == (section == ACTIVE))
+    key = tuple_(Auction.end_time, Auction.id)
+    after = decode_cursor(cursor)
+
+    if section == ACTIVE:
+        if after:
+            query = query.filter(key > tuple_(*after))
+        query = query.order_by(Auction.end_time.asc(), Auction.id.asc())
+    else:
+        if after:
+            query = query.filter(key < tuple_(*after))
+        query = query.order_by(Auction.end_time.desc(), Auction.id.desc())
+
+    auctions = query.limit(limit + 1).all()
+    next_cursor = encode_cursor(auctions[limit - 1]) if len(auctions) > limit else None
+    return auctions[:limit], next_cursor
+
+
+def render_section(section, cursor=None):
+    """Returns (html, next_cursor) for a listing page, from the cache if possible."""
+    key = (section, cursor or '')
+    cached = fragment_cache.get(key)
+    if cached is not None:
+        return cached
+
+    auctions, next_cursor = auctions_page(section, cursor)
+    html = render_template(f'{section}_auctions.html', auctions=auctions)
+    tags = [section] + [f"auction:{auction.id}" for auction in auctions]
+    fragment_cache.set(key, (html, next_cursor), tags=tags)
+    return html, next_cursor
+
+
+def invalidate_auction(auction_id):
+    """A bid or price change on this auction: drop the pages that show it."""
+    fragment_cache.invalidate(f"auction:{auction_id}")
+
+
+def invalidate_new_auction():
+    """A new auction can land on any active page."""
+    fragment_cache.invalidate(ACTIVE)
+
+
+def invalidate_closed_auction(auction_id):
+    """A closed auction leaves the active pages and can land on any inactive page."""
+    fragment_cache.invalidate(f"auction:{auction_id}")
+    fragment_cache.invalidate(INACTIVE)
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import logging
+import threading
+import uuid
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class LiveEvent:
+    __slots__ = ('id', 'type', 'payload')
+
+    def __init__(self, token, event_id, event_type, data):
+        self.id = event_id
+        self.type = event_type
+        # Encoded once here and shared by every subscriber of the auction.
+        self.payload = (
+            f"id: {token}-{event_id}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n"
+        ).encode()
+
+
+class _Channel:
+    def __init__(self, history_size):
+        self.last_id = 0
+        self.history = deque(maxlen=history_size)
+        self.subscribers = set()
+
+
+class LiveBroker:
+    """Fans out auction events to server-sent-event subscribers.
+
+    publish() may be called from any thread (bid engine shards, scheduler
+    jobs); delivery to the subscriber queues happens on the event loop that
+    serves the streams. Each auction keeps a short history so a reconnecting
+    client can resume from its Last-Event-ID. With a relay attached (see
+    cluster.EventRelay) events are also passed to the other processes.
+
+    Every process numbers the events it delivers itself, so event ids carry
+    the broker's token and a client that reconnects to another process is
+    told to reset instead of resuming from a number that means nothing here.
+    """
+
+    def __init__(self, history_size=100, max_channels=1000, queue_size=100):
+        self.history_size = history_size
+        self.max_channels = max_channels
+        self.queue_size = queue_size
+        self._channels = OrderedDict()
+        self._lock = threading.Lock()
+        self._loop = None
+        self.relay = None
+        self.token = uuid.uuid4().hex[:8]
+
+    def _channel(self, auction_id):
+        channel = self._channels.get(auction_id)
+        if channel is None:
+            channel = self._channels[auction_id] = _Channel(self.history_size)
+            self._evict_idle_channels()
+        else:
+            self._channels.move_to_end(auction_id)
+        return channel
+
+    def _evict_idle_channels(self):
+        if len(self._channels) <= self.max_channels:
+            return
+        for auction_id, channel in list(self._channels.items()):
+            if len(self._channels) <= self.max_channels:
+                break
+            if not channel.subscribers:
+                del self._channels[auction_id]
+
+    def publish(self, auction_id, event_type, data):
+        self.publish_local(auction_id, event_type, data)
+        if self.relay is not None:
+            self.relay.send(auction_id, event_type, data)
+
+    def publish_local(self, auction_id, event_type, data):
+        with self._lock:
+            channel = self._channel(auction_id)
+            channel.last_id += 1
+            event = LiveEvent(self.token, channel.last_id, event_type, data)
+            channel.history.append(event)
+            subscribers = list(channel.subscribers)
+        if subscribers and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._deliver, subscribers, event)
+
+    def _deliver(self, subscribers, event):
+        for queue in subscribers:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # A stalled client is disconnected and resumes from its last event id.
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    def _parse_event_id(self, last_event_id):
+        """The event number in a Last-Event-ID this broker issued, else None."""
+        token, _, number = last_event_id.partition('-')
+        if token != self.token or not number.isdigit():
+            return None
+        return int(number)
+
+    @asynccontextmanager
+    async def subscribe(self, auction_id, last_event_id=None):
+        """Yields (reset, backlog, queue) for one stream of an auction.
+
+        last_event_id is the raw Last-Event-ID header. reset is True when it
+        was issued by another process or is older than the kept history, in
+        which case the client should reload the bid list once.
+        """
+        self._loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        with self._lock:
+            channel = self._channel(auction_id)
+            channel.subscribers.add(queue)
+            reset, backlog = False, []
+            if last_event_id:
+                last_id = self._parse_event_id(last_event_id)
+                oldest = channel.history[0].id if channel.history else channel.last_id + 1
+                if last_id is None or last_id > channel.last_id or last_id < oldest - 1:
+                    reset = True
+                else:
+                    backlog = [event for event in channel.history if event.id > last_id]
+        try:
+            yield reset, backlog, queue
+        finally:
+            with self._lock:
+                channel.subscribers.discard(queue)
+
+
+live_broker = LiveBroker()
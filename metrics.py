@@ -0,0 +1,269 @@
+"""In-process metrics, served at /metrics in the Prometheus text format.
+
+Counters and histograms are plain dicts behind a lock, keyed by label
+values, so recording costs a dict lookup and an addition. Every process
+keeps its own numbers; Prometheus scrapes each web process and sums them.
+
+instrument_app() times every Flask route, records the SQL each request
+ran as query_budget.py counted it, and checks it against the route's
+budget. instrument_engine() times each statement and pool checkout, per
+workload pool (see db.py), and the pools' occupancy is read at scrape
+time. Jobs and the notification dispatcher record into the metrics
+defined here directly.
+"""
+import bisect
+import functools
+import math
+import threading
+import time
+
+from flask import request
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+import query_budget
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+registry = []
+
+
+def _format(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            samples = list(self._samples())
+        lines += [f"{name}{labels} {_format(value)}" for name, labels, value in samples]
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def _samples(self):
+        for labels, value in self._values.items():
+            yield f"{self.name}_total", _labels(self.labelnames, labels), value
+
+
+class Gauge(_Metric):
+    """A value read when /metrics is scraped: `callback` returns {label values: value}."""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def _samples(self):
+        try:
+            values = self.callback() if self.callback else {}
+        except Exception:
+            values = {}
+        for labels, value in values.items():
+            yield self.name, _labels(self.labelnames, labels), value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # One count per bucket plus +Inf, then the sum.
+                series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, *labels):
+        series = self._values.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def _samples(self):
+        for labels, series in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series):
+                cumulative += count
+                yield f"{self.name}_bucket", _labels(self.labelnames, labels, f'le="{_format(bound)}"'), cumulative
+            yield f"{self.name}_sum", _labels(self.labelnames, labels), series[-1]
+            yield f"{self.name}_count", _labels(self.labelnames, labels), cumulative
+
+
+def render():
+    return '\n'.join(metric.render() for metric in registry) + '\n'
+
+
+HTTP_REQUESTS = Counter('tauction_http_requests', 'Requests served by Flask.', ('method', 'route', 'status'))
+HTTP_LATENCY = Histogram('tauction_http_request_duration_seconds', 'Time to produce a response.', ('method', 'route'))
+REQUEST_SQL_STATEMENTS = Histogram(
+    'tauction_http_request_sql_statements', 'SQL statements run by one request.', ('route',), COUNT_BUCKETS
+)
+REQUEST_SQL_SECONDS = Histogram('tauction_http_request_sql_seconds', 'Time one request spent in SQL.', ('route',))
+SQL_STATEMENTS = Histogram(
+    'tauction_sql_statement_duration_seconds', 'SQL statements, by workload pool.', ('pool', 'operation'), FAST_BUCKETS
+)
+POOL_CHECKOUT_WAIT = Histogram(
+    'tauction_db_pool_checkout_wait_seconds', 'Time waiting for a pooled connection.', ('pool',), FAST_BUCKETS
+)
+POOL_TIMEOUTS = Counter(
+    'tauction_db_pool_timeouts', 'Checkouts that gave up after the pool timeout.', ('pool',)
+)
+JOB_DURATION = Histogram('tauction_job_duration_seconds', 'Background job run time.', ('job',))
+JOB_FAILURES = Counter('tauction_job_failures', 'Background job runs that raised.', ('job',))
+JOB_ROWS = Counter('tauction_job_rows', 'Rows changed by background jobs.', ('job',))
+NOTIFICATION_SEND = Histogram('tauction_notification_send_seconds', 'Telegram send_message calls.', ('result',))
+NOTIFICATION_DELIVERY = Histogram(
+    'tauction_notification_delivery_seconds', 'From enqueue to the final outcome, retries included.', ('status',),
+    DEFAULT_BUCKETS + (30, 60, 300),
+)
+NOTIFICATION_ERRORS = Counter('tauction_notification_errors', 'Failed send_message calls.', ('error',))
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def instrument_app(app):
+    @app.before_request
+    def start_timer():
+        request.environ['tauction.started'] = time.perf_counter()
+        request.environ['tauction.sql'] = query_budget.start()
+
+    @app.after_request
+    def record_request(response):
+        started = request.environ.get('tauction.started')
+        counter = request.environ.get('tauction.sql')
+        if started is not None:
+            route = _route()
+            HTTP_LATENCY.observe(time.perf_counter() - started, request.method, route)
+            HTTP_REQUESTS.inc(request.method, route, response.status_code)
+            REQUEST_SQL_STATEMENTS.observe(counter.statements, route)
+            REQUEST_SQL_SECONDS.observe(counter.seconds, route)
+            query_budget.check_request(counter, route)
+        return response
+
+    @app.teardown_request
+    def stop_counting(exception=None):
+        counter = request.environ.pop('tauction.sql', None)
+        if counter is not None:
+            query_budget.stop(counter)
+
+
+def _operation(statement):
+    words = statement[:32].split(None, 1)
+    return words[0].upper() if words else ''
+
+
+def instrument_engine(engine, workload='web'):
+    """Times the engine's statements and checkouts, and reports its pool, under `workload`."""
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._tauction_started = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, '_tauction_started', None)
+        if started is None:
+            return
+        SQL_STATEMENTS.observe(time.perf_counter() - started, workload, _operation(statement))
+
+    if isinstance(engine.pool, QueuePool):
+        _time_checkouts(engine.pool, workload)
+        _pools[workload] = engine.pool
+
+
+def _time_checkouts(pool, workload):
+    # QueuePool._do_get is where a checkout blocks when the pool is
+    # exhausted; the async pools block there too, on the event loop.
+    do_get = pool._do_get
+
+    @functools.wraps(do_get)
+    def timed_do_get():
+        started = time.perf_counter()
+        try:
+            return do_get()
+        except exc.TimeoutError:
+            POOL_TIMEOUTS.inc(workload)
+            raise
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started, workload)
+
+    pool._do_get = timed_do_get
+
+
+_pools = {}
+
+
+def _pool_stats():
+    stats = {}
+    for workload, pool in list(_pools.items()):
+        stats[(workload, 'size')] = pool.size()
+        stats[(workload, 'checked_out')] = pool.checkedout()
+        stats[(workload, 'idle')] = pool.checkedin()
+        stats[(workload, 'overflow')] = max(pool.overflow(), 0)
+        # The most connections the pool will open; checked_out at this means waits.
+        stats[(workload, 'max')] = pool.size() + max(pool._max_overflow, 0)
+    return stats
+
+
+POOL_CONNECTIONS = Gauge(
+    'tauction_db_pool_connections', 'Connections of each workload pool, by state.', ('pool', 'state'), _pool_stats
+)
+
+
+def timed_job(name):
+    """Decorates an async job so each run records its duration, and failures."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def run(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                JOB_FAILURES.inc(name)
+                raise
+            finally:
+                JOB_DURATION.observe(time.perf_counter() - started, name)
+        return run
+    return decorator
@@ -1,9 +1,10 @@
 import enum
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean, Enum, Table
+import math
+from sqlalchemy import BigInteger, Column, DDL, Integer, String, Float, DateTime, ForeignKey, Boolean, Enum, Table, Index, event, false, func, literal, text
 from sqlalchemy.orm import relationship
 from flask_login import UserMixin
 from db import Base
-from datetime import datetime
+from datetime import datetime, timedelta
 
 class AuctionType(enum.Enum):
     ENGLISH = "English"
@@ -11,9 +12,14 @@ class AuctionType(enum.Enum):
     CLOSED = "Closed"
     EVERLASTING = "Everlasting"
 
+class PricingRule(enum.Enum):
+    """What the winner of a sealed-bid (Closed) auction pays; see sealed.py."""
+    FIRST_PRICE = "First price"
+    SECOND_PRICE = "Second price"
+
 watchlist = Table('watchlist', Base.metadata,
-    Column('user_id', Integer, ForeignKey('users.id')),
-    Column('auction_id', Integer, ForeignKey('auctions.id'))
+    Column('user_id', Integer, ForeignKey('users.id'), primary_key=True),
+    Column('auction_id', Integer, ForeignKey('auctions.id'), primary_key=True, index=True)
 )
 
 class User(UserMixin, Base):
@@ -23,11 +29,32 @@ class User(UserMixin, Base):
     email = Column(String(120), index=True, unique=True)
     password_hash = Column(String(128))
     telegram_id = Column(String(64), unique=True)
-    xtr_balance = Column(Float, default=0.0)
     auctions = relationship('Auction', back_populates='creator')
     bids = relationship('Bid', back_populates='bidder')
     watchlist = relationship('Auction', secondary=watchlist, back_populates='watchers')
     is_active = Column(Boolean, default=True)  # Добавлено поле is_active
+    is_admin = Column(Boolean, nullable=False, default=False, server_default=false())
+
+def dutch_price(starting_price, decrement, interval, start_time, now=None):
+    """The price of a Dutch auction at a given moment.
+
+    The price drops by `decrement` every `interval` seconds after `start_time`
+    and never goes below zero. Both the pages and the bid engine use this, so
+    the price shown is always the price accepted.
+    """
+    now = now or datetime.utcnow()
+    if not decrement or not interval or now <= start_time:
+        return starting_price
+    intervals_passed = int((now - start_time).total_seconds() // interval)
+    return max(0, round(starting_price - intervals_passed * decrement, 2))
+
+
+def dutch_end_time(starting_price, decrement, interval, start_time):
+    """When a Dutch auction's price reaches zero, or None if it never does."""
+    if not decrement or not interval:
+        return None
+    return start_time + timedelta(seconds=math.ceil(starting_price / decrement) * interval)
+
 
 class Auction(Base):
     __tablename__ = 'auctions'
@@ -36,6 +63,7 @@ class Auction(Base):
     description = Column(String(500))
     starting_price = Column(Float, nullable=False)
     current_price = Column(Float, nullable=False)
+    start_time = Column(DateTime, default=datetime.utcnow)
     end_time = Column(DateTime, nullable=False)
     is_active = Column(Boolean, default=True)
     creator_id = Column(Integer, ForeignKey('users.id'))
@@ -43,9 +71,31 @@ class Auction(Base):
     bids = relationship('Bid', back_populates='auction')
     watchers = relationship('User', secondary=watchlist, back_populates='watchlist')
     auction_type = Column(Enum(AuctionType), nullable=False)
-    current_dutch_price = Column(Float)
     dutch_price_decrement = Column(Float)
     dutch_interval = Column(Integer)  # Interval in seconds
+    pricing_rule = Column(Enum(PricingRule), nullable=False, default=PricingRule.FIRST_PRICE,
+                          server_default=PricingRule.FIRST_PRICE.name)
+    # Maintained by the bid engine in the same transaction as the bid insert;
+    # see consistency.py for the checker. Left empty on sealed lots until
+    # they are resolved at the close.
+    highest_bid_id = Column(Integer)
+    highest_bid_amount = Column(Float)
+    bid_count = Column(Integer, nullable=False, default=0, server_default='0')
+    last_bid_at = Column(DateTime)
+    # Bumped by every write that changes what the bid history API shows;
+    # served as its ETag (see bid_history.py).
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+
+    @property
+    def current_dutch_price(self):
+        if self.auction_type != AuctionType.DUTCH:
+            return None
+        return dutch_price(self.starting_price, self.dutch_price_decrement, self.dutch_interval, self.start_time)
+
+    @property
+    def bids_sealed(self):
+        """Whether bid amounts must stay hidden: a Closed lot that hasn't been resolved."""
+        return self.auction_type == AuctionType.CLOSED and bool(self.is_active)
 
 class Bid(Base):
     __tablename__ = 'bids'
@@ -57,9 +107,94 @@ class Bid(Base):
     auction_id = Column(Integer, ForeignKey('auctions.id'))
     auction = relationship('Auction', back_populates='bids')
 
+# Winning bid / detail page (highest first) and bids API (newest first).
+Index('ix_bids_auction_id_amount', Bid.auction_id, Bid.amount.desc())
+Index('ix_bids_auction_id_timestamp', Bid.auction_id, Bid.timestamp.desc())
+Index('ix_bids_bidder_id', Bid.bidder_id)
+# Listing pages and the close scheduler only ever read one side of is_active,
+# ordered by (end_time, id); partial indexes keep each side small.
+Index('ix_auctions_active_end_time', Auction.end_time, Auction.id,
+      postgresql_where=text('is_active'), sqlite_where=text('is_active = 1'))
+Index('ix_auctions_inactive_end_time', Auction.end_time, Auction.id,
+      postgresql_where=text('NOT is_active'), sqlite_where=text('is_active = 0'))
+Index('ix_auctions_creator_id', Auction.creator_id)
+# Watcher alerts look up the running lots bid on since their last run.
+Index('ix_auctions_active_last_bid_at', Auction.last_bid_at,
+      postgresql_where=text('is_active'), sqlite_where=text('is_active = 1'))
+
+# Text search (see search.py). Titles weigh more than descriptions. Queries
+# must use this exact expression, constants rendered inline, for Postgres to
+# match it to the GIN index; SQLite searches an in-process index instead.
+SEARCH_CONFIG = 'simple'  # no stemming: lots are listed in several languages
+
+
+def _inline(value):
+    return literal(value, literal_execute=True)
+
+
+auction_search_document = func.setweight(
+    func.to_tsvector(_inline(SEARCH_CONFIG), func.coalesce(Auction.title, _inline(''))), _inline('A')
+).op('||')(func.setweight(
+    func.to_tsvector(_inline(SEARCH_CONFIG), func.coalesce(Auction.description, _inline(''))), _inline('B')
+))
+Index('ix_auctions_search', auction_search_document, postgresql_using='gin').ddl_if(dialect='postgresql')
+
+class BalanceHold(Base):
+    """Funds a user has reserved for their open bids on one auction."""
+    __tablename__ = 'balance_holds'
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    auction_id = Column(Integer, ForeignKey('auctions.id'), primary_key=True, index=True)
+    amount = Column(Float, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class LedgerEntry(Base):
+    """One append-only movement of a user's XTR, in minor units (see ledger.py)."""
+    __tablename__ = 'ledger_entries'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    kind = Column(String(16), nullable=False)  # opening / topup / hold / release / settlement / adjustment
+    balance_delta = Column(BigInteger, nullable=False, default=0)
+    held_delta = Column(BigInteger, nullable=False, default=0)
+    auction_id = Column(Integer, ForeignKey('auctions.id'))
+    reference = Column(String(128))  # e.g. the Telegram payment charge id
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # The writing transaction's id on PostgreSQL (a column default); NULL on
+    # SQLite, where entries commit in id order. See ledger.sequence().
+    txid = Column(BigInteger)
+
+event.listen(LedgerEntry.__table__, 'after_create', DDL(
+    "ALTER TABLE ledger_entries ALTER COLUMN txid SET DEFAULT txid_current()"
+).execute_if(dialect='postgresql'))
+# Balance reads sum a user's entries after their snapshot.
+Index('ix_ledger_entries_user_id_sequence', LedgerEntry.user_id, func.coalesce(LedgerEntry.txid, LedgerEntry.id))
+# A Telegram payment is credited once, however often its update is delivered.
+Index('uq_ledger_entries_topup_reference', LedgerEntry.reference, unique=True,
+      postgresql_where=text("kind = 'topup'"), sqlite_where=text("kind = 'topup'"))
+
+
+class BalanceSnapshot(Base):
+    """A user's ledger totals over the entries up to and including last_sequence."""
+    __tablename__ = 'balance_snapshots'
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    balance = Column(BigInteger, nullable=False, default=0)
+    held = Column(BigInteger, nullable=False, default=0)
+    last_sequence = Column(BigInteger, nullable=False, default=0)
+    taken_at = Column(DateTime, default=datetime.utcnow)
+
 class Subscriber(Base):
     __tablename__ = 'subscribers'
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     subscription_end = Column(DateTime)
 
+
+class Notification(Base):
+    __tablename__ = 'notifications'
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(String(64), index=True)
+    message = Column(String(4096))
+    status = Column(String(16), nullable=False)  # sent / failed
+    attempts = Column(Integer, default=0)
+    last_error = Column(String(500))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime)
@@ -0,0 +1,262 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import insert
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from config import Config
+from db import async_session
+from models import Notification
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self):
+        """Seconds until a token is available; takes it if one is available now."""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def pause(self, seconds):
+        """Empties the bucket so no token is handed out for `seconds`."""
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+    @property
+    def idle(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+@dataclass
+class OutgoingMessage:
+    chat_id: int
+    text: str
+    attempts: int = 0
+    last_error: Optional[str] = None
+    created_at: datetime = field(default_factory=datetime.utcnow)
+
+
+class NotificationDispatcher:
+    """Delivers Telegram messages from an in-process outbox.
+
+    Producers call enqueue() from any thread and return at once. A fixed
+    number of workers send the messages, throttled by a global and a per-chat
+    token bucket sized to Telegram's limits. Flood-control and network errors
+    are retried with backoff; the final outcome of every message is written
+    to the notifications table in batches.
+    """
+
+    def __init__(self, bot=None, concurrency=8, global_rate=30, per_chat_rate=1,
+                 max_attempts=5, base_backoff=1, flush_interval=1):
+        self.bot = bot
+        self.concurrency = concurrency
+        self.per_chat_rate = per_chat_rate
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.flush_interval = flush_interval
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_buckets = {}
+        self.sent_count = 0
+        self.failed_count = 0
+        self._queue = None
+        self._loop = None
+        self._idle = None
+        self._in_flight = 0
+        self._pending = []
+        self._outcomes = []
+        self._tasks = []
+
+    def enqueue(self, chat_id, text):
+        message = OutgoingMessage(int(chat_id), text)
+        if self._loop is None:
+            self._pending.append(message)
+        else:
+            self._loop.call_soon_threadsafe(self._accept, message)
+
+    def enqueue_many(self, messages):
+        """Queues (chat_id, text) pairs with one hand-off to the event loop."""
+        messages = [OutgoingMessage(int(chat_id), text) for chat_id, text in messages]
+        if not messages:
+            return
+        if self._loop is None:
+            self._pending.extend(messages)
+        else:
+            self._loop.call_soon_threadsafe(self._accept_all, messages)
+
+    def _accept_all(self, messages):
+        for message in messages:
+            self._accept(message)
+
+    def _accept(self, message):
+        self._in_flight += 1
+        self._idle.clear()
+        self._queue.put_nowait(message)
+
+    def start(self, bot=None):
+        if bot is not None:
+            self.bot = bot
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        for message in self._pending:
+            self._accept(message)
+        self._pending = []
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.concurrency)]
+        self._tasks.append(asyncio.ensure_future(self._flusher()))
+        logger.info(f"Notification dispatcher started with {self.concurrency} workers")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._flush_outcomes()
+
+    async def join(self):
+        """Waits until every queued message has been delivered or given up on."""
+        await self._idle.wait()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10000:
+                self.chat_buckets = {k: v for k, v in self.chat_buckets.items() if not v.idle}
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, capacity=1)
+        return bucket
+
+    async def _throttle(self, chat_id):
+        # The per-chat bucket is checked last so its spacing holds at send time.
+        for bucket in (self.global_bucket, self._chat_bucket(chat_id)):
+            while True:
+                delay = bucket.delay()
+                if not delay:
+                    break
+                await asyncio.sleep(delay)
+
+    async def _worker(self):
+        while True:
+            message = await self._queue.get()
+            try:
+                await self._deliver(message)
+            except Exception as e:
+                self._finish(message, 'failed', str(e))
+
+    async def _deliver(self, message):
+        if self.bot is None:
+            logger.error("Telegram application is not initialized.")
+            self._finish(message, 'failed')
+            return
+
+        await self._throttle(message.chat_id)
+        message.attempts += 1
+        try:
+            await self._send(message)
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            if isinstance(retry_after, timedelta):
+                retry_after = retry_after.total_seconds()
+            # Flood control applies to the whole bot, not just this chat.
+            self.global_bucket.pause(retry_after)
+            self._retry(message, str(e), retry_after)
+        except (BadRequest, Forbidden) as e:
+            self._finish(message, 'failed', str(e))
+        except NetworkError as e:
+            self._retry(message, str(e), self.base_backoff * 2 ** (message.attempts - 1))
+        except Exception as e:
+            logger.error(f"Error sending notification to user {message.chat_id}: {str(e)}")
+            self._finish(message, 'failed', str(e))
+        else:
+            logger.info(f"Notification sent to user {message.chat_id}")
+            self._finish(message, 'sent')
+
+    async def _send(self, message):
+        started = time.perf_counter()
+        result = 'error'
+        try:
+            await self.bot.send_message(chat_id=message.chat_id, text=message.text)
+            result = 'ok'
+        except Exception as e:
+            metrics.NOTIFICATION_ERRORS.inc(type(e).__name__)
+            raise
+        finally:
+            metrics.NOTIFICATION_SEND.observe(time.perf_counter() - started, result)
+
+    def _retry(self, message, error, delay):
+        message.last_error = error
+        if message.attempts >= self.max_attempts:
+            self._finish(message, 'failed', error)
+            return
+        logger.warning(f"Retrying notification to user {message.chat_id} in {delay}s: {error}")
+        # Re-queued with a delay instead of sleeping, so the worker stays free.
+        self._loop.call_later(delay, self._queue.put_nowait, message)
+
+    @property
+    def in_flight(self):
+        return self._in_flight + len(self._pending)
+
+    def _finish(self, message, status, error=None):
+        self._in_flight -= 1
+        metrics.NOTIFICATION_DELIVERY.observe((datetime.utcnow() - message.created_at).total_seconds(), status)
+        if not self._in_flight:
+            self._idle.set()
+        if status == 'sent':
+            self.sent_count += 1
+        else:
+            self.failed_count += 1
+            logger.error(f"Giving up on notification to user {message.chat_id}: {error}")
+        self._outcomes.append({
+            'chat_id': str(message.chat_id),
+            'message': message.text,
+            'status': status,
+            'attempts': message.attempts,
+            'last_error': (error or message.last_error or '')[:500] or None,
+            'created_at': message.created_at,
+            'finished_at': datetime.utcnow(),
+        })
+
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush_outcomes()
+
+    async def _flush_outcomes(self):
+        outcomes, self._outcomes = self._outcomes, []
+        if not outcomes:
+            return
+        try:
+            async with async_session('bot') as session:
+                await session.execute(insert(Notification), outcomes)
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Failed to record {len(outcomes)} notification outcomes: {str(e)}")
+
+
+dispatcher = NotificationDispatcher(
+    concurrency=Config.NOTIFY_CONCURRENCY,
+    global_rate=Config.NOTIFY_GLOBAL_RATE,
+    per_chat_rate=Config.NOTIFY_CHAT_RATE,
+    max_attempts=Config.NOTIFY_MAX_ATTEMPTS,
+)
+metrics.Gauge('tauction_notification_in_flight', 'Notifications queued or being retried.',
+              callback=lambda: {(): dispatcher.in_flight})
@@ -0,0 +1,81 @@
+"""The logged-in user as flask_login sees it, cached per process.
+
+load_user used to fetch the full users row on every authenticated request,
+bid API polls included. Requests only need a few fields of it, so those are
+kept in a UserPrincipal in an LRU cache with a TTL. Whatever changes one of
+these fields calls user_cache.invalidate(user_id). With a relay attached
+(see cluster.PrincipalRelay) the invalidation reaches the other processes
+too. Everything else, balances included, is read fresh by the routes that
+need it.
+"""
+import logging
+
+from sqlalchemy import select
+
+from cache import LRUCache
+from config import Config
+from db import db_session
+from models import User
+
+logger = logging.getLogger(__name__)
+
+
+class UserPrincipal:
+    """What a request needs to know about its user."""
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, id, username, telegram_id, is_active, is_admin):
+        self.id = id
+        self.username = username
+        self.telegram_id = telegram_id
+        self.is_active = is_active
+        self.is_admin = is_admin
+
+    def get_id(self):
+        return str(self.id)
+
+    def __eq__(self, other):
+        if isinstance(other, (UserPrincipal, User)):
+            return self.get_id() == other.get_id()
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class PrincipalCache:
+    def __init__(self, maxsize=10000, ttl=60):
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.relay = None
+
+    def get(self, user_id):
+        principal = self._cache.get(user_id)
+        if principal is None:
+            principal = self._load(user_id)
+            if principal is not None:
+                self._cache.set(user_id, principal)
+        return principal
+
+    def _load(self, user_id):
+        row = db_session.execute(
+            select(User.id, User.username, User.telegram_id, User.is_active, User.is_admin).where(User.id == user_id)
+        ).first()
+        if row is None:
+            return None
+        return UserPrincipal(*row)
+
+    def invalidate(self, user_id):
+        self.invalidate_local(user_id)
+        if self.relay is not None:
+            self.relay.send(user_id)
+
+    def invalidate_local(self, user_id):
+        self._cache.delete(user_id)
+
+    def clear(self):
+        self._cache.clear()
+
+
+user_cache = PrincipalCache(Config.USER_CACHE_SIZE, Config.USER_CACHE_TTL)
@@ -0,0 +1,99 @@
+"""Per-request SQL statement counts and query budgets.
+
+instrument_engine() counts the statements run on an engine (every workload's,
+see app.create_app). Each counting() block sees the statements its own
+thread runs inside it, so it works around a whole request or a single call
+in a test.
+
+Every Flask request runs in a counting() block (see metrics.instrument_app)
+and is checked against its route's budget: @query_budget.budget(n) on the
+view, or Config.QUERY_BUDGET. Going over logs a warning, or raises
+QueryBudgetExceeded if the app's QUERY_BUDGET_STRICT is set, as the tests
+do. A page whose cost grows with the rows it shows (an N+1 lazy load)
+quickly goes over.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, request
+from sqlalchemy import event
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class StatementCounter:
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+
+
+def start():
+    counter = StatementCounter()
+    _local.__dict__.setdefault('counters', []).append(counter)
+    return counter
+
+
+def stop(counter):
+    counters = getattr(_local, 'counters', [])
+    if counter in counters:
+        counters.remove(counter)
+
+
+@contextmanager
+def counting():
+    counter = start()
+    try:
+        yield counter
+    finally:
+        stop(counter)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and getattr(_local, 'counters', None):
+        context._query_budget_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_budget_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    for counter in getattr(_local, 'counters', ()):
+        counter.statements += 1
+        counter.seconds += elapsed
+
+
+def instrument_engine(engine, workload=None):
+    # Safe to call again on the same engine: statements are counted once.
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def budget(limit):
+    """Sets the number of SQL statements one request to the view may run."""
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+def check_request(counter, route):
+    view = current_app.view_functions.get(request.endpoint)
+    budget = getattr(view, 'query_budget', Config.QUERY_BUDGET)
+    if counter.statements <= budget:
+        return
+    message = f"{request.method} {route} ran {counter.statements} SQL statements, over its budget of {budget}"
+    if current_app.config.get('QUERY_BUDGET_STRICT'):
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
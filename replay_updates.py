@@ -0,0 +1,58 @@
+"""POSTs recorded Telegram updates to the bot's webhook endpoint.
+
+Each argument is a JSON file holding one update, or a .jsonl file with one
+update per line. Updates are sent in order, the way Telegram would:
+
+    BOT_MODE=webhook TELEGRAM_WEBHOOK_SECRET=dev python app.py
+    TELEGRAM_WEBHOOK_SECRET=dev python replay_updates.py updates.jsonl
+"""
+import argparse
+import json
+import os
+import urllib.error
+import urllib.request
+
+
+def load_updates(paths):
+    for path in paths:
+        with open(path) as f:
+            if path.endswith('.jsonl'):
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+            else:
+                yield json.load(f)
+
+
+def post_update(url, secret, update):
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(update).encode(),
+        headers={'Content-Type': 'application/json', 'X-Telegram-Bot-Api-Secret-Token': secret},
+        method='POST',
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--url', default=f"http://localhost:{os.getenv('PORT', '5000')}"
+                        f"{os.getenv('TELEGRAM_WEBHOOK_PATH', '/telegram/webhook')}")
+    parser.add_argument('--secret', default=os.getenv('TELEGRAM_WEBHOOK_SECRET', ''))
+    args = parser.parse_args()
+
+    failed = 0
+    for update in load_updates(args.paths):
+        status = post_update(args.url, args.secret, update)
+        print(f"update {update.get('update_id')}: {status}")
+        failed += status != 200
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,9 @@
 import os
 import shutil
 from flask_migrate import Migrate, init, migrate, upgrade
-from app import app, db_session
+from app import create_app, db_session
+
+app = create_app()
 
 # Remove existing migrations
 migrations_dir = 'migrations/versions'
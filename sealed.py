@@ -0,0 +1,86 @@
+"""Resolves sealed-bid (Closed) auctions in the database.
+
+While a sealed lot runs its bids are only stored; nothing tracks a leader,
+so no read path can reveal one. At the close one query ranks the bids of
+every sealed lot in the batch with window functions: each bidder's best
+bid, then the bidders by amount, the earlier bid first on ties. Only the
+top two rows per lot come back, so a lot with thousands of bids costs the
+database a sort and the process two rows.
+
+Under PricingRule.FIRST_PRICE the winner pays their bid; under
+SECOND_PRICE (Vickrey) they pay the best rival bid, or the starting price
+if nobody else bid.
+"""
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import func, select, update
+
+from models import Auction, Bid, PricingRule
+
+
+@dataclass
+class Resolution:
+    auction_id: int
+    winning_bid_id: Optional[int] = None
+    winner_id: Optional[int] = None
+    winning_amount: Optional[float] = None
+    price: Optional[float] = None  # what the winner pays
+
+
+def ranking_query(auction_ids):
+    """The two best bidders of each auction, as (auction_id, rank, bid id, bidder_id, amount)."""
+    per_bidder = select(
+        Bid.id, Bid.auction_id, Bid.bidder_id, Bid.amount,
+        func.row_number().over(
+            partition_by=(Bid.auction_id, Bid.bidder_id),
+            order_by=(Bid.amount.desc(), Bid.id),
+        ).label('bidder_rank'),
+    ).where(Bid.auction_id.in_(auction_ids)).subquery()
+    ranked = select(
+        per_bidder.c.auction_id, per_bidder.c.id, per_bidder.c.bidder_id, per_bidder.c.amount,
+        func.row_number().over(
+            partition_by=per_bidder.c.auction_id,
+            order_by=(per_bidder.c.amount.desc(), per_bidder.c.id),
+        ).label('rank'),
+    ).where(per_bidder.c.bidder_rank == 1).subquery()
+    return (
+        select(ranked.c.auction_id, ranked.c.rank, ranked.c.id, ranked.c.bidder_id, ranked.c.amount)
+        .where(ranked.c.rank <= 2)
+        .order_by(ranked.c.auction_id, ranked.c.rank)
+    )
+
+
+def resolve(session, auctions):
+    """Picks the winner and price of each sealed auction and records them on the row.
+
+    Takes the lots already closed in the caller's transaction; the caller
+    commits. Returns {auction_id: Resolution}, with an empty Resolution for
+    a lot nobody bid on.
+    """
+    resolutions = {auction.id: Resolution(auction.id) for auction in auctions}
+    if not resolutions:
+        return resolutions
+    lots = {auction.id: auction for auction in auctions}
+    for auction_id, rank, bid_id, bidder_id, amount in session.execute(ranking_query(list(lots))):
+        resolution = resolutions[auction_id]
+        if rank == 1:
+            resolution.winning_bid_id, resolution.winner_id, resolution.winning_amount = bid_id, bidder_id, amount
+            resolution.price = amount
+            if lots[auction_id].pricing_rule == PricingRule.SECOND_PRICE:
+                resolution.price = lots[auction_id].starting_price
+        elif lots[auction_id].pricing_rule == PricingRule.SECOND_PRICE:
+            resolution.price = amount
+
+    won = [resolution for resolution in resolutions.values() if resolution.winning_bid_id is not None]
+    if won:
+        session.execute(update(Auction), [
+            {
+                'id': resolution.auction_id,
+                'highest_bid_id': resolution.winning_bid_id,
+                'highest_bid_amount': resolution.winning_amount,
+                'current_price': resolution.price,
+            }
+            for resolution in won
+        ])
+    return resolutions
@@ -0,0 +1,158 @@
+"""Full-text search over auction titles and descriptions.
+
+On Postgres the match and the rank come from models.auction_search_document,
+a weighted tsvector backed by the ix_auctions_search GIN index. SQLite has
+no full-text index we can rely on, so there an in-process inverted index
+scores the lots with the same weights and the database only filters by
+is_active. Lots are never re-titled, so that index just catches up on new
+ids before each search.
+
+Results are ranked best first with id as the tie breaker, and paged by a
+(rank, id) keyset cursor like the listing pages.
+"""
+import logging
+import re
+import threading
+from collections import Counter
+
+from sqlalchemy import Float, cast, func, literal, select, tuple_
+
+from config import Config
+from db import db_session
+from models import Auction, auction_search_document, SEARCH_CONFIG
+
+logger = logging.getLogger(__name__)
+
+TITLE_WEIGHT = 1.0  # ts_rank_cd's default weights for 'A' and 'B' lexemes
+DESCRIPTION_WEIGHT = 0.4
+
+_word = re.compile(r'\w+')
+
+
+def encode_cursor(rank, auction_id):
+    return f"{rank!r}_{auction_id}"
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        rank, auction_id = cursor.rsplit('_', 1)
+        return float(rank), int(auction_id)
+    except ValueError:
+        return None
+
+
+def search_page(text, auction_type=None, is_active=None, cursor=None, limit=None):
+    """Returns one page of (auction, rank) matches and the cursor of the next page."""
+    limit = limit or Config.LISTING_PAGE_SIZE
+    after = decode_cursor(cursor)
+    if db_session.get_bind().dialect.name == 'postgresql':
+        results = _postgres_page(text, auction_type, is_active, after, limit + 1)
+    else:
+        results = fallback_index.page(text, auction_type, is_active, after, limit + 1)
+    next_cursor = None
+    if len(results) > limit:
+        auction, rank = results[limit - 1]
+        next_cursor = encode_cursor(rank, auction.id)
+    return results[:limit], next_cursor
+
+
+def _postgres_page(text, auction_type, is_active, after, limit):
+    query = func.websearch_to_tsquery(literal(SEARCH_CONFIG, literal_execute=True), text)
+    # float8, so the rank survives the round trip through the cursor unchanged.
+    rank = cast(func.ts_rank_cd(auction_search_document, query), Float(precision=53))
+    stmt = select(Auction, rank).where(auction_search_document.op('@@')(query))
+    if auction_type is not None:
+        stmt = stmt.where(Auction.auction_type == auction_type)
+    if is_active is not None:
+        stmt = stmt.where(Auction.is_active == is_active)
+    if after:
+        stmt = stmt.where(tuple_(rank, Auction.id) < tuple_(*after))
+    stmt = stmt.order_by(rank.desc(), Auction.id.desc()).limit(limit)
+    return [tuple(row) for row in db_session.execute(stmt).all()]
+
+
+def tokenize(text):
+    return _word.findall((text or '').lower())
+
+
+class InvertedIndex:
+    """Term -> {auction id: weight} postings for every lot, built in memory."""
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self._postings = {}
+        self._types = {}
+        self._last_id = 0
+        self._lock = threading.Lock()
+
+    def add(self, auction_id, title, description, auction_type):
+        weights = Counter()
+        for term in tokenize(title):
+            weights[term] += TITLE_WEIGHT
+        for term in tokenize(description):
+            weights[term] += DESCRIPTION_WEIGHT
+        for term, weight in weights.items():
+            self._postings.setdefault(term, {})[auction_id] = weight
+        self._types[auction_id] = auction_type
+        self._last_id = max(self._last_id, auction_id)
+
+    def refresh(self):
+        """Indexes the lots created since the last refresh."""
+        with self._lock:
+            building = self._last_id == 0
+            rows = db_session.execute(
+                select(Auction.id, Auction.title, Auction.description, Auction.auction_type)
+                .where(Auction.id > self._last_id)
+                .order_by(Auction.id)
+            ).all()
+            for row in rows:
+                self.add(*row)
+        if building and rows:
+            logger.info(f"Built the in-process search index over {len(rows)} auctions")
+
+    def ranked(self, text, auction_type=None, after=None):
+        """(rank, auction id) for every lot matching all the terms, best first."""
+        terms = set(tokenize(text))
+        if not terms:
+            return []
+        with self._lock:
+            postings = sorted((self._postings.get(term, {}) for term in terms), key=len)
+            matches = [
+                (sum(posting[auction_id] for posting in postings), auction_id)
+                for auction_id in postings[0]
+                if all(auction_id in posting for posting in postings[1:])
+                and (auction_type is None or self._types[auction_id] == auction_type)
+            ]
+        if after:
+            matches = [match for match in matches if match < after]
+        matches.sort(reverse=True)
+        return matches
+
+    def page(self, text, auction_type, is_active, after, limit):
+        self.refresh()
+        matches = self.ranked(text, auction_type, after)
+        if is_active is None:
+            page = matches[:limit]
+        else:
+            # is_active changes as lots close, so it is checked in the database,
+            # a batch of candidates at a time until the page is full.
+            page = []
+            for start in range(0, len(matches), self.batch_size):
+                batch = matches[start:start + self.batch_size]
+                kept = set(db_session.execute(
+                    select(Auction.id)
+                    .where(Auction.id.in_([auction_id for _, auction_id in batch]), Auction.is_active == is_active)
+                ).scalars())
+                page += [match for match in batch if match[1] in kept][:limit - len(page)]
+                if len(page) == limit:
+                    break
+        auctions = db_session.execute(
+            select(Auction).where(Auction.id.in_([auction_id for _, auction_id in page]))
+        ).scalars()
+        by_id = {auction.id: auction for auction in auctions}
+        return [(by_id[auction_id], rank) for rank, auction_id in page if auction_id in by_id]
+
+
+fallback_index = InvertedIndex()
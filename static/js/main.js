@@ -87,6 +87,29 @@ document.addEventListener('DOMContentLoaded', function() {
     updateCountdowns();
     setInterval(updateCountdowns, 1000);
 
+    // Dutch prices are derived from the start time, so they tick locally
+    // with the same formula the server uses (models.dutch_price).
+    function updateDutchPrices() {
+        document.querySelectorAll('.dutch-price').forEach(function(element) {
+            const startingPrice = parseFloat(element.dataset.startingPrice);
+            const decrement = parseFloat(element.dataset.decrement);
+            const interval = parseInt(element.dataset.interval, 10);
+            const elapsed = (Date.now() - new Date(element.dataset.startTime).getTime()) / 1000;
+            let price = startingPrice;
+            if (decrement && interval && elapsed > 0) {
+                const intervalsPassed = Math.floor(elapsed / interval);
+                price = Math.max(0, Math.round((startingPrice - intervalsPassed * decrement) * 100) / 100);
+            }
+            if (element.tagName === 'INPUT') {
+                element.value = price;
+            } else {
+                element.textContent = price;
+            }
+        });
+    }
+    updateDutchPrices();
+    setInterval(updateDutchPrices, 1000);
+
     // Masonry layout initialization
     const grid = document.querySelector('.auction-grid');
     if (grid) {
@@ -143,4 +166,41 @@ document.addEventListener('DOMContentLoaded', function() {
     // Call updateMinBidAmount initially and set interval
     updateMinBidAmount();
     setInterval(updateMinBidAmount, 5000);
+
+    // Listing pages are cached for everyone, so the stars on the user's
+    // watched auctions are filled in with one request per page.
+    const watchCards = document.querySelectorAll('[data-watch-id]');
+    if (watchCards.length && document.body.dataset.authenticated) {
+        const ids = Array.from(watchCards, card => card.dataset.watchId);
+        fetch(`/api/watchlist/flags?ids=${ids.join(',')}`)
+            .then(response => response.json())
+            .then(data => {
+                const watched = new Set(data.watched.map(String));
+                watchCards.forEach(card => {
+                    const flag = card.querySelector('.watch-flag');
+                    if (flag && watched.has(card.dataset.watchId)) {
+                        flag.classList.remove('d-none');
+                    }
+                });
+            })
+            .catch(error => console.error('Error fetching watchlist flags:', error));
+    }
+
+    document.querySelectorAll('.watchlist-btn').forEach(function(button) {
+        button.addEventListener('click', function() {
+            const auctionId = button.dataset.auctionId;
+            const url = button.dataset.action === 'remove'
+                ? `/remove_from_watchlist/${auctionId}`
+                : `/add_to_watchlist/${auctionId}`;
+            fetch(url, {method: 'POST'})
+                .then(response => response.json())
+                .then(data => {
+                    if (!data.success) return;
+                    button.dataset.action = data.watching ? 'remove' : 'add';
+                    button.querySelector('i').className = `${data.watching ? 'fas' : 'far'} fa-star`;
+                    button.querySelector('.watchlist-label').textContent = data.watching ? 'Remove from' : 'Add to';
+                })
+                .catch(error => console.error('Error updating watchlist:', error));
+        });
+    });
 });
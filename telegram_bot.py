@@ -1,8 +1,10 @@
+import asyncio
 import os
 import logging
 from telegram import Update, LabeledPrice
 from telegram.ext import (
     Application,
+    BaseUpdateProcessor,
     CommandHandler,
     PreCheckoutQueryHandler,
     MessageHandler,
@@ -11,7 +13,11 @@ from telegram.ext import (
 )
 from telegram.error import BadRequest
 from models import User
-from db import db_session
+from sqlalchemy import select
+from config import Config
+from db import async_session
+import ledger
+from notifications import dispatcher
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -23,6 +29,60 @@ PAYMENT_PROVIDER_TOKEN = os.environ.get('PAYMENT_PROVIDER_TOKEN')
 
 application = None
 
+# Updates waiting for their chat or a free slot; past this PTB stops
+# handing over new ones until some finish.
+PENDING_UPDATES_LIMIT = 10000
+
+
+def _chat_key(update):
+    if not isinstance(update, Update):
+        return None
+    # Pre-checkout queries carry no chat; a private chat's id is the user's id.
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Processes up to `limit` updates at once, but one at a time per chat.
+
+    PTB calls do_process_update in the order updates arrive, so each update
+    is chained behind the previous one from its chat before anything is
+    awaited. An update waiting for its chat doesn't hold one of the `limit`
+    slots, so a busy chat can't stall the others.
+    """
+
+    def __init__(self, limit):
+        super().__init__(PENDING_UPDATES_LIMIT)
+        self.limit = limit
+        self._slots = asyncio.Semaphore(limit)
+        self._tails = {}  # chat key -> future done when its latest update finishes
+
+    async def do_process_update(self, update, coroutine):
+        key = _chat_key(update)
+        previous = self._tails.get(key) if key is not None else None
+        finished = asyncio.get_running_loop().create_future()
+        if key is not None:
+            self._tails[key] = finished
+        try:
+            if previous is not None:
+                await asyncio.shield(previous)
+            async with self._slots:
+                await coroutine
+        finally:
+            finished.set_result(None)
+            if key is not None and self._tails.get(key) is finished:
+                del self._tails[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
 async def start(update: Update, context: CallbackContext):
     logger.info(f"User {update.effective_user.id} started the bot")
     await update.message.reply_text(
@@ -78,21 +138,29 @@ async def successful_payment_callback(update: Update, context: CallbackContext):
     amount = int(payment.total_amount / 1000)  # Convert back from kopecks to XTR
     user_id = update.effective_user.id
 
-    user = db_session.query(User).filter_by(telegram_id=str(user_id)).first()
-    if user:
-        user.xtr_balance += amount
-        db_session.commit()
+    async with async_session('bot') as session:
+        account_id = await session.scalar(select(User.id).where(User.telegram_id == str(user_id)))
+        is_new = account_id is None
+        if is_new:
+            user = User(telegram_id=str(user_id), username=update.effective_user.username)
+            session.add(user)
+            await session.flush()
+            account_id = user.id
+        # A top-up is a plain insert into the ledger; no balance row is rewritten.
+        credited = (await session.execute(ledger.topup_entry(
+            session, account_id, ledger.to_minor(amount), payment.telegram_payment_charge_id,
+        ))).rowcount == 1
+        await session.commit()
+
+    if not credited:
+        logger.warning(f"Payment {payment.telegram_payment_charge_id} was already credited; ignoring the repeat")
+        return
+
+    if not is_new:
         await update.message.reply_text(
             f'Thank you for your payment! {amount} XTR stars have been added to your balance.'
         )
     else:
-        new_user = User(
-            telegram_id=str(user_id),
-            username=update.effective_user.username,
-            xtr_balance=amount
-        )
-        db_session.add(new_user)
-        db_session.commit()
         await update.message.reply_text(
             f'Thank you for your payment! A new account has been created for you with {amount} XTR stars.'
         )
@@ -106,7 +174,12 @@ def setup_bot() -> Application:
 
     logger.info(f"Setting up bot with token: {bot_token[:5]}...{bot_token[-5:]}")
 
-    application = Application.builder().token(bot_token).build()
+    application = (
+        Application.builder()
+        .token(bot_token)
+        .concurrent_updates(ChatOrderedUpdateProcessor(Config.BOT_UPDATE_CONCURRENCY))
+        .build()
+    )
 
     logger.info("Adding command handlers")
     
@@ -118,13 +191,7 @@ def setup_bot() -> Application:
     logger.info("Bot setup completed")
     return application
 
-async def send_notification(user_id: int, message: str):
+def send_notification(user_id: int, message: str):
+    """Queues a message for the notification dispatcher and returns at once."""
     logger.info(f"send_notification called with user_id={user_id}, message={message}")
-    if application:
-        try:
-            await application.bot.send_message(chat_id=int(user_id), text=message)
-            logger.info(f"Notification sent to user {user_id}")
-        except Exception as e:
-            logger.error(f"Error sending notification to user {user_id}: {str(e)}")
-    else:
-        logger.error("Telegram application is not initialized.")
+    dispatcher.enqueue(user_id, message)
@@ -1,7 +1,7 @@
-from db import engine
+from db import get_engine
 from sqlalchemy import inspect
 
-inspector = inspect(engine)
+inspector = inspect(get_engine())
 columns = inspector.get_columns('users')
 for column in columns:
     print(column['name'], column['type'])
\ No newline at end of file
@@ -0,0 +1,223 @@
+"""Checks of the money paths: escrow holds, settlement and ledger snapshots.
+
+Runs the bid engine and the close-time settlement against a throwaway
+database (LEDGER_TEST_DATABASE_URL, a temporary SQLite file by default) and
+checks every user's balance and held totals afterwards.
+
+    python test_ledger.py        # one PASS/FAIL line per check
+    python -m pytest test_ledger.py
+"""
+import itertools
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+_default_url = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'tauction_ledger.db')}"
+LEDGER_TEST_DATABASE_URL = os.environ.get('LEDGER_TEST_DATABASE_URL', _default_url)
+os.environ.setdefault('DATABASE_URL', LEDGER_TEST_DATABASE_URL)
+
+from sqlalchemy import create_engine, func, select, update
+
+from bid_engine import BidEngine
+from db import Base, db_session
+from models import Auction, AuctionType, BalanceHold, Bid, LedgerEntry, PricingRule, User
+import escrow
+import ledger
+import sealed
+
+_engine = None
+_usernames = (f'user{i}' for i in itertools.count(1))
+
+
+def scratch_engine():
+    global _engine
+    if _engine is None:
+        _engine = create_engine(LEDGER_TEST_DATABASE_URL)
+        Base.metadata.drop_all(_engine)
+        Base.metadata.create_all(_engine)
+    return _engine
+
+
+@contextmanager
+def scratch_session():
+    """db_session, which the bid engine writes through, bound to the scratch database."""
+    previous = db_session.session_factory.kw.get('bind')
+    db_session.remove()
+    db_session.configure(bind=scratch_engine())
+    try:
+        yield db_session
+    finally:
+        db_session.remove()
+        db_session.configure(bind=previous)
+
+
+def _user(session, funds=0):
+    user = User(username=next(_usernames))
+    session.add(user)
+    session.flush()
+    if funds:
+        session.execute(ledger.entry(user.id, ledger.TOPUP, balance_delta=ledger.to_minor(funds)))
+    session.commit()
+    return user.id
+
+
+def _auction(session, creator_id, auction_type=AuctionType.ENGLISH, **values):
+    now = datetime.utcnow()
+    auction = Auction(**{
+        'title': 'Lot', 'description': '', 'starting_price': 1, 'current_price': 1, 'creator_id': creator_id,
+        'start_time': now - timedelta(minutes=1), 'end_time': now + timedelta(hours=1), 'is_active': True,
+        'auction_type': auction_type, **values,
+    })
+    session.add(auction)
+    session.commit()
+    return auction.id
+
+
+def _balances(session, *user_ids):
+    balances = ledger.balances(session, user_ids)
+    return [balances.get(user_id, (0, 0)) for user_id in user_ids]
+
+
+def _holds(session, auction_id):
+    return dict(session.execute(
+        select(BalanceHold.user_id, BalanceHold.amount).where(BalanceHold.auction_id == auction_id)
+    ).all())
+
+
+def _bid(engine, auction_id, user_id, amount):
+    return engine.place_bid(auction_id, user_id, 'bidder', amount)
+
+
+def test_outbid_hold_is_released():
+    with scratch_session() as session:
+        engine = BidEngine(shards=1)
+        creator, first, second = _user(session), _user(session, 100), _user(session, 100)
+        lot = _auction(session, creator)
+
+        assert _bid(engine, lot, first, 10).accepted
+        assert _balances(session, first) == [(100, 10)]
+        assert _bid(engine, lot, second, 20).accepted
+        assert _balances(session, first, second) == [(100, 0), (100, 20)]
+        assert _holds(session, lot) == {second: 20}
+
+        # Raising their own bid holds only the difference on top.
+        assert _bid(engine, lot, second, 30).accepted
+        assert _balances(session, second) == [(100, 30)]
+
+
+def test_bid_over_available_funds_is_rejected():
+    with scratch_session() as session:
+        engine = BidEngine(shards=1)
+        creator, bidder = _user(session), _user(session, 30)
+        held_lot, lot = _auction(session, creator), _auction(session, creator)
+        assert _bid(engine, held_lot, bidder, 20).accepted
+
+        # 30 owned, 20 of it held: only 10 is available.
+        result = _bid(engine, lot, bidder, 15)
+        assert not result.accepted and 'enough XTR' in result.message
+        assert _balances(session, bidder) == [(30, 20)]
+        assert _holds(session, lot) == {}
+        assert session.scalar(select(func.count()).select_from(Bid).where(Bid.auction_id == lot)) == 0
+        assert _bid(engine, lot, bidder, 10).accepted
+
+
+def test_shared_bidder_across_shards():
+    with scratch_session() as session:
+        engine = BidEngine(shards=2)
+        creator, bidder = _user(session), _user(session, 50)
+        lots = [_auction(session, creator) for _ in range(2)]
+        assert {lot % 2 for lot in lots} == {0, 1}, "expected one lot on each shard"
+
+        # Both shards reserve for the same bidder at once; only one bid fits.
+        with ThreadPoolExecutor(len(lots)) as pool:
+            results = list(pool.map(lambda lot: _bid(engine, lot, bidder, 30), lots))
+        assert sorted(result.accepted for result in results) == [False, True], [r.message for r in results]
+        assert 'enough XTR' in next(result.message for result in results if not result.accepted)
+        assert _balances(session, bidder) == [(50, 30)]
+
+        # With funds for both lots, concurrent bids on the two shards never fail
+        # with a retry, and the bidder ends up holding exactly both prices.
+        session.execute(ledger.entry(bidder, ledger.TOPUP, balance_delta=ledger.to_minor(100)))
+        session.commit()
+        with ThreadPoolExecutor(len(lots)) as pool:
+            results = list(pool.map(lambda amount: _bid(engine, lots[amount % 2], bidder, amount), range(31, 51)))
+        assert not [result.message for result in results if 'try again' in result.message]
+        prices = session.scalars(select(Auction.current_price).where(Auction.id.in_(lots))).all()
+        assert _balances(session, bidder) == [(150, sum(prices))]
+
+
+def test_dutch_acceptance_settles():
+    with scratch_session() as session:
+        engine = BidEngine(shards=1)
+        creator, buyer = _user(session), _user(session, 100)
+        lot = _auction(session, creator, AuctionType.DUTCH, starting_price=40, current_price=40,
+                       dutch_price_decrement=1, dutch_interval=3600)
+
+        result = _bid(engine, lot, buyer, 40)
+        assert result.accepted and result.current_price == 40
+        session.expire_all()
+        assert not session.get(Auction, lot).is_active
+        assert _balances(session, buyer, creator) == [(60, 0), (40, 0)]
+        assert _holds(session, lot) == {}
+
+
+def test_sealed_second_price_settlement():
+    with scratch_session() as session:
+        engine = BidEngine(shards=1)
+        creator, loser, winner = _user(session), _user(session, 100), _user(session, 100)
+        lot = _auction(session, creator, AuctionType.CLOSED, pricing_rule=PricingRule.SECOND_PRICE)
+        assert _bid(engine, lot, loser, 10).accepted
+        assert _bid(engine, lot, winner, 25).accepted
+        # Sealed bids all stay held until the close.
+        assert _balances(session, loser, winner) == [(100, 10), (100, 25)]
+
+        # As close_auctions does it, in one transaction.
+        session.execute(update(Auction).where(Auction.id == lot).values(is_active=False))
+        resolution = sealed.resolve(session, [session.get(Auction, lot)])[lot]
+        assert (resolution.winner_id, resolution.price) == (winner, 10)
+        for statement in escrow.settle_statements(lot, winner, resolution.price, creator):
+            session.execute(statement)
+        session.commit()
+
+        assert _balances(session, loser, winner, creator) == [(100, 0), (90, 0), (10, 0)]
+        assert _holds(session, lot) == {}
+
+
+def test_snapshots_match_full_ledger():
+    with scratch_session() as session:
+        engine = BidEngine(shards=1)
+        creator, first, second = _user(session), _user(session, 50), _user(session, 50)
+        lot = _auction(session, creator)
+        assert _bid(engine, lot, first, 5).accepted
+        assert _bid(engine, lot, second, 7).accepted
+
+        before = _balances(session, creator, first, second)
+        cutoff = ledger.take_snapshots(session)
+        session.commit()
+        assert cutoff == session.scalar(select(func.max(LedgerEntry.id)))
+        assert _balances(session, creator, first, second) == before
+        assert ledger.find_drift(session) == []
+
+        # New entries are read as a delta on top of the snapshot, then folded in.
+        session.execute(ledger.entry(first, ledger.TOPUP, balance_delta=ledger.to_minor(3)))
+        session.commit()
+        assert _bid(engine, lot, first, 9).accepted
+        assert _balances(session, first, second) == [(53, 9), (50, 0)]
+        assert ledger.find_drift(session) == []
+        ledger.take_snapshots(session)
+        session.commit()
+        assert _balances(session, first, second) == [(53, 9), (50, 0)]
+        assert ledger.reconcile(session) == []
+        session.commit()
+
+
+if __name__ == "__main__":
+    for name, check in sorted(globals().items()):
+        if name.startswith('test_') and callable(check):
+            try:
+                check()
+                print(f"PASS {name}")
+            except AssertionError as e:
+                print(f"FAIL {name}: {e}")
@@ -0,0 +1,317 @@
+"""Query-plan regression checks for the hot queries.
+
+Seeds a throwaway database (QUERY_PLAN_DATABASE_URL, a temporary SQLite file
+by default; point it at a scratch Postgres database to check real plans) and
+asserts with EXPLAIN that each hot query is answered from its index, and
+that the hot pages run a fixed number of statements within their budgets.
+
+    python test_query_plans.py        # one PASS/FAIL line per check
+    python -m pytest test_query_plans.py
+"""
+import json
+import os
+import random
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+_default_url = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'tauction_query_plans.db')}"
+QUERY_PLAN_DATABASE_URL = os.environ.get('QUERY_PLAN_DATABASE_URL', _default_url)
+os.environ.setdefault('DATABASE_URL', QUERY_PLAN_DATABASE_URL)
+
+from sqlalchemy import create_engine, event, insert, select, text, update
+
+from app import create_app
+from db import Base, db_session
+from models import Auction, AuctionType, Bid, User, watchlist
+import bid_history
+import ledger
+import listing
+import query_budget
+import search
+import sealed
+import watch_alerts
+
+SEED_USERS = int(os.environ.get('QUERY_PLAN_USERS', 2000))
+SEED_AUCTIONS = int(os.environ.get('QUERY_PLAN_AUCTIONS', 20000))
+SEED_BIDS_PER_AUCTION = int(os.environ.get('QUERY_PLAN_BIDS_PER_AUCTION', 5))
+
+_engine = None
+
+
+def seeded_engine():
+    global _engine
+    if _engine is not None:
+        return _engine
+
+    engine = create_engine(QUERY_PLAN_DATABASE_URL)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    types = list(AuctionType)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {'id': i, 'username': f'user{i}', 'telegram_id': str(i)}
+            for i in range(1, SEED_USERS + 1)
+        ])
+        # Most of the history is closed, as in production.
+        conn.execute(insert(Auction), [
+            {
+                'id': i,
+                'title': f'Lot {i}',
+                'starting_price': 1,
+                'current_price': 1,
+                'start_time': now - timedelta(days=30),
+                'end_time': now + timedelta(minutes=rng.randint(-40000, 40000)),
+                'is_active': rng.random() < 0.1,
+                'creator_id': rng.randint(1, SEED_USERS),
+                'auction_type': rng.choice(types),
+            }
+            for i in range(1, SEED_AUCTIONS + 1)
+        ])
+        conn.execute(insert(Bid), [
+            {
+                'auction_id': auction_id,
+                'bidder_id': rng.randint(1, SEED_USERS),
+                'amount': rng.uniform(1, 1000),
+                'timestamp': now - timedelta(seconds=rng.randint(0, 10 ** 6)),
+            }
+            for auction_id in range(1, SEED_AUCTIONS + 1)
+            for _ in range(SEED_BIDS_PER_AUCTION)
+        ])
+        conn.execute(insert(watchlist), [
+            {'user_id': rng.randint(1, SEED_USERS), 'auction_id': auction_id}
+            for auction_id in range(1, SEED_AUCTIONS + 1, 3)
+        ])
+    with engine.connect() as conn:
+        conn.execute(text('ANALYZE'))
+        conn.commit()
+
+    db_session.remove()
+    db_session.configure(bind=engine)
+    _engine = engine
+    return engine
+
+
+@contextmanager
+def captured_statements(engine):
+    """Records the SQL the application code sends, so the real query is explained."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def explain(engine, statement, parameters=None):
+    """Returns the plan as a list of (operation, index name or None, table)."""
+    if isinstance(statement, str):
+        sql = statement
+    else:
+        with captured_statements(engine) as statements, engine.connect() as conn:
+            conn.execute(statement).all()
+        sql, parameters = statements[-1]
+
+    with engine.connect() as conn:
+        if engine.dialect.name == 'postgresql':
+            raw = conn.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {sql}', parameters).scalar()
+            plan = raw if isinstance(raw, list) else json.loads(raw)
+            nodes = []
+
+            def walk(node):
+                nodes.append((node['Node Type'], node.get('Index Name'), node.get('Relation Name')))
+                for child in node.get('Plans', []):
+                    walk(child)
+
+            walk(plan[0]['Plan'])
+            return nodes
+
+        if parameters is not None and not isinstance(parameters, (tuple, list)):
+            parameters = tuple(parameters.values())
+        rows = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}', parameters or ()).all()
+        nodes = []
+        for row in rows:
+            detail = row[-1]
+            words = detail.split()
+            index = None
+            if 'INDEX' in words:
+                index = words[words.index('INDEX') + 1]
+            nodes.append((words[0], index, words[1] if len(words) > 1 else None))
+        return nodes
+
+
+def assert_uses_index(nodes, index_name, table):
+    assert any(index == index_name for _, index, _ in nodes), \
+        f"expected {index_name} in plan, got {nodes}"
+    full_scans = {'Seq Scan', 'SCAN'}
+    assert not any(op in full_scans and index is None and relation == table for op, index, relation in nodes), \
+        f"unexpected full scan of {table}: {nodes}"
+
+
+def _listing_plan(section, cursor):
+    engine = seeded_engine()
+    with captured_statements(engine) as statements:
+        listing.auctions_page(section, cursor)
+    db_session.remove()
+    statement, parameters = statements[-1]
+    return explain(engine, statement, parameters)
+
+
+def test_active_listing_uses_partial_index():
+    cursor = f"{datetime.utcnow().isoformat()}_1"
+    for page_cursor in (None, cursor):
+        assert_uses_index(_listing_plan(listing.ACTIVE, page_cursor), 'ix_auctions_active_end_time', 'auctions')
+
+
+def test_inactive_listing_uses_partial_index():
+    cursor = f"{datetime.utcnow().isoformat()}_{SEED_AUCTIONS}"
+    for page_cursor in (None, cursor):
+        assert_uses_index(_listing_plan(listing.INACTIVE, page_cursor), 'ix_auctions_inactive_end_time', 'auctions')
+
+
+def test_close_scheduler_load_uses_partial_index():
+    # Same query as CloseScheduler.load()
+    statement = select(Auction.id, Auction.end_time).where(
+        Auction.is_active == True,
+        Auction.auction_type != AuctionType.EVERLASTING
+    ).order_by(Auction.end_time)
+    assert_uses_index(explain(seeded_engine(), statement), 'ix_auctions_active_end_time', 'auctions')
+
+
+def test_winning_bid_uses_amount_index():
+    # Same ordering as the auction detail page
+    statement = select(Bid).where(Bid.auction_id == 42).order_by(Bid.amount.desc()).limit(1)
+    assert_uses_index(explain(seeded_engine(), statement), 'ix_bids_auction_id_amount', 'bids')
+
+
+def test_recent_bids_use_timestamp_index():
+    # Same query as /api/auction/<id>/bids
+    statement = select(Bid).where(Bid.auction_id == 42).order_by(Bid.timestamp.desc()).limit(10)
+    assert_uses_index(explain(seeded_engine(), statement), 'ix_bids_auction_id_timestamp', 'bids')
+
+
+def test_watchers_of_auction_use_index():
+    statement = select(watchlist.c.user_id).where(watchlist.c.auction_id == 42)
+    assert_uses_index(explain(seeded_engine(), statement), 'ix_watchlist_auction_id', 'watchlist')
+
+
+def test_watched_flags_use_primary_key():
+    # Same query as watchlists.watched_ids()
+    engine = seeded_engine()
+    statement = select(watchlist.c.auction_id).where(watchlist.c.user_id == 7, watchlist.c.auction_id.in_([1, 2, 3]))
+    primary_key = 'watchlist_pkey' if engine.dialect.name == 'postgresql' else 'sqlite_autoindex_watchlist_1'
+    assert_uses_index(explain(engine, statement), primary_key, 'watchlist')
+
+
+def test_sealed_ranking_reads_bids_by_auction():
+    # Same query as sealed.resolve() for a batch of lots
+    statement = sealed.ranking_query([42, 43, 44])
+    nodes = explain(seeded_engine(), statement)
+    assert not any(op in ('SCAN', 'Seq Scan') and relation == 'bids' for op, _, relation in nodes), \
+        f"unexpected full scan of bids: {nodes}"
+
+
+def test_watch_alert_queries_use_partial_indexes():
+    engine = seeded_engine()
+    now = datetime.utcnow()
+    assert_uses_index(explain(engine, watch_alerts.bid_activity_query(now - timedelta(seconds=60), now)),
+                      'ix_auctions_active_last_bid_at', 'auctions')
+    assert_uses_index(explain(engine, watch_alerts.ending_query(now, now + timedelta(minutes=15))),
+                      'ix_auctions_active_end_time', 'auctions')
+    assert_uses_index(explain(engine, watch_alerts.watchers_query([42, 43])), 'ix_watchlist_auction_id', 'watchlist')
+
+
+def test_balance_delta_reads_use_sequence_index():
+    # Same query as ledger.balances(); escrow.reserve() checks funds the same way
+    assert_uses_index(explain(seeded_engine(), ledger.balances_stmt([42])),
+                      'ix_ledger_entries_user_id_sequence', 'ledger_entries')
+
+
+def test_search_uses_text_index():
+    # SQLite ranks in process and must only touch auctions by primary key.
+    engine = seeded_engine()
+    with captured_statements(engine) as statements:
+        search.search_page('lot 42', is_active=False)
+    db_session.remove()
+    plans = [explain(engine, statement, parameters) for statement, parameters in statements]
+    if engine.dialect.name == 'postgresql':
+        assert_uses_index(plans[0], 'ix_auctions_search', 'auctions')
+    else:
+        for nodes in plans:
+            assert not any(op == 'SCAN' and relation == 'auctions' for op, _, relation in nodes), \
+                f"unexpected full scan of auctions: {nodes}"
+
+
+def _crowded_auction(engine, bidders=50):
+    """A lot with far more bidders than the seeded ones."""
+    auction_id = SEED_AUCTIONS + 1
+    with engine.begin() as conn:
+        if conn.execute(select(Auction.id).where(Auction.id == auction_id)).first() is None:
+            now = datetime.utcnow()
+            conn.execute(insert(Auction).values(
+                id=auction_id, title='Crowded lot', description='', starting_price=1, current_price=bidders,
+                start_time=now, end_time=now + timedelta(days=1), is_active=True, creator_id=1,
+                auction_type=AuctionType.ENGLISH,
+            ))
+            conn.execute(insert(Bid), [
+                {'auction_id': auction_id, 'bidder_id': user_id, 'amount': user_id, 'timestamp': now}
+                for user_id in range(1, bidders + 1)
+            ])
+    return auction_id
+
+
+def _statement_count(client, path, headers=None, status=200):
+    with query_budget.counting() as counter:
+        response = client.get(path, headers=headers)
+    assert response.status_code == status, f"{path} returned {response.status_code}"
+    return counter.statements
+
+
+def test_page_cost_does_not_grow_with_bids():
+    engine = seeded_engine()
+    app = create_app()
+    query_budget.instrument_engine(engine)
+    app.config['QUERY_BUDGET_STRICT'] = True
+    client = app.test_client()
+    crowded = _crowded_auction(engine)
+    for path in ('/auction/{}', '/api/auction/{}/bids'):
+        _statement_count(client, path.format(crowded))  # warm the caches
+        bid_history.fragment_cache.clear()  # compare rendering, not cache hits
+        few, many = (_statement_count(client, path.format(auction_id)) for auction_id in (42, crowded))
+        assert few == many, f"{path} ran {few} statements for 5 bids and {many} for 50"
+    _statement_count(client, '/')
+    db_session.remove()
+
+
+def test_unchanged_bid_history_is_not_rendered_again():
+    engine = seeded_engine()
+    app = create_app()
+    query_budget.instrument_engine(engine)
+    client = app.test_client()
+    path = '/api/auction/42/bids'
+    etag = client.get(path).headers['ETag']
+    assert _statement_count(client, path) == 1, "a cached payload should cost only the version lookup"
+    assert _statement_count(client, path, {'If-None-Match': etag}, status=304) == 1
+
+    with engine.begin() as conn:
+        conn.execute(update(Auction).where(Auction.id == 42).values(version=Auction.version + 1))
+    response = client.get(path, headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['ETag'] != etag
+    db_session.remove()
+
+
+if __name__ == "__main__":
+    for name, check in sorted(globals().items()):
+        if name.startswith('test_') and callable(check):
+            try:
+                check()
+                print(f"PASS {name}")
+            except AssertionError as e:
+                print(f"FAIL {name}: {e}")
@@ -1,10 +1,10 @@
-from models import User, Subscriber  # Import your models
-from db import engine, Base  # Import your database engine and Base
+from alembic import command
+from alembic.config import Config as AlembicConfig
 
 def update_schema():
-    # Reflect database schema changes to the Base metadata
-    Base.metadata.create_all(bind=engine)
+    # The schema is managed by the Alembic migrations alone; the app never creates tables.
+    command.upgrade(AlembicConfig('alembic.ini'), 'head')
     print("Database schema updated successfully.")
 
 if __name__ == "__main__":
-    update_schema()
\ No newline at end of file
+    update_schema()
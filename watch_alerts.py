@@ -0,0 +1,173 @@
+"""Telegram alerts to the watchers of a lot: price updates and ending-soon reminders.
+
+Watchers are not messaged per bid. Every WATCH_ALERT_WINDOW seconds the job
+runner (see app.main) looks up the lots whose last_bid_at moved since its
+previous run and sends each of their watchers one message with the price
+now: "you were outbid" if they bid on the lot, "new bids" otherwise, and
+nothing to the leader. However many bids a lot takes in a window, each
+watcher hears about it once, so the messages sent grow with the number of
+watchers, not with watchers times bids.
+
+The same run reminds the watchers of every lot whose end_time has come
+within WATCH_REMINDER_MINUTES, read from the close scheduler's
+ix_auctions_active_end_time index.
+
+Watchers are streamed WATCH_ALERT_BATCH rows at a time, and each batch is
+handed to the notification dispatcher in one call.
+"""
+import logging
+import math
+from datetime import datetime, timedelta
+
+from sqlalchemy import exists, select
+
+from config import Config
+from db import async_session
+from models import Auction, AuctionType, Bid, User, watchlist
+from notifications import dispatcher
+
+logger = logging.getLogger(__name__)
+
+# Sealed lots have no public price, and a Dutch lot ends with its first bid.
+PRICED_TYPES = (AuctionType.ENGLISH, AuctionType.EVERLASTING)
+
+
+def bid_activity_query(after, until):
+    """Active priced lots last bid on in (after, until], with their leading bidder."""
+    return (
+        select(Auction.id, Auction.title, Auction.current_price, Auction.last_bid_at,
+               Bid.bidder_id.label('leader_id'))
+        .outerjoin(Bid, Bid.id == Auction.highest_bid_id)
+        .where(
+            Auction.is_active == True,
+            Auction.last_bid_at > after,
+            Auction.last_bid_at <= until,
+            Auction.auction_type.in_(PRICED_TYPES),
+        )
+    )
+
+
+def ending_query(after, until):
+    """Active lots with a deadline in (after, until]."""
+    return select(Auction).where(
+        Auction.is_active == True,
+        Auction.end_time > after,
+        Auction.end_time <= until,
+        Auction.auction_type != AuctionType.EVERLASTING,
+    )
+
+
+def watchers_query(auction_ids):
+    """(auction_id, user_id, chat_id, has_bid) of every watcher reachable on Telegram."""
+    has_bid = exists().where(Bid.auction_id == watchlist.c.auction_id, Bid.bidder_id == watchlist.c.user_id)
+    return (
+        select(watchlist.c.auction_id, watchlist.c.user_id, User.telegram_id, has_bid.label('has_bid'))
+        .join(User, User.id == watchlist.c.user_id)
+        .where(watchlist.c.auction_id.in_(auction_ids), User.telegram_id.isnot(None))
+    )
+
+
+def price_message(lot, has_bid):
+    if has_bid:
+        return f"You were outbid on '{lot.title}'. The price is now {lot.current_price} XTR."
+    return f"New bids on '{lot.title}'. The price is now {lot.current_price} XTR."
+
+
+def reminder_message(auction, now):
+    minutes = math.ceil((auction.end_time - now).total_seconds() / 60)
+    text = f"'{auction.title}' ends in {minutes} minute{'s' if minutes != 1 else ''}."
+    if auction.auction_type == AuctionType.CLOSED:
+        return f"{text} Sealed bids are open until then."
+    price = auction.current_dutch_price if auction.auction_type == AuctionType.DUTCH else auction.current_price
+    return f"{text} The price is now {price} XTR."
+
+
+class WatchAlerts:
+    def __init__(self, window=30, reminder_minutes=15, batch_size=1000):
+        self.window = timedelta(seconds=window)
+        self.reminder = timedelta(minutes=reminder_minutes)
+        self.batch_size = batch_size
+        self.reset()
+
+    def reset(self):
+        """Starts over as on a new process, e.g. when this process is elected to run the jobs again."""
+        self._bids_since = None
+        self._reminded_until = None
+        # auction_id -> the last_bid_at already announced, for the overlap below.
+        self._announced = {}
+
+    async def run(self, now=None):
+        """One window: price updates for the lots bid on, reminders for the lots ending soon."""
+        now = now or datetime.utcnow()
+        sent = 0
+        async with async_session('scheduler') as session:
+            if self._bids_since is None:
+                # Bids from before this process ran the job may already have
+                # been announced by the previous leader.
+                self._bids_since = now
+            else:
+                sent += await self._price_alerts(session, now)
+            if self._reminded_until is None:
+                # Every lot ending soon is reminded: a lot the previous leader
+                # reminded is reminded twice rather than risk none.
+                self._reminded_until = now
+            sent += await self._reminders(session, now)
+        if sent:
+            logger.info(f"Queued {sent} watcher alerts")
+        return sent
+
+    async def _price_alerts(self, session, now):
+        since, self._bids_since = self._bids_since, now
+        # last_bid_at is stamped before the bid commits, so a window also
+        # looks back one window for bids that committed late.
+        lots = {
+            lot.id: lot for lot in (await session.execute(bid_activity_query(since - self.window, now))).all()
+            if self._announced.get(lot.id) != lot.last_bid_at
+        }
+
+        def messages(rows):
+            return [
+                (chat_id, price_message(lots[auction_id], has_bid))
+                for auction_id, user_id, chat_id, has_bid in rows
+                if user_id != lots[auction_id].leader_id
+            ]
+
+        sent = await self._fan_out(session, list(lots), messages)
+        self._announced.update((auction_id, lot.last_bid_at) for auction_id, lot in lots.items())
+        # Only what the next run's look-back can still return.
+        self._announced = {
+            auction_id: last_bid_at for auction_id, last_bid_at in self._announced.items()
+            if last_bid_at > now - self.window
+        }
+        return sent
+
+    async def _reminders(self, session, now):
+        after, self._reminded_until = max(self._reminded_until, now), now + self.reminder
+        lots = {auction.id: auction for auction in (await session.execute(
+            ending_query(after, self._reminded_until)
+        )).scalars()}
+
+        def messages(rows):
+            return [(chat_id, reminder_message(lots[auction_id], now)) for auction_id, _, chat_id, _ in rows]
+
+        return await self._fan_out(session, list(lots), messages)
+
+    async def _fan_out(self, session, auction_ids, messages):
+        sent = 0
+        for start in range(0, len(auction_ids), self.batch_size):
+            result = await session.stream(
+                watchers_query(auction_ids[start:start + self.batch_size])
+                .execution_options(yield_per=self.batch_size)
+            )
+            async for rows in result.partitions():
+                batch = messages(rows)
+                dispatcher.enqueue_many(batch)
+                sent += len(batch)
+        return sent
+
+
+watch_alerts = WatchAlerts(
+    window=Config.WATCH_ALERT_WINDOW,
+    reminder_minutes=Config.WATCH_REMINDER_MINUTES,
+    batch_size=Config.WATCH_ALERT_BATCH,
+)
@@ -0,0 +1,52 @@
+"""Watchlist membership, keyed on the watchlist table's (user_id, auction_id) primary key.
+
+Membership is answered by existence queries on that key rather than by
+loading User.watchlist, and add/remove are single idempotent statements.
+The functions take the session to run in; the caller commits.
+"""
+from sqlalchemy import delete, exists, literal, select
+
+from db import conflict_insert
+from models import Auction, watchlist
+
+MAX_FLAG_IDS = 200  # auction ids per watched-flags request
+
+
+def add(session, user_id, auction_id):
+    """Watches the auction. Returns False if it was already watched or doesn't exist."""
+    stmt = conflict_insert(session, watchlist).from_select(
+        ['user_id', 'auction_id'],
+        select(literal(user_id), Auction.id).where(Auction.id == auction_id),
+    ).on_conflict_do_nothing(index_elements=['user_id', 'auction_id'])
+    return session.execute(stmt).rowcount == 1
+
+
+def remove(session, user_id, auction_id):
+    """Stops watching the auction. Returns False if it wasn't watched."""
+    stmt = delete(watchlist).where(watchlist.c.user_id == user_id, watchlist.c.auction_id == auction_id)
+    return session.execute(stmt).rowcount == 1
+
+
+def is_watching(session, user_id, auction_id):
+    return session.execute(
+        select(exists().where(watchlist.c.user_id == user_id, watchlist.c.auction_id == auction_id))
+    ).scalar()
+
+
+def watched_ids(session, user_id, auction_ids):
+    """The subset of `auction_ids` the user watches."""
+    if not auction_ids:
+        return set()
+    return set(session.execute(
+        select(watchlist.c.auction_id)
+        .where(watchlist.c.user_id == user_id, watchlist.c.auction_id.in_(auction_ids))
+    ).scalars())
+
+
+def watched_auctions(session, user_id):
+    return session.execute(
+        select(Auction)
+        .join(watchlist, watchlist.c.auction_id == Auction.id)
+        .where(watchlist.c.user_id == user_id)
+        .order_by(Auction.end_time)
+    ).scalars().all()